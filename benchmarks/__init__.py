@@ -0,0 +1,16 @@
+"""
+Standalone performance benchmarks. Run them from the repository root, e.g.
+`python -m benchmarks.query_result_storage`.
+"""
+import os
+import time
+
+# Benchmarks import redash modules directly, which require these to be set.
+os.environ.setdefault("REDASH_COOKIE_SECRET", "benchmark")
+os.environ.setdefault("REDASH_SECRET_KEY", "benchmark")
+
+
+def timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started
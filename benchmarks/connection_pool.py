@@ -0,0 +1,54 @@
+"""
+Compare running queries on new and pooled PostgreSQL connections.
+
+Runs the given number of small queries through the PostgreSQL query runner, first opening a new
+connection for each (like a forking worker does) and then reusing the connections of the query
+runner connection pool. Point REDASH_DATABASE_URL at the database to query.
+
+Usage: python -m benchmarks.connection_pool [--queries 1000] [--query "SELECT 1"]
+"""
+import argparse
+from unittest import mock
+from urllib.parse import urlparse
+
+from benchmarks import timed
+from redash import settings
+from redash.query_runner.connection_pool import connection_pool
+from redash.query_runner.pg import PostgreSQL
+
+
+def run_queries(runner, query, count):
+    for _ in range(count):
+        data, error = runner.run_query(query, None)
+        if error:
+            raise Exception(error)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--query", default="SELECT 1")
+    args = parser.parse_args()
+
+    url = urlparse(settings.SQLALCHEMY_DATABASE_URI)
+    runner = PostgreSQL(
+        {
+            "user": url.username or "",
+            "password": url.password or "",
+            "host": url.hostname or "localhost",
+            "port": url.port or 5432,
+            "dbname": url.path.lstrip("/"),
+        }
+    )
+
+    print("{:<10} {:>8} {:>10} {:>12}".format("mode", "queries", "seconds", "ms/query"))
+    for mode, enabled in (("new", False), ("pooled", True)):
+        with mock.patch.object(settings, "QUERY_RUNNER_POOL_ENABLED", enabled):
+            _, elapsed = timed(run_queries, runner, args.query, args.queries)
+        print("{:<10} {:>8} {:>10.3f} {:>12.3f}".format(mode, args.queries, elapsed, elapsed * 1000 / args.queries))
+
+    connection_pool.clear()
+
+
+if __name__ == "__main__":
+    main()
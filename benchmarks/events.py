@@ -0,0 +1,102 @@
+"""
+Compare recording events one by one with buffering them in Redis and flushing them in batches.
+
+"per event" records every event like the record_event job does: one ORM insert, one commit and
+one webhook request per event. "batched" appends the events to the Redis buffer and runs
+flush_events, which inserts EVENTS_FLUSH_BATCH_SIZE events per statement and posts them to the
+webhook --webhook-batch-size at a time (EVENT_REPORTING_WEBHOOKS_BATCH_SIZE). The webhook is a local HTTP server that
+only counts what it receives. RQ overhead of the per-event jobs is not included.
+
+The benchmark writes to the configured database and Redis (everything it creates is removed
+afterwards), so point REDASH_DATABASE_URL and REDASH_REDIS_URL at scratch instances.
+
+Usage: python -m benchmarks.events [--events 1000 10000] [--no-webhook] [--webhook-batch-size 100]
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from benchmarks import timed
+from redash import create_app, models, redis_connection, settings
+from redash.models import db
+from redash.tasks import general
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    received = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        data = body["data"]
+        WebhookHandler.received += len(data) if isinstance(data, list) else 1
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def raw_events(org, count):
+    now = int(time.time())
+    return [
+        {"org_id": org.id, "action": "view", "object_type": "dashboard", "object_id": i, "timestamp": now}
+        for i in range(count)
+    ]
+
+
+def per_event(events):
+    for event in events:
+        general.record_event(event)
+
+
+def batched(events):
+    for event in events:
+        general.buffer_event(event)
+    general.flush_events()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--no-webhook", action="store_true")
+    parser.add_argument("--webhook-batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    webhooks = []
+    if not args.no_webhook:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), WebhookHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        webhooks = ["http://127.0.0.1:{}/".format(server.server_port)]
+
+    app = create_app()
+    with app.app_context(), mock.patch.object(settings, "EVENT_REPORTING_WEBHOOKS", webhooks), mock.patch.object(
+        settings, "EVENT_REPORTING_WEBHOOKS_BATCH_SIZE", args.webhook_batch_size
+    ):
+        org = models.Organization(name="Events benchmark", slug="events-benchmark-{}".format(time.time()), settings={})
+        db.session.add(org)
+        db.session.commit()
+
+        try:
+            print("{:>9} {:<10} {:>10} {:>12} {:>10}".format("events", "mode", "seconds", "events/s", "forwarded"))
+            for count in args.events:
+                for mode, func in (("per event", per_event), ("batched", batched)):
+                    WebhookHandler.received = 0
+                    _, elapsed = timed(func, raw_events(org, count))
+                    print(
+                        "{:>9} {:<10} {:>10.3f} {:>12.0f} {:>10}".format(
+                            count, mode, elapsed, count / elapsed, WebhookHandler.received
+                        )
+                    )
+        finally:
+            redis_connection.delete(general.EVENTS_BUFFER_KEY)
+            models.Event.query.filter(models.Event.org_id == org.id).delete(synchronize_session=False)
+            db.session.delete(org)
+            db.session.commit()
+
+
+if __name__ == "__main__":
+    main()
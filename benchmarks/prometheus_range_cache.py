@@ -0,0 +1,116 @@
+"""
+Measure the bytes a dashboard refreshing a Prometheus range query downloads, with and without the cache.
+
+Runs a fake Prometheus HTTP API serving the given number of series, and refreshes a "last 6 hours"
+query (with the step Redash picks for it) once per simulated minute, first without and then with
+the range query cache.
+
+The benchmark writes to the configured Redis (the cache entries are removed afterwards), so point
+REDASH_REDIS_URL at a scratch instance.
+
+Usage: python -m benchmarks.prometheus_range_cache [--refreshes 30] [--series 50] [--hours 6]
+"""
+import argparse
+import contextlib
+import io
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks import timed
+from redash import redis_connection, settings
+from redash.query_runner.prometheus import Prometheus, parse_step
+from redash.utils import json_dumps
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+class FakePrometheus(ThreadingHTTPServer):
+    def __init__(self, series, seconds_per_point=0):
+        super().__init__(("127.0.0.1", 0), FakePrometheusHandler)
+        self.series = series
+        self.seconds_per_point = seconds_per_point
+        self.bytes_sent = 0
+        self.url = "http://127.0.0.1:{}".format(self.server_address[1])
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+class FakePrometheusHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        params = {name: values[0] for name, values in parse_qs(urlparse(self.path).query).items()}
+        start, end, step = float(params["start"]), float(params["end"]), parse_step(params["step"])
+        timestamps = [start + i * step for i in range(int((end - start) // step) + 1)]
+        # Stands in for the time Prometheus spends evaluating the query, which grows with the range.
+        time.sleep(len(timestamps) * self.server.seconds_per_point)
+        result = [
+            {
+                "metric": {"__name__": "http_requests_total", "instance": "host-{}".format(i)},
+                "values": [[t, str(round(t * i % 1000, 3))] for t in timestamps],
+            }
+            for i in range(self.server.series)
+        ]
+        body = json_dumps({"status": "success", "data": {"resultType": "matrix", "result": result}}).encode()
+        self.server.bytes_sent += len(body)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def refresh(prometheus, server, end, hours):
+    start = end - hours * 3600
+    query = "query=http_requests_total&start={}&end={}".format(
+        datetime.fromtimestamp(start, timezone.utc).strftime(TIME_FORMAT),
+        datetime.fromtimestamp(end, timezone.utc).strftime(TIME_FORMAT),
+    )
+    sent = server.bytes_sent
+    # The runner prints its payloads.
+    with contextlib.redirect_stdout(io.StringIO()):
+        (data, error), elapsed = timed(prometheus.run_query, query, None)
+    if error:
+        raise Exception(error)
+    return server.bytes_sent - sent, len(data["rows"]), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--refreshes", type=int, default=30)
+    parser.add_argument("--series", type=int, default=50)
+    parser.add_argument("--hours", type=int, default=6)
+    args = parser.parse_args()
+
+    server = FakePrometheus(args.series)
+    prometheus = Prometheus({"url": server.url})
+    first_end = int(time.time()) - args.refreshes * 60
+
+    print("{:<10} {:>10} {:>14} {:>14} {:>10}".format("cache", "rows", "first KB", "refresh KB", "refresh ms"))
+    try:
+        for enabled in (False, True):
+            with mock.patch.object(settings, "PROMETHEUS_RANGE_CACHE_ENABLED", enabled):
+                first, rows, _ = refresh(prometheus, server, first_end, args.hours)
+                results = [
+                    refresh(prometheus, server, first_end + i * 60, args.hours) for i in range(1, args.refreshes)
+                ]
+            refreshed = sum(sent for sent, _, _ in results) / len(results)
+            elapsed = sum(elapsed for _, _, elapsed in results) / len(results)
+            print(
+                "{:<10} {:>10} {:>14.1f} {:>14.1f} {:>10.1f}".format(
+                    "on" if enabled else "off", rows, first / 1024, refreshed / 1024, elapsed * 1000
+                )
+            )
+    finally:
+        for key in redis_connection.scan_iter("prometheus:range:*"):
+            redis_connection.delete(key)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compare fetching a long Prometheus range query at once and in parallel shards.
+
+Runs a fake Prometheus HTTP API serving the given number of series, which takes a fixed time per
+returned point to answer (like Prometheus evaluating a query over a long range), and runs a
+"last 30 days" query once without sharding and then split into one-day shards fetched with each of
+the given concurrencies.
+
+Usage: python -m benchmarks.prometheus_sharding [--days 30] [--step 5m] [--series 20] [--seconds-per-point 0.001]
+       [--concurrency 1 4 8]
+"""
+import argparse
+import contextlib
+import io
+import time
+from datetime import datetime, timezone
+from unittest import mock
+
+from benchmarks import timed
+from benchmarks.prometheus_range_cache import TIME_FORMAT, FakePrometheus
+from redash import settings
+from redash.query_runner.prometheus import Prometheus
+
+
+def run_query(prometheus, start, end, step):
+    query = "query=http_requests_total&start={}&end={}&step={}".format(
+        datetime.fromtimestamp(start, timezone.utc).strftime(TIME_FORMAT),
+        datetime.fromtimestamp(end, timezone.utc).strftime(TIME_FORMAT),
+        step,
+    )
+    # The runner prints its payloads.
+    with contextlib.redirect_stdout(io.StringIO()):
+        (data, error), elapsed = timed(prometheus.run_query, query, None)
+    if error:
+        raise Exception(error)
+    return data, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--step", default="5m")
+    parser.add_argument("--series", type=int, default=20)
+    parser.add_argument("--seconds-per-point", type=float, default=0.001)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    args = parser.parse_args()
+
+    server = FakePrometheus(args.series, args.seconds_per_point)
+    prometheus = Prometheus({"url": server.url})
+    end = int(time.time()) // 3600 * 3600
+    start = end - args.days * 86400
+
+    modes = [("whole", 0, 1)] + [("sharded", 86400, concurrency) for concurrency in args.concurrency]
+    expected = None
+    print("{:<10} {:>12} {:>10} {:>10}".format("mode", "concurrency", "rows", "seconds"))
+    try:
+        for name, shard_size, concurrency in modes:
+            with mock.patch.object(settings, "PROMETHEUS_RANGE_CACHE_ENABLED", False), mock.patch.object(
+                settings, "PROMETHEUS_RANGE_SHARD_SIZE", shard_size
+            ), mock.patch.object(settings, "PROMETHEUS_RANGE_SHARD_CONCURRENCY", concurrency):
+                data, elapsed = run_query(prometheus, start, end, args.step)
+            expected = expected or data
+            if data != expected:
+                raise Exception("Sharded results differ from the unsharded ones")
+            print("{:<10} {:>12} {:>10} {:>10.2f}".format(name, concurrency, len(data["rows"]), elapsed))
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Compare the JSON and columnar storage formats for QueryResult.data.
+
+Usage: python -m benchmarks.query_result_storage [--rows 10000 1000000]
+"""
+import argparse
+import datetime
+import random
+
+from benchmarks import timed
+from redash.models.persistence import deserialize_query_result_data
+from redash.utils import columnar, json_dumps
+
+
+def synthetic_result(row_count, seed=0):
+    rng = random.Random(seed)
+    start = datetime.datetime(2024, 1, 1)
+    columns = [
+        {"name": "id", "friendly_name": "id", "type": "integer"},
+        {"name": "value", "friendly_name": "value", "type": "float"},
+        {"name": "flag", "friendly_name": "flag", "type": "boolean"},
+        {"name": "category", "friendly_name": "category", "type": "string"},
+        {"name": "created_at", "friendly_name": "created_at", "type": "datetime"},
+    ]
+    rows = [
+        {
+            "id": i,
+            "value": rng.random() * 1000 if i % 50 else None,
+            "flag": i % 3 == 0,
+            "category": "category-{}".format(rng.randint(0, 100)),
+            "created_at": (start + datetime.timedelta(seconds=i)).isoformat(),
+        }
+        for i in range(row_count)
+    ]
+    return {"columns": columns, "rows": rows}
+
+
+def run(row_count):
+    data = synthetic_result(row_count)
+    results = []
+    for name, encode in (("json", json_dumps), ("columnar", columnar.encode)):
+        encoded, encode_time = timed(encode, data)
+        _, decode_time = timed(deserialize_query_result_data, encoded)
+        results.append((name, len(encoded), encode_time, decode_time))
+
+    if columnar.is_columnar(encoded):
+        result = columnar.ColumnarResult(encoded)
+        _, column_time = timed(result.column, "value")
+        results.append(("columnar (1 col)", None, None, column_time))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 1000000])
+    args = parser.parse_args()
+
+    print("{:>9} {:<17} {:>12} {:>10} {:>10}".format("rows", "format", "bytes", "encode s", "decode s"))
+    for row_count in args.rows:
+        for name, size, encode_time, decode_time in run(row_count):
+            print(
+                "{:>9} {:<17} {:>12} {:>10} {:>10.3f}".format(
+                    row_count,
+                    name,
+                    size if size is not None else "-",
+                    "{:.3f}".format(encode_time) if encode_time is not None else "-",
+                    decode_time,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
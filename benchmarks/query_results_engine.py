@@ -0,0 +1,58 @@
+"""
+Compare the SQLite and DuckDB engines of the Query Results data source.
+
+Joins two cached results of the given size on their id column, first with empty table
+caches ("cold") and then again reusing the tables loaded by the first run ("warm").
+
+Usage: python -m benchmarks.query_results_engine [--rows 10000 100000] [--engines sqlite duckdb]
+"""
+import argparse
+from types import SimpleNamespace
+from unittest import mock
+
+from benchmarks import timed
+from benchmarks.query_result_storage import synthetic_result
+from redash.query_runner import query_results
+
+QUERY = "SELECT a.id, a.value, b.category FROM cached_query_1 a JOIN cached_query_2 b ON a.id = b.id"
+
+
+def run(engine, row_count):
+    queries = {
+        query_id: SimpleNamespace(
+            id=query_id,
+            latest_query_data_id=query_id,
+            latest_query_data=SimpleNamespace(data=synthetic_result(row_count, seed=query_id)),
+        )
+        for query_id in (1, 2)
+    }
+    runner = query_results.Results({"engine": engine})
+    query_results.table_cache.clear()
+
+    timings = []
+    with mock.patch.object(query_results, "_load_query", lambda user, query_id: queries[query_id]):
+        for _ in ("cold", "warm"):
+            (data, error), elapsed = timed(runner.run_query, QUERY, None)
+            if error:
+                raise RuntimeError(error)
+            timings.append(elapsed)
+
+    query_results.table_cache.clear()
+    return len(data["rows"]), timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--engines", nargs="+", default=[query_results.ENGINE_SQLITE, query_results.ENGINE_DUCKDB])
+    args = parser.parse_args()
+
+    print("{:>9} {:<8} {:>9} {:>10} {:>10}".format("rows", "engine", "output", "cold s", "warm s"))
+    for row_count in args.rows:
+        for engine in args.engines:
+            output_rows, (cold, warm) = run(engine, row_count)
+            print("{:>9} {:<8} {:>9} {:>10.3f} {:>10.3f}".format(row_count, engine, output_rows, cold, warm))
+
+
+if __name__ == "__main__":
+    main()
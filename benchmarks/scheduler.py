@@ -0,0 +1,113 @@
+"""
+Measure Query.outdated_queries with a large number of scheduled queries.
+
+Creates a throwaway organization with the given number of scheduled queries whose last
+executions are spread over their intervals, so only a small fraction is due on any tick. The
+first tick rebuilds the due-time index and evaluates every schedule, like a full scan does; the
+following ticks only evaluate the queries that are due.
+
+The benchmark writes to the configured database and Redis (everything it creates is removed
+afterwards), so point REDASH_DATABASE_URL and REDASH_REDIS_URL at scratch instances.
+
+Usage: python -m benchmarks.scheduler [--schedules 100000] [--ticks 5]
+"""
+import argparse
+import random
+import time
+
+from benchmarks import timed
+from redash import create_app, models, redis_connection
+from redash.models import db
+
+INTERVALS = [60, 300, 600, 900, 1800, 3600, 3600 * 12, 86400]
+
+
+def create_schedules(count, seed=0):
+    rnd = random.Random(seed)
+    org = models.Organization(
+        name="Scheduler benchmark", slug="scheduler-benchmark-{}".format(time.time()), settings={}
+    )
+    group = models.Group(name="default", permissions=models.Group.DEFAULT_PERMISSIONS, org=org)
+    user = models.User(org=org, name="Scheduler benchmark", email="scheduler-benchmark@example.com", group_ids=[])
+    data_source = models.DataSource(org=org, name="Scheduler benchmark", type="pg", options={})
+    db.session.add_all([org, group, user, data_source])
+    db.session.commit()
+
+    schedules = []
+    for i in range(count):
+        interval = rnd.choice(INTERVALS)
+        schedules.append(
+            {
+                "org_id": org.id,
+                "user_id": user.id,
+                "data_source_id": data_source.id,
+                "name": "Query {}".format(i),
+                "query_text": "SELECT {}".format(i),
+                "query_hash": "hash{}".format(i),
+                "schedule": {"interval": str(interval), "time": None, "day_of_week": None, "until": None},
+                "schedule_failures": 0,
+                "is_archived": False,
+                "is_draft": False,
+                "options": {},
+                "version": 1,
+                "api_key": "key{}".format(i),
+            }
+        )
+    db.session.bulk_insert_mappings(models.Query, schedules)
+    db.session.commit()
+
+    # Spread last executions over a little more than one interval, so about 2% are due.
+    now = time.time()
+    query_ids = [query_id for (query_id,) in db.session.query(models.Query.id).filter(models.Query.org_id == org.id)]
+    executions = {}
+    for query_id, schedule in zip(query_ids, schedules):
+        interval = int(schedule["schedule"]["interval"])
+        executions[query_id] = now - rnd.uniform(0, interval * 1.02)
+    redis_connection.hset(models.scheduled_queries_executions.KEY_NAME, mapping=executions)
+
+    return org, query_ids
+
+
+def cleanup(org, query_ids):
+    redis_connection.delete(models.scheduled_queries_index.KEY_NAME, models.scheduled_queries_index.REBUILT_KEY_NAME)
+    if query_ids:
+        redis_connection.hdel(models.scheduled_queries_executions.KEY_NAME, *query_ids)
+
+    for model in (models.Query, models.DataSourceGroup, models.DataSource, models.User, models.Group):
+        if model is models.DataSourceGroup:
+            data_source_ids = db.session.query(models.DataSource.id).filter(models.DataSource.org_id == org.id)
+            model.query.filter(model.data_source_id.in_(data_source_ids)).delete(synchronize_session=False)
+        else:
+            model.query.filter(model.org_id == org.id).delete(synchronize_session=False)
+    db.session.delete(org)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--schedules", type=int, default=100000)
+    parser.add_argument("--ticks", type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        (org, query_ids), elapsed = timed(create_schedules, args.schedules)
+        print("created {} schedules in {:.1f}s".format(len(query_ids), elapsed))
+
+        try:
+            redis_connection.delete(models.scheduled_queries_index.REBUILT_KEY_NAME)
+            print("{:<24} {:>9} {:>10}".format("tick", "outdated", "seconds"))
+            for tick in range(args.ticks + 1):
+                outdated, elapsed = timed(models.Query.outdated_queries)
+                db.session.rollback()
+                label = "full scan (rebuild)" if tick == 0 else "indexed #{}".format(tick)
+                print("{:<24} {:>9} {:>10.3f}".format(label, len(outdated), elapsed))
+                # The executions of outdated queries start and mark them in the index.
+                for query in outdated:
+                    models.scheduled_queries_executions.update(query.id)
+        finally:
+            cleanup(org, query_ids)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Compare full and incremental schema refreshes of a PostgreSQL data source.
+
+Creates the given number of database schemas with tables in the configured database and refreshes
+the schema of a data source pointing at it: "full" re-reads and rewrites every table like before,
+"unchanged" only compares the schema fingerprints, and "one changed" re-reads the tables of the
+schema where a column was added.
+
+The benchmark writes to the configured database and Redis (everything it creates is removed
+afterwards), so point REDASH_DATABASE_URL and REDASH_REDIS_URL at scratch instances.
+
+Usage: python -m benchmarks.schema_refresh [--schemas 50] [--tables 40] [--columns 100]
+"""
+import argparse
+import time
+from unittest import mock
+from urllib.parse import urlparse
+
+from benchmarks import timed
+from redash import create_app, models, settings
+from redash.models import db
+from redash.query_runner import NotSupported
+from redash.query_runner.pg import PostgreSQL
+from redash.utils.configuration import ConfigurationContainer
+
+SCHEMA_PREFIX = "schema_benchmark_"
+
+
+def run(sql):
+    with db.engine.connect() as connection:
+        connection.execution_options(autocommit=True).execute(sql)
+
+
+def create_schemas(schemas, tables, columns):
+    columns_sql = ", ".join("col_{} integer".format(i) for i in range(columns))
+    for s in range(schemas):
+        statements = ["CREATE SCHEMA {}{}".format(SCHEMA_PREFIX, s)]
+        statements += [
+            "CREATE TABLE {}{}.table_{} ({})".format(SCHEMA_PREFIX, s, t, columns_sql) for t in range(tables)
+        ]
+        run(";\n".join(statements))
+
+
+def drop_schemas(schemas):
+    run(";\n".join("DROP SCHEMA IF EXISTS {}{} CASCADE".format(SCHEMA_PREFIX, s) for s in range(schemas)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--schemas", type=int, default=50)
+    parser.add_argument("--tables", type=int, default=40)
+    parser.add_argument("--columns", type=int, default=100)
+    args = parser.parse_args()
+
+    url = urlparse(settings.SQLALCHEMY_DATABASE_URI)
+    options = {
+        "user": url.username or "",
+        "password": url.password or "",
+        "host": url.hostname or "localhost",
+        "port": url.port or 5432,
+        "dbname": url.path.lstrip("/"),
+    }
+
+    app = create_app()
+    with app.app_context():
+        org = models.Organization(name="Schema benchmark", slug="schema-benchmark-{}".format(time.time()), settings={})
+        data_source = models.DataSource(
+            org=org,
+            name="Schema benchmark",
+            type="pg",
+            options=ConfigurationContainer(options, PostgreSQL.configuration_schema()),
+        )
+        db.session.add_all([org, data_source])
+        db.session.commit()
+
+        try:
+            _, elapsed = timed(create_schemas, args.schemas, args.tables, args.columns)
+            total = args.schemas * args.tables * args.columns
+            print("created {} columns in {:.1f}s".format(total, elapsed))
+
+            print("{:<12} {:>8} {:>10}".format("refresh", "tables", "seconds"))
+            with mock.patch.object(PostgreSQL, "get_schema_fingerprints", side_effect=NotSupported):
+                schema, elapsed = timed(data_source.get_schema, refresh=True)
+            print("{:<12} {:>8} {:>10.3f}".format("full", len(schema), elapsed))
+
+            # The first incremental refresh reads everything, to record the fingerprints.
+            data_source.get_schema(refresh=True)
+            schema, elapsed = timed(data_source.get_schema, refresh=True)
+            print("{:<12} {:>8} {:>10.3f}".format("unchanged", len(schema), elapsed))
+
+            run("ALTER TABLE {}0.table_0 ADD COLUMN added integer".format(SCHEMA_PREFIX))
+            schema, elapsed = timed(data_source.get_schema, refresh=True)
+            print("{:<12} {:>8} {:>10.3f}".format("one changed", len(schema), elapsed))
+        finally:
+            drop_schemas(args.schemas)
+            models.schema_cache.delete(data_source.id)
+            db.session.delete(data_source)
+            db.session.delete(org)
+            db.session.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Time BaseSQLQueryRunner.apply_auto_limit on generated 1 KB and 100 KB queries.
+
+For each size, a single statement and a commented multi-statement text are timed three ways:
+parsing everything like before ("parsed"), with the single-statement fast path but no
+memoization ("uncached") and with a warm memoization cache ("cached").
+
+Usage: python -m benchmarks.sql_auto_limit [--sizes 1024 102400] [--repeat 20]
+"""
+import argparse
+import re
+from unittest import mock
+
+from benchmarks import timed
+from redash import query_runner
+from redash.query_runner import BaseSQLQueryRunner
+
+
+def generate_query(size, multi_statement):
+    columns = []
+    while sum(len(column) + 2 for column in columns) < size:
+        columns.append("CASE WHEN t.col_{0} > {0} THEN t.col_{0} ELSE NULL END AS c{0}".format(len(columns)))
+    select = "SELECT\n  " + ",\n  ".join(columns) + "\nFROM events t\nWHERE t.created_at > now() - interval '1 day'"
+    if multi_statement:
+        return "-- daily report\nSET search_path TO analytics;\n" + select + ";\n-- end of report\n"
+    return select
+
+
+def run(runner, query, repeat):
+    _, elapsed = timed(lambda: [runner.apply_auto_limit(query, True) for _ in range(repeat)])
+    return elapsed / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024, 100 * 1024])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    runner = BaseSQLQueryRunner({})
+    print("{:>9} {:<10} {:>11} {:>11} {:>11}".format("bytes", "statements", "parsed ms", "uncached ms", "cached ms"))
+    for size in args.sizes:
+        for multi_statement in (False, True):
+            query = generate_query(size, multi_statement)
+            uncached = mock.patch.object(query_runner, "apply_auto_limit", query_runner.apply_auto_limit.__wrapped__)
+
+            with uncached, mock.patch.object(query_runner, "STATEMENT_SEPARATORS_REGEX", re.compile("")):
+                parsed = run(runner, query, args.repeat)
+            with uncached:
+                no_cache = run(runner, query, args.repeat)
+            query_runner.apply_auto_limit.cache_clear()
+            runner.apply_auto_limit(query, True)
+            cached = run(runner, query, args.repeat)
+
+            print(
+                "{:>9} {:<10} {:>11.3f} {:>11.3f} {:>11.3f}".format(
+                    len(query), "multiple" if multi_statement else "single", parsed, no_cache, cached
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Compare the throughput and memory of forking and threaded workers running I/O bound queries.
+
+Enqueues the given number of queries that wait on the database (SELECT pg_sleep(...)) for a
+PostgreSQL data source pointing at the configured database. They are run by as many forking
+workers as the concurrency (each forking a work horse per job, like `rq worker` does), and then by
+a single threaded worker (`rq worker --threads`) running that many jobs at the same time. Memory
+is the peak proportional set size (PSS, which splits the pages shared after a fork between the
+processes sharing them) of all the worker processes and their work horses, so it needs Linux.
+
+The benchmark writes to the configured database and Redis (everything it creates is removed
+afterwards), so point REDASH_DATABASE_URL and REDASH_REDIS_URL at scratch instances.
+
+Usage: python -m benchmarks.threaded_worker [--queries 200] [--concurrency 8] [--sleep 0.1]
+"""
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+from rq import Connection
+
+from redash import create_app, models, rq_redis_connection, settings
+from redash.models import db
+from redash.query_runner.pg import PostgreSQL
+from redash.tasks.queries.execution import enqueue_query
+from redash.tasks.worker import ThreadedWorker, Worker
+from redash.utils.configuration import ConfigurationContainer
+
+
+def pss(pid):
+    try:
+        with open("/proc/{}/smaps_rollup".format(pid)) as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def descendants(pid):
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open("/proc/{}/stat".format(entry)) as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+
+    pids, pending = [], [pid]
+    while pending:
+        for child in children.get(pending.pop(), []):
+            pids.append(child)
+            pending.append(child)
+    return pids
+
+
+class MemorySampler(threading.Thread):
+    """Samples the total PSS of the processes started by this one, keeping the peak."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = 0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(0.05):
+            self.peak = max(self.peak, sum(pss(pid) for pid in descendants(os.getpid())))
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        return self.peak
+
+
+def run_worker(app, worker_class, **kwargs):
+    with app.app_context(), Connection(rq_redis_connection):
+        worker = worker_class(["queries"], log_job_description=False, job_monitoring_interval=1, **kwargs)
+        worker.work(burst=True, logging_level="WARNING")
+
+
+def run_workers(app, data_source, queries, sleep, processes, worker_class, **kwargs):
+    with Connection(rq_redis_connection):
+        for i in range(queries):
+            enqueue_query("SELECT pg_sleep({}), {}".format(sleep, i), data_source, None, metadata={})
+    # The workers open their own database connections.
+    db.session.remove()
+    db.engine.dispose()
+
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=run_worker, args=(app, worker_class), kwargs=kwargs) for _ in range(processes)]
+    sampler = MemorySampler()
+    sampler.start()
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    return elapsed, sampler.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--sleep", type=float, default=0.1)
+    args = parser.parse_args()
+
+    url = urlparse(settings.SQLALCHEMY_DATABASE_URI)
+    options = {
+        "user": url.username or "",
+        "password": url.password or "",
+        "host": url.hostname or "localhost",
+        "port": url.port or 5432,
+        "dbname": url.path.lstrip("/"),
+    }
+
+    app = create_app()
+    with app.app_context():
+        org = models.Organization(name="Worker benchmark", slug="worker-benchmark-{}".format(time.time()), settings={})
+        data_source = models.DataSource(
+            org=org,
+            name="Worker benchmark",
+            type="pg",
+            options=ConfigurationContainer(options, PostgreSQL.configuration_schema()),
+        )
+        db.session.add_all([org, data_source])
+        db.session.commit()
+
+        try:
+            print(
+                "{:<10} {:>9} {:>8} {:>10} {:>12} {:>10}".format(
+                    "worker", "processes", "queries", "seconds", "queries/s", "PSS MB"
+                )
+            )
+            modes = [
+                ("forking", args.concurrency, Worker, {}),
+                ("threaded", 1, ThreadedWorker, {"concurrency": args.concurrency}),
+            ]
+            for name, processes, worker_class, kwargs in modes:
+                elapsed, memory = run_workers(
+                    app, data_source, args.queries, args.sleep, processes, worker_class, **kwargs
+                )
+                stored = models.QueryResult.query.filter_by(data_source_id=data_source.id).count()
+                models.QueryResult.query.filter_by(data_source_id=data_source.id).delete()
+                db.session.commit()
+                print(
+                    "{:<10} {:>9} {:>8} {:>10.2f} {:>12.1f} {:>10.1f}".format(
+                        name, processes, stored, elapsed, stored / elapsed, memory / 1024 / 1024
+                    )
+                )
+        finally:
+            models.QueryResult.query.filter_by(data_source_id=data_source.id).delete()
+            db.session.delete(data_source)
+            db.session.delete(org)
+            db.session.commit()
+
+
+if __name__ == "__main__":
+    main()
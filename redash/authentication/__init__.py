@@ -7,6 +7,8 @@ from urllib.parse import urlsplit, urlunsplit
 
 from flask import jsonify, redirect, request, session, url_for
 from flask_login import LoginManager, login_user, logout_user, user_logged_in
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
 from sqlalchemy.orm.exc import NoResultFound
 from werkzeug.exceptions import Unauthorized
 
@@ -14,11 +16,16 @@ from redash import models, settings
 from redash.authentication import jwt_auth
 from redash.authentication.org_resolving import current_org
 from redash.settings.organization import settings as org_settings
-from redash.tasks import record_event
+from redash.tasks import buffer_event
 
 login_manager = LoginManager()
 logger = logging.getLogger("authentication")
 
+# Columns of users and API keys kept in the principal cache. The others (like password_hash) are
+# loaded from the database if they are ever accessed.
+CACHED_USER_COLUMNS = ("id", "org_id", "name", "email", "group_ids", "api_key", "disabled_at", "details")
+CACHED_API_KEY_COLUMNS = ("id", "org_id", "api_key", "active", "object_type", "object_id", "created_by_id")
+
 
 def get_login_url(external=False, next="/"):
     if settings.MULTI_ORG and current_org == None:  # noqa: E711
@@ -91,46 +98,105 @@ def hmac_load_user_from_request(request):
                 return user
 
         if query_id:
-            query = models.Query.query.filter(models.Query.id == query_id).one()
-            calculated_signature = sign(query.api_key, request.path, expires)
-
-            if query.api_key and signature == calculated_signature:
-                return models.ApiUser(
-                    query.api_key,
-                    query.org,
-                    list(query.groups.keys()),
-                    name="ApiKey: Query {}".format(query.id),
-                )
+            org = current_org._get_current_object()
+            field = models.principal_cache.query_field(query_id)
+            principal = models.principal_cache.get(org and org.id, field)
+            if principal is None:
+                query = models.Query.query.filter(models.Query.id == query_id).one()
+                principal = cache_query_principal(query)
+                if org and query.org_id == org.id:
+                    models.principal_cache.set(org.id, field, principal)
+                else:
+                    org = query.org
+
+            calculated_signature = sign(principal["api_key"], request.path, expires)
+
+            if principal["api_key"] and signature == calculated_signature:
+                return load_cached_principal(principal, org)
 
     return None
 
 
+def cache_query_principal(query):
+    return {
+        "type": "query",
+        "query_id": query.id,
+        "api_key": query.api_key,
+        "groups": list(query.groups.keys()),
+    }
+
+
+def cached_columns(instance, columns):
+    return {column: getattr(instance, column) for column in columns}
+
+
+def load_cached_instance(model, columns):
+    """
+    Returns a model instance attached to the current session from cached column values, without
+    querying the database. Other columns are loaded when they are accessed.
+    """
+    instance = model(**columns)
+    make_transient_to_detached(instance)
+    existing = models.db.session.identity_map.get(inspect(instance).key)
+    if existing is not None:
+        return existing
+
+    models.db.session.add(instance)
+    return instance
+
+
+def load_cached_principal(principal, org):
+    if principal["type"] == "user":
+        return load_cached_instance(models.User, principal["columns"])
+
+    if principal["type"] == "api_key":
+        api_key = load_cached_instance(models.ApiKey, principal["columns"])
+        return models.ApiUser(api_key, org, [])
+
+    return models.ApiUser(
+        principal["api_key"],
+        org,
+        principal["groups"],
+        name="ApiKey: Query {}".format(principal["query_id"]),
+    )
+
+
 def get_user_from_api_key(api_key, query_id):
     if not api_key:
         return None
 
     user = None
+    principal = None
 
-    # TODO: once we switch all api key storage into the ApiKey model, this code will be much simplified
     org = current_org._get_current_object()
+    field = models.principal_cache.api_key_field(api_key)
+    cached = models.principal_cache.get(org and org.id, field)
+    # Query API keys are only valid for their own query.
+    if cached is not None and (cached["type"] != "query" or str(cached["query_id"]) == str(query_id)):
+        return load_cached_principal(cached, org)
+
+    # TODO: once we switch all api key storage into the ApiKey model, this code will be much simplified
     try:
         user = models.User.get_by_api_key_and_org(api_key, org)
         if user.is_disabled:
             user = None
+        else:
+            principal = {"type": "user", "columns": cached_columns(user, CACHED_USER_COLUMNS)}
     except models.NoResultFound:
         try:
             api_key = models.ApiKey.get_by_api_key(api_key)
             user = models.ApiUser(api_key, api_key.org, [])
+            if org and api_key.org_id == org.id:
+                principal = {"type": "api_key", "columns": cached_columns(api_key, CACHED_API_KEY_COLUMNS)}
         except models.NoResultFound:
             if query_id:
                 query = models.Query.get_by_id_and_org(query_id, org)
                 if query and query.api_key == api_key:
-                    user = models.ApiUser(
-                        api_key,
-                        query.org,
-                        list(query.groups.keys()),
-                        name="ApiKey: Query {}".format(query.id),
-                    )
+                    principal = cache_query_principal(query)
+                    user = load_cached_principal(principal, query.org)
+
+    if principal is not None and org:
+        models.principal_cache.set(org.id, field, principal)
 
     return user
 
@@ -210,7 +276,7 @@ def log_user_logged_in(app, user):
         "ip": request.remote_addr,
     }
 
-    record_event.delay(event)
+    buffer_event(event)
 
 
 @login_manager.unauthorized_handler
@@ -2,7 +2,7 @@ import datetime
 import socket
 from itertools import chain
 
-from click import argument
+from click import argument, option
 from flask.cli import AppGroup
 from rq import Connection
 from rq.worker import WorkerStatus
@@ -16,7 +16,7 @@ from redash.tasks import (
     rq_scheduler,
     schedule_periodic_jobs,
 )
-from redash.tasks.worker import Worker
+from redash.tasks.worker import ThreadedWorker, Worker
 from redash.worker import default_queues
 
 manager = AppGroup(help="RQ management commands.")
@@ -31,7 +31,15 @@ def scheduler():
 
 @manager.command()
 @argument("queues", nargs=-1)
-def worker(queues):
+@option(
+    "--threads",
+    type=int,
+    default=0,
+    help="Run this many jobs at the same time in threads of the worker process, instead of forking "
+    "a process per job (for I/O bound queues, like the query queues). Keep it below the database "
+    "connection pool size (SQLALCHEMY_POOL_SIZE + SQLALCHEMY_MAX_OVERFLOW).",
+)
+def worker(queues, threads=0):
     # Configure any SQLAlchemy mappers loaded until now so that the mapping configuration
     # will already be available to the forked work horses and they won't need
     # to spend valuable time re-doing that on every fork.
@@ -43,7 +51,10 @@ def worker(queues):
         queues = chain(*[queue.split(",") for queue in queues])
 
     with Connection(rq_redis_connection):
-        w = Worker(queues, log_job_description=False, job_monitoring_interval=5)
+        if threads:
+            w = ThreadedWorker(queues, concurrency=threads, log_job_description=False, job_monitoring_interval=5)
+        else:
+            w = Worker(queues, log_job_description=False, job_monitoring_interval=5)
         w.work()
 
 
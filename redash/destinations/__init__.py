@@ -1,5 +1,10 @@
 import logging
 
+import requests
+from requests.adapters import HTTPAdapter
+
+from redash import settings
+
 logger = logging.getLogger(__name__)
 
 __all__ = ["BaseDestination", "register", "get_destination", "import_destinations"]
@@ -47,6 +52,12 @@ class BaseDestination:
 
 destinations = {}
 
+# Shared by the HTTP destinations, so notifications sent concurrently reuse connections to the
+# same hosts instead of opening one per request.
+http_session = requests.Session()
+http_session.mount("http://", HTTPAdapter(pool_maxsize=settings.ALERTS_NOTIFICATION_CONCURRENCY))
+http_session.mount("https://", HTTPAdapter(pool_maxsize=settings.ALERTS_NOTIFICATION_CONCURRENCY))
+
 
 def register(destination_class):
     global destinations
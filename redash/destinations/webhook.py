@@ -1,9 +1,8 @@
 import logging
 
-import requests
 from requests.auth import HTTPBasicAuth
 
-from redash.destinations import BaseDestination, register
+from redash.destinations import BaseDestination, http_session, register
 from redash.serializers import serialize_alert
 from redash.utils import json_dumps
 
@@ -40,7 +39,7 @@ class Webhook(BaseDestination):
 
             headers = {"Content-Type": "application/json"}
             auth = HTTPBasicAuth(options.get("username"), options.get("password")) if options.get("username") else None
-            resp = requests.post(
+            resp = http_session.post(
                 options.get("url"),
                 data=json_dumps(data),
                 auth=auth,
@@ -51,6 +50,11 @@ class Webhook(BaseDestination):
                 logging.error("webhook send ERROR. status_code => {status}".format(status=resp.status_code))
         except Exception:
             logging.exception("webhook send ERROR.")
+            raise
+
+        # Server errors and rate limiting are worth retrying, unlike rejected requests.
+        if resp.status_code >= 500 or resp.status_code == 429:
+            resp.raise_for_status()
 
 
 register(Webhook)
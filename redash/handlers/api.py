@@ -25,7 +25,9 @@ from redash.handlers.data_sources import (
     DataSourceListResource,
     DataSourcePauseResource,
     DataSourceResource,
+    DataSourceSchemaColumnsResource,
     DataSourceSchemaResource,
+    DataSourceSchemaTablesResource,
     DataSourceTestResource,
     DataSourceTypeListResource,
 )
@@ -70,7 +72,9 @@ from redash.handlers.queries import (
     QueryTagsResource,
 )
 from redash.handlers.query_results import (
+    DashboardQueryResultsResource,
     JobResource,
+    JobStatusStreamResource,
     QueryDropdownsResource,
     QueryResultDropdownResource,
     QueryResultListResource,
@@ -147,6 +151,16 @@ api.add_org_resource(
 api.add_org_resource(DataSourceTypeListResource, "/api/data_sources/types", endpoint="data_source_types")
 api.add_org_resource(DataSourceListResource, "/api/data_sources", endpoint="data_sources")
 api.add_org_resource(DataSourceSchemaResource, "/api/data_sources/<data_source_id>/schema")
+api.add_org_resource(
+    DataSourceSchemaTablesResource,
+    "/api/data_sources/<data_source_id>/schema/tables",
+    endpoint="data_source_schema_tables",
+)
+api.add_org_resource(
+    DataSourceSchemaColumnsResource,
+    "/api/data_sources/<data_source_id>/schema/columns",
+    endpoint="data_source_schema_columns",
+)
 api.add_org_resource(DatabricksDatabaseListResource, "/api/databricks/databases/<data_source_id>")
 api.add_org_resource(
     DatabricksSchemaResource,
@@ -245,6 +259,12 @@ api.add_org_resource(
     "/api/queries/<query_id>/results/<query_result_id>.<filetype>",
     endpoint="query_result",
 )
+api.add_org_resource(
+    DashboardQueryResultsResource,
+    "/api/dashboards/<dashboard_id>/results",
+    endpoint="dashboard_query_results",
+)
+api.add_org_resource(JobStatusStreamResource, "/api/jobs/stream", endpoint="job_status_stream")
 api.add_org_resource(
     JobResource,
     "/api/jobs/<job_id>",
@@ -11,7 +11,7 @@ from sqlalchemy.orm.exc import NoResultFound
 from redash import settings
 from redash.authentication import current_org
 from redash.models import db
-from redash.tasks import record_event as record_event_task
+from redash.tasks import buffer_event
 from redash.utils import json_dumps
 from redash.utils.query_order import sort_query
 
@@ -58,7 +58,7 @@ def record_event(org, user, options):
     if "timestamp" not in options:
         options["timestamp"] = int(time.time())
 
-    record_event_task.delay(options)
+    buffer_event(options)
 
 
 def require_fields(req, fields):
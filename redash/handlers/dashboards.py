@@ -1,4 +1,4 @@
-from flask import request, url_for
+from flask import current_app, request, url_for
 from flask_restful import abort
 from funcy import partial, project
 from sqlalchemy.orm.exc import StaleDataError
@@ -19,6 +19,7 @@ from redash.permissions import (
 )
 from redash.security import csp_allows_embeding
 from redash.serializers import DashboardSerializer, public_dashboard
+from redash.utils import json_dumps
 
 # Ordering map for relationships
 order_map = {
@@ -289,6 +290,12 @@ class PublicDashboardResource(BaseResource):
         else:
             dashboard = self.current_user.object
 
+        if models.public_dashboard_cache.enabled:
+            response = models.public_dashboard_cache.get_or_set_response(
+                dashboard, lambda: json_dumps(public_dashboard(dashboard))
+            )
+            return current_app.response_class(response, mimetype="application/json")
+
         return public_dashboard(dashboard)
 
 
@@ -184,6 +184,60 @@ class DataSourceSchemaResource(BaseResource):
         return serialize_job(job)
 
 
+SCHEMA_PAGE_SIZE = 100
+SCHEMA_MAX_PAGE_SIZE = 1000
+
+
+class DataSourceSchemaTablesResource(BaseResource):
+    def get(self, data_source_id):
+        """
+        Lists the table names of the cached schema in pages, optionally only those starting with
+        `prefix` or containing `q` (ignoring case). Pass the `next` of a page as `after` to get the
+        following page.
+        """
+        data_source = get_object_or_404(models.DataSource.get_by_id_and_org, data_source_id, self.current_org)
+        require_access(data_source, self.current_user, view_only)
+
+        if not models.schema_cache.exists(data_source.id):
+            return serialize_job(get_schema.delay(data_source.id, False))
+
+        limit = request.args.get("limit", SCHEMA_PAGE_SIZE, type=int)
+        if not 0 < limit <= SCHEMA_MAX_PAGE_SIZE:
+            abort(400, message="limit must be between 1 and {}.".format(SCHEMA_MAX_PAGE_SIZE))
+
+        after = request.args.get("after")
+        search = request.args.get("q")
+        if search:
+            names = models.schema_cache.search_names(data_source.id, search, after=after, limit=limit)
+        else:
+            prefix = request.args.get("prefix", "")
+            names = models.schema_cache.list_names(data_source.id, prefix=prefix, after=after, limit=limit)
+
+        return {
+            "tables": names,
+            "next": names[-1] if len(names) == limit else None,
+            "count": models.schema_cache.count(data_source.id),
+        }
+
+
+class DataSourceSchemaColumnsResource(BaseResource):
+    def get(self, data_source_id):
+        """
+        Returns the cached tables named by the `table` arguments, with their columns.
+        """
+        data_source = get_object_or_404(models.DataSource.get_by_id_and_org, data_source_id, self.current_org)
+        require_access(data_source, self.current_user, view_only)
+
+        names = request.args.getlist("table")
+        if not names or len(names) > SCHEMA_PAGE_SIZE:
+            abort(400, message="Pass between 1 and {} table names.".format(SCHEMA_PAGE_SIZE))
+
+        if not models.schema_cache.exists(data_source.id):
+            return serialize_job(get_schema.delay(data_source.id, False))
+
+        return {"tables": models.schema_cache.get_tables(data_source.id, names)}
+
+
 class DataSourcePauseResource(BaseResource):
     @require_admin
     def post(self, data_source_id):
@@ -1,12 +1,14 @@
+import time
 import unicodedata
 from urllib.parse import quote, urlparse, parse_qs, urlencode, urlunparse
 
 import regex
-from flask import make_response, request
+from flask import Response, make_response, request, stream_with_context
 from flask_login import current_user
 from flask_restful import abort
+from werkzeug.wsgi import wrap_file
 
-from redash import models, settings
+from redash import models, redis_connection, rq_redis_connection, settings
 from redash.handlers.base import BaseResource, get_object_or_404, record_event
 from redash.models.parameterized_query import (
     InvalidParameterError,
@@ -23,16 +25,25 @@ from redash.permissions import (
     view_only,
 )
 from redash.serializers import (
+    accessible_query_ids,
     serialize_job,
     serialize_query_result,
-    serialize_query_result_to_dsv,
-    serialize_query_result_to_xlsx,
+    serialize_query_result_to_dsv_stream,
+    serialize_query_result_to_xlsx_file,
 )
 from redash.tasks import Job
-from redash.tasks.queries import enqueue_query
+from redash.tasks.queries import (
+    CANCELLED_MESSAGE,
+    JOB_STATUS_CHANNEL,
+    enqueue_queries,
+    enqueue_query,
+    publish_job_status,
+)
 from redash.utils import (
     collect_parameters_from_request,
+    gen_query_hash,
     json_dumps,
+    json_loads,
     to_filename,
 )
 
@@ -75,14 +86,7 @@ def run_query(query, parameters, data_source, query_id, should_apply_auto_limit,
 
     query_text = data_source.query_runner.apply_auto_limit(query.text, should_apply_auto_limit)
     print('===================query_text=================', query_text)
-    if query_start or query_end:
-        # 使用&分割query_text
-        new_query_text = query_text.split("&")[0]
-        print('===================new_query_text=================', new_query_text)
-        new_query_text += f"&start={query_start}"
-        new_query_text += f"&end={query_end}"
-        query_text = new_query_text
-    
+    query_text = apply_time_range(query_text, query_start, query_end)
     print('===================new_query=================', query_text)
 
     if query.missing_params:
@@ -90,17 +94,19 @@ def run_query(query, parameters, data_source, query_id, should_apply_auto_limit,
 
     # 在调用 get_latest 前打印 query_text，追踪参数流向
     if max_age == 0:
-        query_result = None
+        query_result_response = None
     else:
         print('===================before_get_latest_query_text=================', query_text, flush=True)
-        query_result = models.QueryResult.get_latest(data_source, query_text, max_age)
+        query_result_response = get_latest_query_result_response(
+            data_source, query_text, max_age, current_user.is_api_user()
+        )
 
     record_event(
         current_user.org,
         current_user,
         {
             "action": "execute_query",
-            "cache": "hit" if query_result else "miss",
+            "cache": "hit" if query_result_response else "miss",
             "object_id": data_source.id,
             "object_type": "data_source",
             "query": query_text,
@@ -109,8 +115,8 @@ def run_query(query, parameters, data_source, query_id, should_apply_auto_limit,
         },
     )
 
-    if query_result:
-        return {"query_result": serialize_query_result(query_result, current_user.is_api_user())}
+    if query_result_response:
+        return make_response(query_result_response, 200, {"Content-Type": "application/json"})
     else:
         job = enqueue_query(
             query_text,
@@ -125,6 +131,74 @@ def run_query(query, parameters, data_source, query_id, should_apply_auto_limit,
         return serialize_job(job)
 
 
+def apply_time_range(query_text, query_start, query_end):
+    if query_start or query_end:
+        # 使用&分割query_text
+        query_text = query_text.split("&")[0]
+        query_text += f"&start={query_start}"
+        query_text += f"&end={query_end}"
+
+    return query_text
+
+
+def get_latest_query_result_response(data_source, query_text, max_age, is_api_user):
+    """
+    Return the serialized `{"query_result": ...}` response for the latest result of `query_text`
+    that is no older than `max_age`, or None. Served from the query result cache when possible.
+    """
+    query_hash = gen_query_hash(query_text)
+    query_result_id = models.query_result_cache.get_latest_id(data_source.id, query_hash, max_age)
+    if query_result_id is not None:
+        response = models.query_result_cache.get_response(query_result_id, public=is_api_user)
+        if response is not None:
+            return response
+
+    query_result = models.QueryResult.get_latest(data_source, query_text, max_age)
+    if query_result is None:
+        return None
+
+    models.query_result_cache.set_latest(query_result)
+    return models.query_result_cache.get_or_set_response(
+        query_result.id,
+        lambda: json_dumps({"query_result": serialize_query_result(query_result, is_api_user)}),
+        public=is_api_user,
+    )
+
+
+DATA_PAGE_ARGS = ("offset", "limit", "columns", "order_by")
+
+
+def parse_data_page_args(query_result):
+    """
+    Parse the `offset`, `limit`, `columns` and `order_by` arguments used to fetch a page of the result's
+    rows (`columns` and `order_by` may be repeated; prefix an `order_by` column with "-" to sort it in
+    descending order). Returns None when none of them were given.
+    """
+    if not any(arg in request.args for arg in DATA_PAGE_ARGS):
+        return None
+
+    try:
+        offset = int(request.args.get("offset", 0))
+        limit = int(request.args["limit"]) if "limit" in request.args else None
+    except ValueError:
+        abort(400, message="offset 和 limit 必须是整数。")
+
+    if offset < 0 or (limit is not None and limit < 0):
+        abort(400, message="offset 和 limit 不能为负数。")
+
+    columns = request.args.getlist("columns")
+    order_by = [
+        (name[1:], True) if name.startswith("-") else (name, False) for name in request.args.getlist("order_by")
+    ]
+
+    known_columns = {column["name"] for column in query_result.data_columns or []}
+    for name in columns + [name for name, _ in order_by]:
+        if name not in known_columns:
+            abort(400, message="未知的列：{}".format(name))
+
+    return {"columns": columns or None, "offset": offset, "limit": limit, "order_by": order_by}
+
+
 def get_download_filename(query_result, query, filetype):
     retrieved_at = query_result.retrieved_at.strftime("%Y_%m_%d")
     if query:
@@ -197,6 +271,129 @@ class QueryResultListResource(BaseResource):
         )
 
 
+class DashboardQueryResultsResource(BaseResource):
+    @require_any_of_permission(("view_query", "execute_query"))
+    def post(self, dashboard_id):
+        """
+        执行仪表板上的多个查询（或检索它们的最近结果）。
+
+        :param number dashboard_id: 仪表板 ID
+        :<json array queries: 要执行的查询列表，每项包含 `query_id`，以及可选的 `parameters`、`max_age`、`apply_auto_limit`、`start` 和 `end`，含义与执行单个保存的查询时相同
+
+        按请求顺序返回 `results` 数组：命中缓存的项包含 `query_result`，其余项包含 `job`（出错时 `job` 的 status 为 4）。
+        """
+        params = request.get_json(force=True, silent=True) or {}
+        entries = params.get("queries")
+        if not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+            abort(400, message="queries 必须是对象列表。")
+
+        try:
+            query_ids = [int(entry["query_id"]) for entry in entries]
+            max_ages = [int(-1 if entry.get("max_age") is None else entry["max_age"]) for entry in entries]
+        except (KeyError, TypeError, ValueError):
+            abort(400, message="每个查询都必须包含整数类型的 query_id 和 max_age。")
+
+        dashboard = get_object_or_404(models.Dashboard.get_by_id_and_org, dashboard_id, self.current_org)
+        queries = {query.id: query for query in dashboard.load_queries(set(query_ids))}
+
+        # Queries with unsafe parameters need full access to run, like in QueryResultResource.
+        parameterized = {query_id: query.parameterized for query_id, query in queries.items()}
+        safe = [query for query in queries.values() if parameterized[query.id].is_safe]
+        unsafe = [query for query in queries.values() if not parameterized[query.id].is_safe]
+        allowed = accessible_query_ids(safe, self.current_user, view_only) | accessible_query_ids(
+            unsafe, self.current_user, not_view_only
+        )
+
+        results = [None] * len(entries)
+        pending = []
+        for i, (entry, query_id, max_age) in enumerate(zip(entries, query_ids, max_ages)):
+            query = queries.get(query_id)
+            if query is None:
+                results[i] = error_response("仪表板上没有此查询。", 404)[0]
+            elif query_id not in allowed:
+                if parameterized[query_id].is_safe:
+                    results[i] = error_messages["no_permission"][0]
+                elif self.current_user.is_api_user():
+                    results[i] = error_messages["unsafe_when_shared"][0]
+                else:
+                    results[i] = error_messages["unsafe_on_view_only"][0]
+            else:
+                results[i], query_text = self.prepare_query(query, parameterized[query_id], entry)
+                if query_text is not None:
+                    pending.append((i, query, query_text, max_age))
+
+        lookups = {
+            i: (query.data_source_id, gen_query_hash(query_text), max_age)
+            for i, query, query_text, max_age in pending
+            if max_age != 0
+        }
+        latest = models.QueryResult.get_latest_many(list(lookups.values()))
+
+        is_api_user = self.current_user.is_api_user()
+        misses = []
+        for i, query, query_text, max_age in pending:
+            query_result = latest.get(lookups.get(i))
+            if query_result is not None:
+                results[i] = {"query_result": serialize_query_result(query_result, is_api_user)}
+            else:
+                misses.append((i, query, query_text))
+
+        jobs = enqueue_queries(
+            [
+                {
+                    "query": query_text,
+                    "data_source": query.data_source,
+                    "user_id": self.current_user.id,
+                    "is_api_key": is_api_user,
+                    "scheduled_query": None,
+                    "metadata": {"Username": self.current_user.get_actual_user(), "query_id": query.id},
+                }
+                for _, query, query_text in misses
+            ]
+        )
+        for (i, _, _), job in zip(misses, jobs):
+            results[i] = serialize_job(job) if job is not None else error_response("查询排队失败，请稍后重试。")[0]
+
+        self.record_event(
+            {
+                "action": "execute_queries",
+                "object_id": dashboard.id,
+                "object_type": "dashboard",
+                "queries": len(entries),
+                "cache_hits": len(pending) - len(misses),
+                "cache_misses": len(misses),
+            }
+        )
+
+        return {"results": [dict(result, query_id=query_id) for result, query_id in zip(results, query_ids)]}
+
+    @staticmethod
+    def prepare_query(query, parameterized, entry):
+        """Return an error response and None, or None and the text of the query to run."""
+        data_source = query.data_source
+        if not data_source:
+            return error_messages["no_data_source"][0], None
+
+        if data_source.paused:
+            if data_source.pause_reason:
+                message = "{} 已暂停 ({}). 请稍后重试.".format(data_source.name, data_source.pause_reason)
+            else:
+                message = "{} 已暂停. 请稍后重试.".format(data_source.name)
+            return error_response(message)[0], None
+
+        try:
+            parameterized.apply(entry.get("parameters") or {})
+        except (InvalidParameterError, QueryDetachedFromDataSourceError) as e:
+            return error_response(str(e))[0], None
+
+        if parameterized.missing_params:
+            return error_response("缺少参数值: {}".format(", ".join(parameterized.missing_params)))[0], None
+
+        should_apply_auto_limit = entry.get("apply_auto_limit", query.options.get("apply_auto_limit", False))
+        query_text = data_source.query_runner.apply_auto_limit(parameterized.text, should_apply_auto_limit)
+        return None, apply_time_range(query_text, entry.get("start"), entry.get("end"))
+
+
 ONE_YEAR = 60 * 60 * 24 * 365.25
 
 
@@ -305,11 +502,15 @@ class QueryResultResource(BaseResource):
         :param number query_id: 查询 ID，用于获取结果
         :param number query_result_id: 查询结果 ID，用于获取特定结果
         :param string filetype: 返回格式。可选 'json', 'xlsx', 或 'csv'。默认为 'json'。
+        :qparam number offset: （仅 JSON）跳过的行数
+        :qparam number limit: （仅 JSON）返回的最大行数
+        :qparam string columns: （仅 JSON）要返回的列，可重复
+        :qparam string order_by: （仅 JSON）排序列，可重复，以 "-" 开头表示降序
 
         :<json number id: 查询结果 ID
         :<json string query: 生成此结果的查询
         :<json string query_hash: 查询文本的哈希代码
-        :<json object data: 查询输出
+        :<json object data: 查询输出（指定分页参数时包含 total_row_count）
         :<json number data_source_id: 生成此结果的数据源 ID
         :<json number runtime: 执行时间（秒）
         :<json string retrieved_at: 查询检索日期/时间，ISO 格式
@@ -323,8 +524,13 @@ class QueryResultResource(BaseResource):
         query_result = None
         query = None
 
+        # JSON responses may be served from the query result cache, in which case the data itself isn't needed.
+        defer_data = filetype == "json" and models.query_result_cache.enabled
+
         if query_result_id:
-            query_result = get_object_or_404(models.QueryResult.get_by_id_and_org, query_result_id, self.current_org)
+            query_result = get_object_or_404(
+                models.QueryResult.get_by_id_and_org, query_result_id, self.current_org, defer_data=defer_data
+            )
 
         if query_id is not None:
             query = get_object_or_404(models.Query.get_by_id_and_org, query_id, self.current_org)
@@ -334,6 +540,7 @@ class QueryResultResource(BaseResource):
                     models.QueryResult.get_by_id_and_org,
                     query.latest_query_data_id,
                     self.current_org,
+                    defer_data=defer_data,
                 )
 
             if query is not None and query_result is not None and self.current_user.is_api_user():
@@ -389,24 +596,40 @@ class QueryResultResource(BaseResource):
 
     @staticmethod
     def make_json_response(query_result):
-        data = json_dumps({"query_result": query_result.to_dict()})
+        page_args = parse_data_page_args(query_result)
+        if page_args is not None:
+            result = query_result.to_dict(with_data=False)
+            result["data"] = query_result.data_page(**page_args)
+            data = json_dumps({"query_result": result})
+        else:
+            data = models.query_result_cache.get_or_set_response(
+                query_result.id, lambda: json_dumps({"query_result": query_result.to_dict()})
+            )
         headers = {"Content-Type": "application/json"}
         return make_response(data, 200, headers)
 
     @staticmethod
     def make_csv_response(query_result):
         headers = {"Content-Type": "text/csv; charset=UTF-8"}
-        return make_response(serialize_query_result_to_dsv(query_result, ","), 200, headers)
+        return Response(stream_with_context(serialize_query_result_to_dsv_stream(query_result, ",")), 200, headers)
 
     @staticmethod
     def make_tsv_response(query_result):
         headers = {"Content-Type": "text/tab-separated-values; charset=UTF-8"}
-        return make_response(serialize_query_result_to_dsv(query_result, "\t"), 200, headers)
+        return Response(stream_with_context(serialize_query_result_to_dsv_stream(query_result, "\t")), 200, headers)
 
     @staticmethod
     def make_excel_response(query_result):
-        headers = {"Content-Type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"}
-        return make_response(serialize_query_result_to_xlsx(query_result), 200, headers)
+        output = serialize_query_result_to_xlsx_file(query_result)
+        output.seek(0, 2)
+        size = output.tell()
+        output.seek(0)
+
+        headers = {
+            "Content-Type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            "Content-Length": str(size),
+        }
+        return Response(wrap_file(request.environ, output), 200, headers, direct_passthrough=True)
 
 
 class JobResource(BaseResource):
@@ -423,3 +646,90 @@ class JobResource(BaseResource):
         """
         job = Job.fetch(job_id)
         job.cancel()
+        publish_job_status(job.id, 4, error=CANCELLED_MESSAGE)
+
+
+# Statuses after which a job doesn't change anymore (see serialize_job).
+FINAL_JOB_STATUSES = (3, 4, 5)
+
+
+def job_status_events(job_ids):
+    """
+    Yield server-sent events with the status of the given jobs, until they all ended or the stream
+    timed out. Statuses come from the notifications published by the query executor; the jobs are
+    also read every JOB_STATUS_STREAM_RECHECK_INTERVAL seconds, which catches jobs that ended
+    without a notification and keeps the connection alive.
+    """
+    pending = dict.fromkeys(job_ids)
+    pubsub = redis_connection.pubsub(ignore_subscribe_messages=True)
+    # Subscribe before reading the jobs, so a status published in between isn't missed.
+    pubsub.subscribe(*[JOB_STATUS_CHANNEL.format(job_id) for job_id in job_ids])
+
+    def event(job_id, job):
+        if job["status"] == pending.get(job_id, -1):
+            return ""
+        if job["status"] in FINAL_JOB_STATUSES:
+            pending.pop(job_id)
+        else:
+            pending[job_id] = job["status"]
+        return "event: job\ndata: {}\n\n".format(json_dumps(job))
+
+    try:
+        deadline = time.time() + settings.JOB_STATUS_STREAM_TIMEOUT
+        recheck_at = 0
+        while pending:
+            now = time.time()
+            if now >= deadline:
+                break
+
+            if now >= recheck_at:
+                ids = list(pending)
+                events = []
+                for job_id, job in zip(ids, Job.fetch_many(ids, connection=rq_redis_connection)):
+                    if job is None:
+                        events.append(event(job_id, {"id": job_id, "status": 4, "error": "作业不存在。"}))
+                    else:
+                        events.append(event(job_id, serialize_job(job)["job"]))
+                yield "".join(events) or ": keep-alive\n\n"
+                recheck_at = now + settings.JOB_STATUS_STREAM_RECHECK_INTERVAL
+                continue
+
+            message = pubsub.get_message(timeout=min(deadline, recheck_at) - now)
+            if message is not None:
+                job = json_loads(message["data"])
+                if job["id"] in pending:
+                    yield event(job["id"], job)
+
+        yield "event: close\ndata: {}\n\n".format(json_dumps({"pending": list(pending)}))
+    finally:
+        pubsub.close()
+
+
+class JobStatusStreamResource(BaseResource):
+    def get(self):
+        """
+        以服务器发送事件（SSE）流推送多个查询作业的状态，一个连接可以订阅多个作业。
+
+        :qparam string job_id: 作业 ID，可重复
+
+        每次状态变化发送一个 `job` 事件，其数据与 `GET /api/jobs/<job_id>` 返回的 `job` 相同。
+        所有作业结束或 JOB_STATUS_STREAM_TIMEOUT 秒后发送 `close` 事件并关闭流，
+        其 `pending` 为仍在运行的作业，客户端应使用它们重新连接。
+
+        每个打开的流都会占用一个 Web worker，因此需要设置 REDASH_JOB_STATUS_STREAM_ENABLED 并让 gunicorn
+        使用可以同时处理多个连接的 worker（gthread 或 gevent），未启用时返回 404，客户端应继续轮询。
+        """
+        if not settings.JOB_STATUS_STREAM_ENABLED:
+            abort(404, message="作业状态流未启用。")
+
+        job_ids = list(dict.fromkeys(request.args.getlist("job_id")))
+        if not job_ids:
+            abort(400, message="缺少 job_id。")
+        if len(job_ids) > settings.JOB_STATUS_STREAM_MAX_JOBS:
+            abort(400, message="一个连接最多订阅 {} 个作业。".format(settings.JOB_STATUS_STREAM_MAX_JOBS))
+
+        return Response(
+            job_status_events(job_ids),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
@@ -5,13 +5,23 @@ import numbers
 import time
 
 import pytz
-from sqlalchemy import UniqueConstraint, and_, cast, distinct, func, or_
+from sqlalchemy import (
+    UniqueConstraint,
+    and_,
+    cast,
+    distinct,
+    func,
+    inspect,
+    or_,
+    select,
+)
 from sqlalchemy.dialects.postgresql import ARRAY, DOUBLE_PRECISION, JSONB
 from sqlalchemy.event import listens_for
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import (
     backref,
     contains_eager,
+    defer,
     joinedload,
     load_only,
     subqueryload,
@@ -21,6 +31,7 @@ from sqlalchemy_utils import generic_relationship
 from sqlalchemy_utils.models import generic_repr
 from sqlalchemy_utils.types import TSVectorType
 from sqlalchemy_utils.types.encrypted.encrypted_type import FernetEngine
+from werkzeug.utils import import_string
 
 from redash import redis_connection, settings, utils
 from redash.destinations import (
@@ -45,10 +56,14 @@ from redash.models.parameterized_query import (
     ParameterizedQuery,
     QueryDetachedFromDataSourceError,
 )
+from redash.models.persistence import ColumnarPersistence, DBPersistence  # noqa
+from redash.models.principal_cache import principal_cache
+from redash.models.public_dashboard_cache import public_dashboard_cache  # noqa: F401
+from redash.models.query_result_cache import query_result_cache
+from redash.models.schema_cache import ALL_NAMESPACES, schema_cache
 from redash.models.types import (
     Configuration,
     EncryptedConfiguration,
-    JSONText,
     MutableDict,
     MutableList,
     json_cast_property,
@@ -65,6 +80,7 @@ from redash.query_runner import (
     TYPE_DATE,
     TYPE_DATETIME,
     BaseQueryRunner,
+    NotSupported,
     get_configuration_schema_for_query_runner_type,
     get_query_runner,
     with_ssh_tunnel,
@@ -84,17 +100,70 @@ from redash.utils.configuration import ConfigurationContainer
 logger = logging.getLogger(__name__)
 
 
+class ScheduledQueriesIndex:
+    """
+    Redis sorted set of scheduled query ids, scored by the time each one is next due.
+
+    Query.outdated_queries only evaluates the queries whose score has passed instead of every
+    scheduled query on every tick. Anything that can move a query's due time (schedule edits,
+    new results, failures, executions starting) resets its score to 0 so the next tick re-checks
+    it, and the whole index is rebuilt from the database every REBUILD_INTERVAL seconds to pick up
+    changes made behind the ORM's back.
+    """
+
+    KEY_NAME = "sq:due"
+    REBUILT_KEY_NAME = "sq:due:rebuilt"
+    REBUILD_INTERVAL = 60 * 60
+    CHUNK_SIZE = 10000
+
+    def needs_rebuild(self):
+        return not redis_connection.exists(self.REBUILT_KEY_NAME)
+
+    def rebuild(self, query_ids):
+        pipe = redis_connection.pipeline()
+        pipe.delete(self.KEY_NAME)
+        for i in range(0, len(query_ids), self.CHUNK_SIZE):
+            pipe.zadd(self.KEY_NAME, {query_id: 0 for query_id in query_ids[i : i + self.CHUNK_SIZE]})
+        pipe.set(self.REBUILT_KEY_NAME, time.time(), ex=self.REBUILD_INTERVAL)
+        pipe.execute()
+
+    def due(self, now):
+        return [int(query_id) for query_id in redis_connection.zrangebyscore(self.KEY_NAME, "-inf", now.timestamp())]
+
+    def reschedule(self, due_times):
+        if due_times:
+            redis_connection.zadd(self.KEY_NAME, {query_id: due.timestamp() for query_id, due in due_times.items()})
+
+    def touch(self, query_ids):
+        if query_ids:
+            redis_connection.zadd(self.KEY_NAME, {query_id: 0 for query_id in query_ids})
+
+    def remove(self, query_ids):
+        if query_ids:
+            redis_connection.zrem(self.KEY_NAME, *query_ids)
+
+
+scheduled_queries_index = ScheduledQueriesIndex()
+
+
 class ScheduledQueriesExecutions:
     KEY_NAME = "sq:executed_at"
 
     def __init__(self):
         self.executions = {}
 
-    def refresh(self):
-        self.executions = redis_connection.hgetall(self.KEY_NAME)
+    def refresh(self, query_ids=None):
+        if query_ids is None:
+            self.executions = redis_connection.hgetall(self.KEY_NAME)
+        elif query_ids:
+            values = redis_connection.hmget(self.KEY_NAME, query_ids)
+            self.executions = {str(query_id): value for query_id, value in zip(query_ids, values) if value}
+        else:
+            self.executions = {}
 
     def update(self, query_id):
         redis_connection.hset(self.KEY_NAME, mapping={query_id: time.time()})
+        scheduled_queries_index.touch([query_id])
 
     def get(self, query_id):
         timestamp = self.executions.get(str(query_id))
@@ -198,13 +267,12 @@ class DataSource(BelongsToOrgMixin, db.Model):
         res = db.session.delete(self)
         db.session.commit()
 
-        redis_connection.delete(self._schema_key)
+        schema_cache.delete(self.id)
 
         return res
 
     def get_cached_schema(self):
-        cache = redis_connection.get(self._schema_key)
-        return json_loads(cache) if cache else None
+        return schema_cache.get(self.id)
 
     def get_schema(self, refresh=False):
         out_schema = None
@@ -213,6 +281,17 @@ class DataSource(BelongsToOrgMixin, db.Model):
 
         if out_schema is None:
             query_runner = self.query_runner
+            fingerprints = None
+            # Table sizes change without the tables changing, so they need a full refresh.
+            if not (refresh and settings.SCHEMA_RUN_TABLE_SIZE_CALCULATIONS):
+                try:
+                    fingerprints = query_runner.get_schema_fingerprints()
+                except NotSupported:
+                    pass
+
+            if fingerprints is not None:
+                return self._refresh_schema(fingerprints)
+
             schema = query_runner.get_schema(get_stats=refresh)
 
             try:
@@ -221,21 +300,44 @@ class DataSource(BelongsToOrgMixin, db.Model):
                 logging.exception("Error sorting schema columns for data_source {}".format(self.id))
                 out_schema = schema
             finally:
-                ttl = int(datetime.timedelta(minutes=settings.SCHEMAS_REFRESH_SCHEDULE, days=7).total_seconds())
-                redis_connection.set(self._schema_key, json_dumps(out_schema), ex=ttl)
+                removed = set(schema_cache.get_fingerprints(self.id)) - {ALL_NAMESPACES}
+                schema_cache.update(self.id, {ALL_NAMESPACES: out_schema or []}, {}, removed)
 
         return out_schema
 
+    def _refresh_schema(self, fingerprints):
+        """Re-fetch the tables of the namespaces whose fingerprint changed since the last refresh."""
+        cached = schema_cache.get_fingerprints(self.id)
+        changed = [
+            namespace
+            for namespace, fingerprint in fingerprints.items()
+            if namespace not in cached or cached[namespace] != fingerprint
+        ]
+        removed = set(cached) - set(fingerprints)
+
+        tables = self.query_runner.get_namespace_schema(changed) if changed else {}
+        tables = {namespace: self._sort_schema(tables.get(namespace, [])) for namespace in changed}
+        if not fingerprints:
+            # Keep an empty namespace, so that a data source without tables still has a cached schema.
+            tables = {ALL_NAMESPACES: []}
+            removed.discard(ALL_NAMESPACES)
+        schema_cache.update(self.id, tables, fingerprints, removed)
+
+        logger.info(
+            "Refreshed schema of data_source %s: %d namespaces, %d changed, %d removed",
+            self.id,
+            len(fingerprints),
+            len(changed),
+            len(removed),
+        )
+        return schema_cache.get(self.id)
+
     def _sort_schema(self, schema):
         return [
             {"name": i["name"], "columns": sorted(i["columns"], key=lambda x: x["name"] if isinstance(x, dict) else x)}
             for i in sorted(schema, key=lambda x: x["name"])
         ]
 
-    @property
-    def _schema_key(self):
-        return "data_source:schema:{}".format(self.id)
-
     @property
     def _pause_key(self):
         return "ds:{}:pause".format(self.id)
@@ -261,6 +363,7 @@ class DataSource(BelongsToOrgMixin, db.Model):
 
     def remove_group(self, group):
         DataSourceGroup.query.filter(DataSourceGroup.group == group, DataSourceGroup.data_source == self).delete()
+        principal_cache.invalidate_org(self.org_id)
         db.session.commit()
 
     def update_group_permission(self, group, view_only):
@@ -292,6 +395,19 @@ class DataSource(BelongsToOrgMixin, db.Model):
         groups = DataSourceGroup.query.filter(DataSourceGroup.data_source == self)
         return dict([(group.group_id, group.view_only) for group in groups])
 
+    @classmethod
+    def groups_by_id(cls, data_source_ids):
+        """Return the groups of all the given data sources with one query, as {data_source_id: groups}."""
+        groups = {data_source_id: {} for data_source_id in data_source_ids}
+        if groups:
+            rows = db.session.query(
+                DataSourceGroup.data_source_id, DataSourceGroup.group_id, DataSourceGroup.view_only
+            ).filter(DataSourceGroup.data_source_id.in_(groups.keys()))
+            for data_source_id, group_id, view_only in rows:
+                groups[data_source_id][group_id] = view_only
+
+        return groups
+
 
 @generic_repr("id", "data_source_id", "group_id", "view_only")
 class DataSourceGroup(db.Model):
@@ -307,8 +423,13 @@ class DataSourceGroup(db.Model):
     __table_args__ = ({"extend_existing": True},)
 
 
+QueryResultPersistence = settings.dynamic_settings.QueryResultPersistence or DBPersistence
+if isinstance(QueryResultPersistence, str):
+    QueryResultPersistence = import_string(QueryResultPersistence)
+
+
 @generic_repr("id", "org_id", "data_source_id", "query_hash", "runtime", "retrieved_at")
-class QueryResult(db.Model, BelongsToOrgMixin):
+class QueryResult(db.Model, QueryResultPersistence, BelongsToOrgMixin):
     id = primary_key("QueryResult")
     org_id = Column(key_type("Organization"), db.ForeignKey("organizations.id"))
     org = db.relationship(Organization)
@@ -316,7 +437,7 @@ class QueryResult(db.Model, BelongsToOrgMixin):
     data_source = db.relationship(DataSource, backref=backref("query_results"))
     query_hash = Column(db.String(32), index=True)
     query_text = Column("query", db.Text)
-    data = Column(JSONText, nullable=True)
+    _data = Column("data", db.Text, nullable=True)
     runtime = Column(DOUBLE_PRECISION)
     retrieved_at = Column(db.DateTime(True))
 
@@ -325,17 +446,28 @@ class QueryResult(db.Model, BelongsToOrgMixin):
     def __str__(self):
         return "%d | %s | %s" % (self.id, self.query_hash, self.retrieved_at)
 
-    def to_dict(self):
-        return {
+    @classmethod
+    def get_by_id_and_org(cls, object_id, org, defer_data=False):
+        query = cls.query.filter(cls.id == object_id, cls.org == org)
+        if defer_data:
+            query = query.options(defer(cls._data))
+        return query.one()
+
+    def to_dict(self, with_data=True):
+        d = {
             "id": self.id,
             "query_hash": self.query_hash,
             "query": self.query_text,
-            "data": self.data,
             "data_source_id": self.data_source_id,
             "runtime": self.runtime,
             "retrieved_at": self.retrieved_at,
         }
 
+        if with_data:
+            d["data"] = self.data
+
+        return d
+
     @classmethod
     def unused(cls, days=7):
         age_threshold = datetime.datetime.now() - datetime.timedelta(days=days)
@@ -364,6 +496,55 @@ class QueryResult(db.Model, BelongsToOrgMixin):
 
         return query.order_by(cls.retrieved_at.desc()).first()
 
+    @classmethod
+    def get_latest_many(cls, lookups):
+        """
+        Bulk version of get_latest, with a single statement. lookups is a list of
+        (data_source_id, query_hash, max_age) tuples; returns the latest result matching each of
+        them, as {lookup: query_result}.
+        """
+        if not lookups:
+            return {}
+
+        def max_age_seconds(max_age):
+            if max_age == -1 and settings.QUERY_RESULTS_EXPIRED_TTL_ENABLED:
+                return settings.QUERY_RESULTS_EXPIRED_TTL
+            return max_age
+
+        conditions = []
+        for data_source_id, query_hash, max_age in set(lookups):
+            condition = and_(cls.data_source_id == data_source_id, cls.query_hash == query_hash)
+            max_age = max_age_seconds(max_age)
+            if max_age != -1:
+                condition = and_(
+                    condition,
+                    db.func.timezone("utc", cls.retrieved_at) + datetime.timedelta(seconds=max_age)
+                    >= db.func.timezone("utc", db.func.now()),
+                )
+            conditions.append(condition)
+
+        latest = {
+            (query_result.data_source_id, query_result.query_hash): query_result
+            for query_result in cls.query.filter(or_(*conditions))
+            .distinct(cls.data_source_id, cls.query_hash)
+            .order_by(cls.data_source_id, cls.query_hash, cls.retrieved_at.desc())
+        }
+
+        # The latest result of a data source and query hash might be too old for a lookup with a
+        # smaller max_age than another lookup of the same query.
+        now = utils.utcnow()
+        results = {}
+        for lookup in lookups:
+            data_source_id, query_hash, max_age = lookup
+            query_result = latest.get((data_source_id, query_hash))
+            max_age = max_age_seconds(max_age)
+            if query_result is not None and (
+                max_age == -1 or query_result.retrieved_at + datetime.timedelta(seconds=max_age) >= now
+            ):
+                results[lookup] = query_result
+
+        return results
+
     @classmethod
     def store_result(cls, org, data_source, query_hash, query, data, run_time, retrieved_at):
         query_result = cls(
@@ -377,6 +558,7 @@ class QueryResult(db.Model, BelongsToOrgMixin):
         )
 
         db.session.add(query_result)
+        query_result_cache.invalidate_latest(data_source.id, query_hash)
         logging.info("Inserted query (%s) data; id=%s", query_hash, query_result.id)
 
         return query_result
@@ -386,11 +568,11 @@ class QueryResult(db.Model, BelongsToOrgMixin):
         return self.data_source.groups
 
 
-def should_schedule_next(previous_iteration, now, interval, time=None, day_of_week=None, failures=0):
-    # if previous_iteration is None, it means the query has never been run before
-    # so we should schedule it immediately
-    if previous_iteration is None:
-        return True
+def next_schedule_time(previous_iteration, interval, time=None, day_of_week=None, failures=0):
+    """
+    Return when a query that last ran at previous_iteration is due to run again, or None if the
+    failure backoff pushes it beyond any representable time.
+    """
     # if time exists then interval > 23 hours (82800s)
     # if day_of_week exists then interval > 6 days (518400s)
     if time is None:
@@ -422,8 +604,18 @@ def should_schedule_next(previous_iteration, now, interval, time=None, day_of_we
         try:
             next_iteration += datetime.timedelta(minutes=2**failures)
         except OverflowError:
-            return False
-    return now > next_iteration
+            return None
+    return next_iteration
+
+
+def should_schedule_next(previous_iteration, now, interval, time=None, day_of_week=None, failures=0):
+    # if previous_iteration is None, it means the query has never been run before
+    # so we should schedule it immediately
+    if previous_iteration is None:
+        return True
+
+    next_iteration = next_schedule_time(previous_iteration, interval, time, day_of_week, failures)
+    return next_iteration is not None and now > next_iteration
 
 
 @gfk_type
@@ -590,16 +782,34 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
 
     @classmethod
     def outdated_queries(cls):
+        # Flushing pending changes marks the affected queries in the index (see reschedule_query).
+        db.session.flush()
+
+        if scheduled_queries_index.needs_rebuild():
+            scheduled_ids = (
+                db.session.query(Query.id).filter(func.jsonb_typeof(Query.schedule) != "null").order_by(Query.id)
+            )
+            scheduled_queries_index.rebuild([query_id for (query_id,) in scheduled_ids])
+
+        now = utils.utcnow()
+        due_ids = scheduled_queries_index.due(now)
+        if not due_ids:
+            return []
+
         queries = (
             Query.query.options(joinedload(Query.latest_query_data).load_only("retrieved_at"))
-            .filter(func.jsonb_typeof(Query.schedule) != "null")
+            .filter(Query.id.in_(due_ids), func.jsonb_typeof(Query.schedule) != "null")
             .order_by(Query.id)
             .all()
         )
 
-        now = utils.utcnow()
         outdated_queries = {}
-        scheduled_queries_executions.refresh()
+        # Outdated queries stay due until their execution starts; the others are pushed back to
+        # their next due time and anything left over (deleted, unscheduled, disabled or expired
+        # schedules) is dropped from the index until its schedule changes.
+        still_due = set()
+        next_due = {}
+        scheduled_queries_executions.refresh(due_ids)
 
         for query in queries:
             try:
@@ -631,6 +841,17 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
                 ):
                     key = "{}:{}".format(query.query_hash, query.data_source_id)
                     outdated_queries[key] = query
+                    still_due.add(query.id)
+                else:
+                    next_iteration = next_schedule_time(
+                        retrieved_at,
+                        query.schedule["interval"],
+                        query.schedule["time"],
+                        query.schedule["day_of_week"],
+                        query.schedule_failures,
+                    )
+                    if next_iteration is not None:
+                        next_due[query.id] = next_iteration
             except Exception as e:
                 query.schedule["disabled"] = True
                 db.session.commit()
@@ -642,6 +863,9 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
                 logging.info(message)
                 sentry.capture_exception(type(e)(message).with_traceback(e.__traceback__))
 
+        scheduled_queries_index.reschedule(next_due)
+        scheduled_queries_index.remove(set(due_ids) - still_due - set(next_due))
+
         return list(outdated_queries.values())
 
     @classmethod
@@ -810,17 +1034,31 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
 
     @property
     def dashboard_api_keys(self):
-        query = """SELECT api_keys.api_key
-                   FROM api_keys
-                   JOIN dashboards ON object_id = dashboards.id
-                   JOIN widgets ON dashboards.id = widgets.dashboard_id
-                   JOIN visualizations ON widgets.visualization_id = visualizations.id
-                   WHERE object_type='dashboards'
-                     AND active=true
-                     AND visualizations.query_id = :id"""
-
-        api_keys = db.session.execute(query, {"id": self.id}).fetchall()
-        return [api_key[0] for api_key in api_keys]
+        return self.dashboard_api_keys_by_id([self.id])[self.id]
+
+    @classmethod
+    def dashboard_api_keys_by_id(cls, query_ids):
+        """
+        Return the API keys of the shared dashboards showing each of the given queries, with one query,
+        as {query_id: [api_key, ...]}.
+        """
+        api_keys = {query_id: [] for query_id in query_ids}
+        if api_keys:
+            rows = (
+                db.session.query(Visualization.query_id, ApiKey.api_key)
+                .join(Widget, Widget.visualization_id == Visualization.id)
+                .join(Dashboard, Dashboard.id == Widget.dashboard_id)
+                .join(ApiKey, ApiKey.object_id == Dashboard.id)
+                .filter(
+                    ApiKey.object_type == "dashboards",
+                    ApiKey.active.is_(True),
+                    Visualization.query_id.in_(api_keys.keys()),
+                )
+            )
+            for query_id, api_key in rows:
+                api_keys[query_id].append(api_key)
+
+        return api_keys
 
     def update_query_hash(self):
         should_apply_auto_limit = self.options.get("apply_auto_limit", False) if self.options else False
@@ -847,6 +1085,13 @@ def receive_before_insert_update(mapper, connection, target):
     target.update_query_hash()
 
 
+@listens_for(Query, "after_insert")
+@listens_for(Query, "after_update")
+def reschedule_query(mapper, connection, target):
+    if target.schedule:
+        scheduled_queries_index.touch([target.id])
+
+
 @listens_for(Query.user_id, "set")
 def query_last_modified_by(target, val, oldval, initiator):
     target.last_modified_by_id = val
@@ -902,6 +1147,25 @@ OPERATORS = {
 }
 
 
+def select_value(values, selector):
+    """
+    Return (found, value) with the value an alert's selector picks from a column's values. Nothing is
+    found when there are no values or max/min can't compare them as numbers.
+    """
+    if not values:
+        return False, None
+
+    try:
+        if selector == "max":
+            return True, max(map(float, values))
+        elif selector == "min":
+            return True, min(map(float, values))
+    except ValueError:
+        return False, None
+
+    return True, values[0]
+
+
 def next_state(op, value, threshold):
     if isinstance(value, bool):
         # If it's a boolean cast to string and lower case, because upper cased
@@ -968,39 +1232,34 @@ class Alert(TimestampMixin, BelongsToOrgMixin, db.Model):
     def get_by_id_and_org(cls, object_id, org):
         return super(Alert, cls).get_by_id_and_org(object_id, org, Query)
 
-    def evaluate(self):
-        data = self.query_rel.latest_query_data.data if self.query_rel.latest_query_data else None
+    def evaluate(self, selected_values=None):
+        """
+        `selected_values` memoizes the selected value of each (query result, column, selector), so
+        that alerts on the same query result share the work when it's passed to all of them.
+        """
+        query_result = self.query_rel.latest_query_data
         new_state = self.UNKNOWN_STATE
 
-        if data and data["rows"] and self.options["column"] in data["rows"][0]:
-            op = OPERATORS.get(self.options["op"], lambda v, t: False)
-
-            if "selector" not in self.options:
-                selector = "first"
-            else:
-                selector = self.options["selector"]
+        if query_result is None:
+            return new_state
 
-            try:
-                if selector == "max":
-                    max_val = float("-inf")
-                    for i in range(len(data["rows"])):
-                        max_val = max(max_val, float(data["rows"][i][self.options["column"]]))
-                    value = max_val
-                elif selector == "min":
-                    min_val = float("inf")
-                    for i in range(len(data["rows"])):
-                        min_val = min(min_val, float(data["rows"][i][self.options["column"]]))
-                    value = min_val
-                else:
-                    value = data["rows"][0][self.options["column"]]
+        column = self.options.get("column")
+        selector = self.options.get("selector", "first")
+        key = (query_result.id, column, selector)
+        if selected_values is None:
+            selected_values = {}
+        if key not in selected_values:
+            selected_values[key] = select_value(query_result.column_values(column), selector)
 
-            except ValueError:
-                return self.UNKNOWN_STATE
+        found, value = selected_values[key]
+        if not found:
+            return new_state
 
-            threshold = self.options["value"]
+        op = OPERATORS.get(self.options["op"], lambda v, t: False)
+        threshold = self.options["value"]
 
-            if value is not None:
-                new_state = next_state(op, value, threshold)
+        if value is not None:
+            new_state = next_state(op, value, threshold)
 
         return new_state
 
@@ -1011,6 +1270,18 @@ class Alert(TimestampMixin, BelongsToOrgMixin, db.Model):
         if template is None:
             return ""
 
+        # Every destination of a state change renders the same templates, which include the whole
+        # result table, so they're rendered once per state and result.
+        key = (template, self.state, self.query_rel.latest_query_data_id)
+        rendered = getattr(self, "_rendered_templates", None)
+        if rendered is None:
+            rendered = self._rendered_templates = {}
+        if key not in rendered:
+            rendered[key] = self._render_template(template)
+
+        return rendered[key]
+
+    def _render_template(self, template):
         data = self.query_rel.latest_query_data.data
         host = base_url(self.query_rel.org)
 
@@ -1049,6 +1320,10 @@ class Alert(TimestampMixin, BelongsToOrgMixin, db.Model):
         template = self.options.get("custom_subject")
         return self.render_template(template)
 
+    def render_custom_templates(self):
+        """Render the custom subject and body, which are memoized for the destinations to reuse."""
+        return self.custom_subject, self.custom_body
+
     @property
     def groups(self):
         return self.query_rel.groups
@@ -1097,6 +1372,55 @@ class Dashboard(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model
     def name_as_slug(self):
         return utils.slugify(self.name)
 
+    def load_widgets(self, with_query_users=True):
+        """
+        Return the widgets with their visualizations, queries and (unless with_query_users is False)
+        query owners, loaded with a single statement.
+        """
+        if with_query_users:
+            options = [
+                joinedload(Widget.visualization).joinedload(Visualization.query_rel).joinedload(Query.user),
+                joinedload(Widget.visualization)
+                .joinedload(Visualization.query_rel)
+                .joinedload(Query.last_modified_by),
+            ]
+        else:
+            options = [joinedload(Widget.visualization).joinedload(Visualization.query_rel)]
+
+        return self.widgets.options(*options).order_by(Widget.id).all()
+
+    def load_queries(self, query_ids):
+        """Return those of the given queries that the dashboard's widgets show, with their data sources."""
+        dashboard_query_ids = (
+            db.session.query(Visualization.query_id)
+            .join(Widget, Widget.visualization_id == Visualization.id)
+            .filter(Widget.dashboard_id == self.id)
+        )
+        return (
+            Query.query.options(joinedload(Query.data_source))
+            .filter(Query.id.in_(query_ids), Query.id.in_(dashboard_query_ids))
+            .all()
+        )
+
+    def widgets_fingerprint(self):
+        """
+        Return a value that changes whenever a widget is added to or removed from the dashboard, or
+        a widget or the visualization or query it shows is updated.
+        """
+        return (
+            db.session.query(
+                func.count(Widget.id),
+                func.max(Widget.updated_at),
+                func.max(Visualization.updated_at),
+                func.max(Query.updated_at),
+            )
+            .select_from(Widget)
+            .outerjoin(Visualization, Widget.visualization_id == Visualization.id)
+            .outerjoin(Query, Visualization.query_id == Query.id)
+            .filter(Widget.dashboard_id == self.id)
+            .one()
+        )
+
     @classmethod
     def all(cls, org, group_ids, user_id):
         query = (
@@ -1281,8 +1605,8 @@ class Event(db.Model):
             "created_at": self.created_at.isoformat(),
         }
 
-    @classmethod
-    def record(cls, event):
+    @staticmethod
+    def values_from_raw(event):
         org_id = event.pop("org_id")
         user_id = event.pop("user_id", None)
         action = event.pop("action")
@@ -1291,18 +1615,34 @@ class Event(db.Model):
 
         created_at = datetime.datetime.utcfromtimestamp(event.pop("timestamp"))
 
-        event = cls(
-            org_id=org_id,
-            user_id=user_id,
-            action=action,
-            object_type=object_type,
-            object_id=object_id,
-            additional_properties=event,
-            created_at=created_at,
-        )
+        return {
+            "org_id": org_id,
+            "user_id": user_id,
+            "action": action,
+            "object_type": object_type,
+            "object_id": object_id,
+            "additional_properties": event,
+            "created_at": created_at,
+        }
+
+    @classmethod
+    def record(cls, event):
+        event = cls(**cls.values_from_raw(event))
         db.session.add(event)
         return event
 
+    @classmethod
+    def record_many(cls, events):
+        """
+        Inserts the raw events with a single multi-row INSERT, bypassing the ORM. Returns the
+        inserted values in the same shape as to_dict(), for forwarding.
+        """
+        rows = [cls.values_from_raw(event) for event in events]
+        if rows:
+            db.session.execute(cls.__table__.insert().values(rows))
+
+        return [dict(row, created_at=row["created_at"].replace(tzinfo=pytz.utc).isoformat()) for row in rows]
+
 
 @generic_repr("id", "created_by_id", "org_id", "active")
 class ApiKey(TimestampMixin, GFKBase, db.Model):
@@ -1338,6 +1678,40 @@ class ApiKey(TimestampMixin, GFKBase, db.Model):
         return k
 
 
+def _api_key_fields(target):
+    # Both the previous and the new key, so a regenerated key stops resolving right away.
+    api_keys = set(inspect(target).attrs.api_key.history.sum())
+    return [principal_cache.api_key_field(api_key) for api_key in api_keys if api_key]
+
+
+@listens_for(User, "after_update")
+@listens_for(User, "after_delete")
+@listens_for(ApiKey, "after_update")
+@listens_for(ApiKey, "after_delete")
+def invalidate_api_key_principal(mapper, connection, target):
+    principal_cache.invalidate(target.org_id, _api_key_fields(target))
+
+
+@listens_for(Query, "after_update")
+@listens_for(Query, "after_delete")
+def invalidate_query_principal(mapper, connection, target):
+    principal_cache.invalidate(target.org_id, _api_key_fields(target) + [principal_cache.query_field(target.id)])
+
+
+@listens_for(Group, "after_update")
+@listens_for(Group, "after_delete")
+def invalidate_group_principals(mapper, connection, target):
+    principal_cache.invalidate_org(target.org_id)
+
+
+@listens_for(DataSourceGroup, "after_insert")
+@listens_for(DataSourceGroup, "after_update")
+@listens_for(DataSourceGroup, "after_delete")
+def invalidate_data_source_group_principals(mapper, connection, target):
+    org_id = connection.execute(select([Group.org_id]).where(Group.id == target.group_id)).scalar()
+    principal_cache.invalidate_org(org_id)
+
+
 @generic_repr("id", "name", "type", "user_id", "org_id", "created_at")
 class NotificationDestination(BelongsToOrgMixin, db.Model):
     id = primary_key("NotificationDestination")
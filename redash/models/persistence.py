@@ -0,0 +1,155 @@
+from redash.utils import columnar, json_dumps, json_loads
+
+
+def deserialize_query_result_data(value):
+    if not value:
+        return value
+
+    if columnar.is_columnar(value):
+        return columnar.decode(value)
+
+    return json_loads(value)
+
+
+def _sort_key(value):
+    return (0, "") if value is None else (1, value)
+
+
+def _sort_indices(indices, order_by):
+    """
+    Sort row indices by `order_by`, a list of (values, descending) tuples. Columns mixing
+    incomparable types are ordered by their values' text.
+    """
+    for values, descending in reversed(order_by):
+        try:
+            indices.sort(key=lambda i: _sort_key(values[i]), reverse=descending)
+        except TypeError:
+            indices.sort(key=lambda i: _sort_key(None if values[i] is None else str(values[i])), reverse=descending)
+
+    return indices
+
+
+class DBPersistence:
+    """
+    Stores QueryResult's data as JSON text in the query_results.data column.
+
+    Reading is format-agnostic, so switching the persistence class back and forth
+    keeps previously stored results readable.
+    """
+
+    def serialize_data(self, data):
+        return json_dumps(data)
+
+    @property
+    def data(self):
+        raw = self._data
+        cached = getattr(self, "_deserialized_data", None)
+        if cached is None or cached[0] is not raw:
+            cached = (raw, deserialize_query_result_data(raw))
+            self._deserialized_data = cached
+
+        return cached[1]
+
+    @data.setter
+    def data(self, data):
+        self._deserialized_data = None
+        self._columnar_data = None
+        self._data = None if data is None else self.serialize_data(data)
+
+    @property
+    def columnar_data(self):
+        """The ColumnarResult view of the stored data, or None if it isn't stored in the columnar format."""
+        raw = self._data
+        cached = getattr(self, "_columnar_data", None)
+        if cached is None or cached[0] is not raw:
+            cached = (raw, columnar.ColumnarResult(raw) if columnar.is_columnar(raw) else None)
+            self._columnar_data = cached
+
+        return cached[1]
+
+    @property
+    def data_columns(self):
+        result = self.columnar_data
+        if result is not None:
+            return result.columns
+
+        return self.data.get("columns") if self.data else None
+
+    def iter_data_rows(self, names):
+        """
+        Iterate over the rows as tuples of the given columns' values, without materializing
+        row dicts for columnar results.
+        """
+        result = self.columnar_data
+        if result is not None:
+            return zip(*[result.column(name) for name in names])
+
+        return (tuple(row.get(name) for name in names) for row in self.data["rows"])
+
+    def column_values(self, name):
+        """
+        The values of a single column, or None if the result has no rows or no such column. Columnar
+        results only decode that column.
+        """
+        result = self.columnar_data
+        if result is not None:
+            if not result.row_count or name not in result.column_names:
+                return None
+            return result.column(name)
+
+        rows = self.data["rows"] if self.data else None
+        if not rows or name not in rows[0]:
+            return None
+        return [row[name] for row in rows]
+
+    def data_page(self, columns=None, offset=0, limit=None, order_by=None):
+        """
+        Return `limit` rows (all by default) starting at `offset`, projected to `columns` and sorted by
+        `order_by` ((column name, descending) tuples), along with the total row count. Columnar results
+        only decode the projected and sorted columns, and only build the returned rows.
+        """
+        order_by = order_by or []
+        end = None if limit is None else offset + limit
+
+        result = self.columnar_data
+        if result is not None:
+            data = dict(result.extra)
+            all_columns = result.columns
+            total_row_count = result.row_count
+            names = columns or result.column_names
+            values = [result.column(name) for name in names]
+            if order_by:
+                sort_by = [(result.column(name), descending) for name, descending in order_by]
+                indices = _sort_indices(list(range(total_row_count)), sort_by)[offset:end]
+                values = [[column[i] for i in indices] for column in values]
+            else:
+                values = [column[offset:end] for column in values]
+            rows = [dict(zip(names, row)) for row in zip(*values)] if names else []
+        else:
+            data = {k: v for k, v in self.data.items() if k not in ("columns", "rows")}
+            all_columns = self.data["columns"]
+            rows = self.data["rows"]
+            total_row_count = len(rows)
+            if order_by:
+                sort_by = [([row.get(name) for row in rows], descending) for name, descending in order_by]
+                rows = [rows[i] for i in _sort_indices(list(range(total_row_count)), sort_by)]
+            rows = rows[offset:end]
+            if columns:
+                rows = [{name: row.get(name) for name in columns} for row in rows]
+
+        if columns:
+            columns_by_name = {column["name"]: column for column in all_columns}
+            all_columns = [columns_by_name[name] for name in columns]
+
+        data.update({"columns": all_columns, "rows": rows, "total_row_count": total_row_count})
+        return data
+
+
+class ColumnarPersistence(DBPersistence):
+    """
+    Stores QueryResult's data using the compact columnar encoding from redash.utils.columnar,
+    falling back to JSON for results it can't represent losslessly.
+    """
+
+    def serialize_data(self, data):
+        return columnar.encode(data) or json_dumps(data)
@@ -0,0 +1,70 @@
+import hashlib
+import time
+
+from redash import redis_connection, settings, statsd_client
+from redash.utils import json_dumps, json_loads
+
+
+class PrincipalCache:
+    """
+    Redis cache of the principals (users and API users) resolved from API keys and query ids.
+
+    Entries of an organization are kept in one hash, so they can be dropped together when something
+    that affects many of them (groups, data source groups) changes. Each entry carries its own
+    expiry, bounded by AUTH_PRINCIPAL_CACHE_TTL, and the hash expires when it is no longer written.
+    """
+
+    KEY = "auth:principals:{}"
+
+    @property
+    def enabled(self):
+        return settings.AUTH_PRINCIPAL_CACHE_TTL > 0
+
+    @staticmethod
+    def api_key_field(api_key):
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()
+
+    @staticmethod
+    def query_field(query_id):
+        return "query:{}".format(query_id)
+
+    def get(self, org_id, field):
+        if not self.enabled or org_id is None:
+            return None
+
+        entry = redis_connection.hget(self.KEY.format(org_id), field)
+        if entry is not None:
+            entry = json_loads(entry)
+            if entry["expires_at"] > time.time():
+                statsd_client.incr("auth.principal_cache.hit")
+                return entry["principal"]
+
+        statsd_client.incr("auth.principal_cache.miss")
+        return None
+
+    def set(self, org_id, field, principal):
+        if not self.enabled:
+            return
+
+        ttl = settings.AUTH_PRINCIPAL_CACHE_TTL
+        entry = json_dumps({"expires_at": time.time() + ttl, "principal": principal})
+        key = self.KEY.format(org_id)
+        with redis_connection.pipeline() as pipe:
+            pipe.hset(key, field, entry)
+            pipe.expire(key, ttl)
+            pipe.execute()
+
+    def invalidate(self, org_id, fields):
+        if not self.enabled or not fields:
+            return
+
+        redis_connection.hdel(self.KEY.format(org_id), *fields)
+
+    def invalidate_org(self, org_id):
+        if not self.enabled:
+            return
+
+        redis_connection.delete(self.KEY.format(org_id))
+
+
+principal_cache = PrincipalCache()
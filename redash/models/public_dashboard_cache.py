@@ -0,0 +1,38 @@
+import hashlib
+
+from redash import redis_connection, settings, statsd_client
+
+
+class PublicDashboardCache:
+    """
+    Redis cache of serialized public dashboard responses.
+
+    Entries are keyed on the dashboard version and the widgets fingerprint, so any change to the
+    dashboard, its widgets or the visualizations and queries they show is picked up by a new key
+    and the previous one expires after PUBLIC_DASHBOARD_CACHE_TTL.
+    """
+
+    KEY = "public_dashboard:{}:{}"
+
+    @property
+    def enabled(self):
+        return settings.PUBLIC_DASHBOARD_CACHE_ENABLED
+
+    def _key(self, dashboard):
+        fingerprint = "{}:{}".format(dashboard.version, dashboard.widgets_fingerprint())
+        return self.KEY.format(dashboard.id, hashlib.sha1(fingerprint.encode()).hexdigest())
+
+    def get_or_set_response(self, dashboard, serialize):
+        key = self._key(dashboard)
+        response = redis_connection.get(key)
+        if response is None:
+            statsd_client.incr("public_dashboard_cache.miss")
+            response = serialize()
+            redis_connection.set(key, response, ex=settings.PUBLIC_DASHBOARD_CACHE_TTL)
+        else:
+            statsd_client.incr("public_dashboard_cache.hit")
+
+        return response
+
+
+public_dashboard_cache = PublicDashboardCache()
@@ -0,0 +1,107 @@
+import datetime
+
+from redash import redis_connection, settings, statsd_client
+from redash.utils import dt_from_timestamp, utcnow
+
+
+class QueryResultCache:
+    """
+    Redis cache of serialized query result responses.
+
+    Two kinds of entries are kept, both bounded by QUERY_RESULTS_CACHE_TTL:
+
+    * the serialized JSON response for a query result id (results never change, so
+      these only need to be dropped when the result itself is deleted), and
+    * a pointer from (data_source_id, query_hash) to the latest result id and its
+      retrieved_at, which is invalidated whenever a new result is stored.
+    """
+
+    RESPONSE_KEY = "query_result:{}:response"
+    PUBLIC_RESPONSE_KEY = "query_result:{}:response:public"
+    LATEST_KEY = "query_result:latest:{}:{}"
+
+    @property
+    def enabled(self):
+        return settings.QUERY_RESULTS_CACHE_ENABLED
+
+    def _response_key(self, query_result_id, public):
+        return (self.PUBLIC_RESPONSE_KEY if public else self.RESPONSE_KEY).format(query_result_id)
+
+    def get_response(self, query_result_id, public=False):
+        if not self.enabled:
+            return None
+
+        response = redis_connection.get(self._response_key(query_result_id, public))
+        if response is None:
+            statsd_client.incr("query_result_cache.miss")
+        else:
+            statsd_client.incr("query_result_cache.hit")
+            statsd_client.incr("query_result_cache.hit_bytes", len(response))
+
+        return response
+
+    def set_response(self, query_result_id, response, public=False):
+        if not self.enabled:
+            return
+
+        if len(response) > settings.QUERY_RESULTS_CACHE_MAX_ITEM_SIZE:
+            statsd_client.incr("query_result_cache.too_large")
+            return
+
+        redis_connection.set(
+            self._response_key(query_result_id, public), response, ex=settings.QUERY_RESULTS_CACHE_TTL
+        )
+        statsd_client.incr("query_result_cache.stored_bytes", len(response))
+
+    def get_or_set_response(self, query_result_id, serialize, public=False):
+        response = self.get_response(query_result_id, public)
+        if response is None:
+            response = serialize()
+            self.set_response(query_result_id, response, public)
+
+        return response
+
+    def get_latest_id(self, data_source_id, query_hash, max_age):
+        """Return the id of the latest cached result that is no older than max_age seconds, if known."""
+        if not self.enabled:
+            return None
+
+        latest = redis_connection.get(self.LATEST_KEY.format(data_source_id, query_hash))
+        if latest is None:
+            return None
+
+        query_result_id, retrieved_at = latest.split(":")
+
+        if max_age == -1 and settings.QUERY_RESULTS_EXPIRED_TTL_ENABLED:
+            max_age = settings.QUERY_RESULTS_EXPIRED_TTL
+
+        if max_age != -1 and dt_from_timestamp(retrieved_at) + datetime.timedelta(seconds=max_age) < utcnow():
+            return None
+
+        return int(query_result_id)
+
+    def set_latest(self, query_result):
+        if not self.enabled:
+            return
+
+        redis_connection.set(
+            self.LATEST_KEY.format(query_result.data_source_id, query_result.query_hash),
+            "{}:{}".format(query_result.id, query_result.retrieved_at.timestamp()),
+            ex=settings.QUERY_RESULTS_CACHE_TTL,
+        )
+
+    def invalidate_latest(self, data_source_id, query_hash):
+        if not self.enabled:
+            return
+
+        redis_connection.delete(self.LATEST_KEY.format(data_source_id, query_hash))
+
+    def invalidate(self, query_result_ids):
+        if not self.enabled or not query_result_ids:
+            return
+
+        keys = [self._response_key(i, public) for i in query_result_ids for public in (False, True)]
+        redis_connection.delete(*keys)
+
+
+query_result_cache = QueryResultCache()
@@ -0,0 +1,138 @@
+import datetime
+
+from redash import redis_connection, settings
+from redash.utils import json_dumps, json_loads
+
+# Namespace of all the tables of data sources whose runner can't fingerprint its schema.
+ALL_NAMESPACES = ""
+
+
+class SchemaCache:
+    """
+    Redis cache of the data source schemas, with one hash entry per table.
+
+    Tables are grouped in namespaces (e.g. the schemas of a PostgreSQL database). Each namespace
+    entry keeps the fingerprint it was fetched with and the names of its tables, so a refresh only
+    replaces the tables of the namespaces whose fingerprint changed. The table names are also kept
+    in a sorted set, to list them in pages and by prefix without loading the tables.
+    """
+
+    TABLES_KEY = "data_source:schema:{}:tables"
+    NAMESPACES_KEY = "data_source:schema:{}:namespaces"
+    NAMES_KEY = "data_source:schema:{}:names"
+    # How many names search_names reads from Redis at a time.
+    SEARCH_CHUNK_SIZE = 1000
+
+    @property
+    def ttl(self):
+        return int(datetime.timedelta(minutes=settings.SCHEMAS_REFRESH_SCHEDULE, days=7).total_seconds())
+
+    def get(self, data_source_id):
+        """Return the cached tables sorted by name, or None when the schema of the data source isn't cached."""
+        with redis_connection.pipeline() as pipe:
+            pipe.exists(self.NAMESPACES_KEY.format(data_source_id))
+            pipe.hvals(self.TABLES_KEY.format(data_source_id))
+            exists, tables = pipe.execute()
+
+        if not exists:
+            return None
+        return sorted((json_loads(table) for table in tables), key=lambda table: table["name"])
+
+    def exists(self, data_source_id):
+        return bool(redis_connection.exists(self.NAMESPACES_KEY.format(data_source_id)))
+
+    def get_tables(self, data_source_id, names):
+        """Return the cached tables with the given names, skipping unknown ones."""
+        if not names:
+            return []
+        tables = redis_connection.hmget(self.TABLES_KEY.format(data_source_id), names)
+        return [json_loads(table) for table in tables if table is not None]
+
+    def list_names(self, data_source_id, prefix="", after=None, limit=100):
+        """
+        Return up to `limit` table names starting with `prefix`, in order, after the name `after`
+        (the last name of the previous page).
+        """
+        start = "[" + prefix if prefix else "-"
+        if after is not None and after >= prefix:
+            start = "(" + after
+        # The first string after all those starting with prefix; UTF-8 sorts like code points.
+        end = "(" + prefix[:-1] + chr(ord(prefix[-1]) + 1) if prefix else "+"
+        return redis_connection.zrangebylex(self.NAMES_KEY.format(data_source_id), start, end, start=0, num=limit)
+
+    def search_names(self, data_source_id, term, after=None, limit=100):
+        """
+        Return up to `limit` table names containing `term`, ignoring case, in order, after the name `after`.
+
+        Redis can't match substrings, so the names after `after` are read in order, SEARCH_CHUNK_SIZE
+        at a time, until `limit` of them matched. A term that matches few tables reads all of them:
+        one round trip per SEARCH_CHUNK_SIZE tables of the data source.
+        """
+        term = term.lower()
+        key = self.NAMES_KEY.format(data_source_id)
+        start = "(" + after if after is not None else "-"
+        matches = []
+        while len(matches) < limit:
+            names = redis_connection.zrangebylex(key, start, "+", start=0, num=self.SEARCH_CHUNK_SIZE)
+            matches.extend(name for name in names if term in name.lower())
+            if len(names) < self.SEARCH_CHUNK_SIZE:
+                break
+            start = "(" + names[-1]
+        return matches[:limit]
+
+    def count(self, data_source_id):
+        return redis_connection.zcard(self.NAMES_KEY.format(data_source_id))
+
+    def get_fingerprints(self, data_source_id):
+        entries = redis_connection.hgetall(self.NAMESPACES_KEY.format(data_source_id))
+        return {namespace: json_loads(entry)["fingerprint"] for namespace, entry in entries.items()}
+
+    def update(self, data_source_id, tables, fingerprints, removed=()):
+        """
+        Replace the tables of the namespaces in `tables` ({namespace: [table, ...]}) and remember
+        their `fingerprints`; the namespaces in `removed` are dropped with their tables.
+        """
+        tables_key = self.TABLES_KEY.format(data_source_id)
+        namespaces_key = self.NAMESPACES_KEY.format(data_source_id)
+        names_key = self.NAMES_KEY.format(data_source_id)
+
+        replaced = list(tables) + list(removed)
+        stale = set()
+        if replaced:
+            for entry in redis_connection.hmget(namespaces_key, replaced):
+                if entry is not None:
+                    stale.update(json_loads(entry)["tables"])
+
+        new_tables = {table["name"]: json_dumps(table) for namespace in tables for table in tables[namespace]}
+        stale.difference_update(new_tables)
+        namespaces = {
+            namespace: json_dumps(
+                {"fingerprint": fingerprints.get(namespace), "tables": [table["name"] for table in tables[namespace]]}
+            )
+            for namespace in tables
+        }
+
+        with redis_connection.pipeline() as pipe:
+            if stale:
+                pipe.hdel(tables_key, *stale)
+                pipe.zrem(names_key, *stale)
+            if new_tables:
+                pipe.hset(tables_key, mapping=new_tables)
+                pipe.zadd(names_key, dict.fromkeys(new_tables, 0))
+            if removed:
+                pipe.hdel(namespaces_key, *removed)
+            if namespaces:
+                pipe.hset(namespaces_key, mapping=namespaces)
+            for key in (tables_key, namespaces_key, names_key):
+                pipe.expire(key, self.ttl)
+            pipe.execute()
+
+    def delete(self, data_source_id):
+        redis_connection.delete(
+            self.TABLES_KEY.format(data_source_id),
+            self.NAMESPACES_KEY.format(data_source_id),
+            self.NAMES_KEY.format(data_source_id),
+        )
+
+
+schema_cache = SchemaCache()
@@ -21,12 +21,14 @@ def has_access(obj, user, need_view_only):
         return has_access_to_groups(obj, user, need_view_only)
 
 
-def has_access_to_object(obj, api_key, need_view_only):
+def has_access_to_object(obj, api_key, need_view_only, dashboard_api_keys=None):
     if obj.api_key == api_key:
         return need_view_only
-    elif hasattr(obj, "dashboard_api_keys"):
+    elif dashboard_api_keys is not None or hasattr(obj, "dashboard_api_keys"):
         # check if api_key belongs to a dashboard containing this query
-        return api_key in obj.dashboard_api_keys and need_view_only
+        if dashboard_api_keys is None:
+            dashboard_api_keys = obj.dashboard_api_keys
+        return api_key in dashboard_api_keys and need_view_only
     else:
         return False
 
@@ -37,7 +39,11 @@ def has_access_to_groups(obj, user, need_view_only):
     if "admin" in user.permissions:
         return True
 
-    matching_groups = set(groups.keys()).intersection(user.group_ids)
+    return groups_grant_access(groups, user.group_ids, need_view_only)
+
+
+def groups_grant_access(groups, group_ids, need_view_only):
+    matching_groups = set(groups.keys()).intersection(group_ids)
 
     if not matching_groups:
         return False
@@ -1,12 +1,12 @@
 import logging
+import re
 from collections import defaultdict
 from contextlib import ExitStack
-from functools import wraps
+from functools import lru_cache, wraps
 
 import sqlparse
 from dateutil import parser
 from rq.timeouts import JobTimeoutException
-from sshtunnel import open_tunnel
 
 from redash import settings, utils
 from redash.utils.requests_session import (
@@ -47,7 +47,15 @@ TYPE_DATE = "date"
 SUPPORTED_COLUMN_TYPES = set([TYPE_INTEGER, TYPE_FLOAT, TYPE_BOOLEAN, TYPE_STRING, TYPE_DATETIME, TYPE_DATE])
 
 
+# Anything that can make sqlparse split a text into several statements or strip parts of it.
+STATEMENT_SEPARATORS_REGEX = re.compile(r";|--|/\*|#|\bGO\b", re.IGNORECASE)
+
+
 def split_sql_statements(query):
+    # Texts without separators or comments are a single statement, so there is nothing to parse.
+    if not STATEMENT_SEPARATORS_REGEX.search(query):
+        return [query.strip()]
+
     def strip_trailing_comments(stmt):
         idx = len(stmt.tokens) - 1
         while idx >= 0:
@@ -105,6 +113,54 @@ def find_last_keyword_idx(parsed_query):
     return -1
 
 
+def query_is_select_no_limit(parsed_query, limit_keywords):
+    last_keyword_idx = find_last_keyword_idx(parsed_query)
+    # Either invalid query or query that is not select
+    if last_keyword_idx == -1 or parsed_query.tokens[0].value.upper() != "SELECT":
+        return False
+
+    no_limit = parsed_query.tokens[last_keyword_idx].value.upper() not in limit_keywords
+
+    return no_limit
+
+
+def add_limit_to_query(parsed_query, limit_query, limit_after_select):
+    limit_tokens = sqlparse.parse(limit_query)[0].tokens
+    length = len(parsed_query.tokens)
+    if not limit_after_select:
+        if parsed_query.tokens[length - 1].ttype == sqlparse.tokens.Punctuation:
+            parsed_query.tokens[length - 1 : length - 1] = limit_tokens
+        else:
+            parsed_query.tokens += limit_tokens
+    else:
+        for i in range(length - 1, -1, -1):
+            if parsed_query[i].value.upper() == "SELECT":
+                index = parsed_query.token_index(parsed_query[i + 1])
+                parsed_query = sqlparse.sql.Statement(
+                    parsed_query.tokens[:index] + limit_tokens + parsed_query.tokens[index:]
+                )
+                break
+    return str(parsed_query)
+
+
+@lru_cache(maxsize=settings.QUERY_AUTO_LIMIT_CACHE_SIZE)
+def apply_auto_limit(query_text, should_apply_auto_limit, limit_query, limit_keywords, limit_after_select):
+    """
+    Split query_text into statements and add limit_query to the last one if it's a select without a limit.
+
+    The same texts come back over and over (every query save, execution and scheduled refresh),
+    so the results are memoized on the text and the runner's limit settings.
+    """
+    queries = split_sql_statements(query_text)
+    # Only selects get a limit, so anything else doesn't need the (slow) full parse.
+    if should_apply_auto_limit and queries[-1][:6].upper() == "SELECT":
+        # we only check for last one in the list because it is the one that we show result
+        parsed_query = sqlparse.parse(queries[-1])[0]
+        if query_is_select_no_limit(parsed_query, limit_keywords):
+            queries[-1] = add_limit_to_query(parsed_query, limit_query, limit_after_select)
+    return combine_sql_statements(queries)
+
+
 class InterruptException(Exception):
     pass
 
@@ -120,6 +176,7 @@ class BaseQueryRunner:
     limit_query = " LIMIT 1000"
     limit_keywords = ["LIMIT", "OFFSET"]
     limit_after_select = False
+    uses_ssh_tunnel = False
 
     def __init__(self, configuration):
         self.syntax = "sql"
@@ -212,6 +269,14 @@ class BaseQueryRunner:
     def run_query(self, query, user):
         raise NotImplementedError()
 
+    def cancel(self):
+        """
+        Cancel the query this runner is executing (from another thread).
+
+        Returns False when the runner can't cancel running queries, or isn't running one.
+        """
+        return False
+
     def fetch_columns(self, columns):
         column_names = set()
         duplicates_counters = defaultdict(int)
@@ -231,6 +296,19 @@ class BaseQueryRunner:
     def get_schema(self, get_stats=False):
         raise NotSupported()
 
+    def get_schema_fingerprints(self):
+        """
+        Return {namespace: fingerprint} for the namespaces (e.g. database schemas) of the data
+        source, where a fingerprint changes whenever a table or column of its namespace changes.
+        Runners that implement it must implement get_namespace_schema too, and their schema is
+        refreshed incrementally.
+        """
+        raise NotSupported()
+
+    def get_namespace_schema(self, namespaces):
+        """Return the tables of the given namespaces, like get_schema does, as {namespace: [table, ...]}."""
+        raise NotSupported()
+
     def _handle_run_query_error(self, error):
         if error is None:
             return
@@ -288,43 +366,19 @@ class BaseSQLQueryRunner(BaseQueryRunner):
         return True
 
     def query_is_select_no_limit(self, query):
-        parsed_query = sqlparse.parse(query)[0]
-        last_keyword_idx = find_last_keyword_idx(parsed_query)
-        # Either invalid query or query that is not select
-        if last_keyword_idx == -1 or parsed_query.tokens[0].value.upper() != "SELECT":
-            return False
-
-        no_limit = parsed_query.tokens[last_keyword_idx].value.upper() not in self.limit_keywords
-
-        return no_limit
+        return query_is_select_no_limit(sqlparse.parse(query)[0], self.limit_keywords)
 
     def add_limit_to_query(self, query):
-        parsed_query = sqlparse.parse(query)[0]
-        limit_tokens = sqlparse.parse(self.limit_query)[0].tokens
-        length = len(parsed_query.tokens)
-        if not self.limit_after_select:
-            if parsed_query.tokens[length - 1].ttype == sqlparse.tokens.Punctuation:
-                parsed_query.tokens[length - 1 : length - 1] = limit_tokens
-            else:
-                parsed_query.tokens += limit_tokens
-        else:
-            for i in range(length - 1, -1, -1):
-                if parsed_query[i].value.upper() == "SELECT":
-                    index = parsed_query.token_index(parsed_query[i + 1])
-                    parsed_query = sqlparse.sql.Statement(
-                        parsed_query.tokens[:index] + limit_tokens + parsed_query.tokens[index:]
-                    )
-                    break
-        return str(parsed_query)
+        return add_limit_to_query(sqlparse.parse(query)[0], self.limit_query, self.limit_after_select)
 
     def apply_auto_limit(self, query_text, should_apply_auto_limit):
-        queries = split_sql_statements(query_text)
-        if should_apply_auto_limit:
-            # we only check for last one in the list because it is the one that we show result
-            last_query = queries[-1]
-            if self.query_is_select_no_limit(last_query):
-                queries[-1] = self.add_limit_to_query(last_query)
-        return combine_sql_statements(queries)
+        return apply_auto_limit(
+            query_text,
+            bool(should_apply_auto_limit),
+            self.limit_query,
+            tuple(self.limit_keywords),
+            self.limit_after_select,
+        )
 
 
 class BaseHTTPQueryRunner(BaseQueryRunner):
@@ -486,6 +540,9 @@ def guess_type_from_string(string_value):
 
 
 def with_ssh_tunnel(query_runner, details):
+    # Imported here, as it needs the statsd client redash sets up after importing this module.
+    from redash.query_runner.ssh_tunnel_pool import ssh_tunnel_pool
+
     def tunnel(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
@@ -502,13 +559,13 @@ def with_ssh_tunnel(query_runner, details):
                     "ssh_username": details["ssh_username"],
                     **settings.dynamic_settings.ssh_tunnel_auth(),
                 }
-                server = stack.enter_context(open_tunnel(bastion_address, remote_bind_address=remote_address, **auth))
+                local_address = stack.enter_context(ssh_tunnel_pool.tunnel(bastion_address, remote_address, auth))
             except Exception as error:
                 raise type(error)("SSH tunnel: {}".format(str(error)))
 
             with stack:
                 try:
-                    query_runner.host, query_runner.port = server.local_bind_address
+                    query_runner.host, query_runner.port = local_address
                     result = f(*args, **kwargs)
                 finally:
                     query_runner.host, query_runner.port = remote_host, remote_port
@@ -518,5 +575,6 @@ def with_ssh_tunnel(query_runner, details):
         return wrapper
 
     query_runner.run_query = tunnel(query_runner.run_query)
+    query_runner.uses_ssh_tunnel = True
 
     return query_runner
@@ -0,0 +1,161 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from redash import settings, statsd_client
+from redash.utils import json_dumps
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """
+    Per-process pool of query runner connections, for workers that run many jobs in the same
+    process. Idle connections are kept per runner type and options, reset before they are pooled
+    again, checked when they were idle for a while and closed after QUERY_RUNNER_POOL_MAX_IDLE_TIME
+    (by sweep(), which runs when connections are returned to the pool and which long-lived workers
+    also call periodically, see ThreadedWorker.monitor_jobs).
+
+    Connections are only pooled when QUERY_RUNNER_POOL_ENABLED is set; otherwise every query gets
+    a new connection, which is closed afterwards.
+    """
+
+    def __init__(self):
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._idle = defaultdict(deque)
+
+    @property
+    def enabled(self):
+        return settings.QUERY_RUNNER_POOL_ENABLED
+
+    @staticmethod
+    def key(runner, configuration):
+        options = configuration.to_dict() if hasattr(configuration, "to_dict") else configuration
+        digest = hashlib.sha256(json_dumps(options, sort_keys=True).encode()).hexdigest()
+        return "{}:{}".format(runner.type(), digest)
+
+    @contextmanager
+    def connection(self, key, connect, reset, ping, close):
+        """
+        Yield an idle connection pooled under `key`, or a new one from `connect()`.
+
+        `reset(connection)` clears the session state before the connection is pooled again and
+        `ping(connection)` checks connections that were idle for a while; both raise when the
+        connection isn't usable. Connections are closed with `close(connection)` instead of being
+        pooled when the block raises, or when `key` is None.
+        """
+        if not self.enabled or key is None:
+            connection = connect()
+            try:
+                yield connection
+            finally:
+                self._close(connection, close)
+            return
+
+        connection = self._checkout(key, ping)
+        if connection is None:
+            connection = connect()
+
+        try:
+            yield connection
+        except BaseException:
+            self._close(connection, close)
+            raise
+
+        self._checkin(key, connection, reset, close)
+
+    def _checkout(self, key, ping):
+        self._check_pid()
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    statsd_client.incr("query_runner.pool.miss")
+                    return None
+                connection, released_at, close = idle.pop()
+
+            idle_time = time.monotonic() - released_at
+            if idle_time > settings.QUERY_RUNNER_POOL_MAX_IDLE_TIME:
+                self._close(connection, close)
+                continue
+
+            if idle_time > settings.QUERY_RUNNER_POOL_PING_AFTER:
+                try:
+                    ping(connection)
+                except Exception:
+                    logger.info("Discarding pooled connection that failed its health check", exc_info=True)
+                    self._close(connection, close)
+                    continue
+
+            statsd_client.incr("query_runner.pool.hit")
+            return connection
+
+    def _checkin(self, key, connection, reset, close):
+        try:
+            reset(connection)
+        except Exception:
+            logger.info("Discarding connection that failed to reset", exc_info=True)
+            self._close(connection, close)
+            return
+
+        with self._lock:
+            idle = self._idle[key]
+            pooled = len(idle) < settings.QUERY_RUNNER_POOL_MAX_SIZE
+            if pooled:
+                idle.append((connection, time.monotonic(), close))
+
+        if not pooled:
+            self._close(connection, close)
+        self.sweep()
+
+    def sweep(self):
+        """
+        Close the connections that were idle for over QUERY_RUNNER_POOL_MAX_IDLE_TIME, including
+        those left behind by keys that aren't used anymore (e.g. data sources whose options changed).
+        """
+        self._check_pid()
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key in list(self._idle):
+                connections = self._idle[key]
+                while connections and now - connections[0][1] > settings.QUERY_RUNNER_POOL_MAX_IDLE_TIME:
+                    connection, _, close = connections.popleft()
+                    expired.append((connection, close))
+                if not connections:
+                    del self._idle[key]
+
+        for connection, close in expired:
+            self._close(connection, close)
+
+    def _check_pid(self):
+        # Connections inherited from a parent process share its sockets, so a forked process
+        # forgets them instead of using (or closing) them.
+        if self._pid != os.getpid():
+            self._reset_state()
+
+    @staticmethod
+    def _close(connection, close):
+        try:
+            close(connection)
+        except Exception:
+            logger.debug("Failed closing connection", exc_info=True)
+
+    def clear(self):
+        self._check_pid()
+        with self._lock:
+            connections = [(connection, close) for idle in self._idle.values() for connection, _, close in idle]
+            self._idle.clear()
+        for connection, close in connections:
+            self._close(connection, close)
+
+
+connection_pool = ConnectionPool()
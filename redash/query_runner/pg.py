@@ -18,8 +18,10 @@ from redash.query_runner import (
     BaseSQLQueryRunner,
     InterruptException,
     JobTimeoutException,
+    NotSupported,
     register,
 )
+from redash.query_runner.connection_pool import connection_pool
 
 logger = logging.getLogger(__name__)
 
@@ -78,7 +80,7 @@ def full_table_name(schema, name):
     return "{}.{}".format(schema, name)
 
 
-def build_schema(query_result, schema):
+def build_schema(query_result, schema, namespaces=None):
     # By default we omit the public schema name from the table name. But there are
     # edge cases, where this might cause conflicts. For example:
     # * We have a schema named "main" with table "users".
@@ -104,6 +106,8 @@ def build_schema(query_result, schema):
 
         if table_name not in schema:
             schema[table_name] = {"name": table_name, "columns": []}
+            if namespaces is not None:
+                namespaces[table_name] = row["table_schema"]
 
         column = row["column_name"]
         if row.get("data_type") is not None:
@@ -140,6 +144,11 @@ def _get_ssl_config(configuration):
 
 class PostgreSQL(BaseSQLQueryRunner):
     noop_query = "SELECT 1"
+    # Clears the session state (settings, temporary tables, prepared statements, ...) a query left
+    # behind, before its connection is pooled for the next one. Runners without it don't pool.
+    connection_reset_query = "DISCARD ALL"
+    # The connection run_query is executing a query on, for cancel() to cancel it.
+    _running_connection = None
 
     @classmethod
     def configuration_schema(cls):
@@ -195,15 +204,15 @@ class PostgreSQL(BaseSQLQueryRunner):
             return "".join(items)
         return None
 
-    def _get_definitions(self, schema, query):
+    def _get_definitions(self, schema, query, namespaces=None):
         results, error = self.run_query(query, None)
 
         if error is not None:
             self._handle_run_query_error(error)
 
-        build_schema(results, schema)
+        build_schema(results, schema, namespaces)
 
-    def _get_tables(self, schema):
+    def _tables_query(self, namespaces=None):
         """
         relkind constants per https://www.postgresql.org/docs/10/static/catalog-pg-class.html
         r = regular table
@@ -218,7 +227,13 @@ class PostgreSQL(BaseSQLQueryRunner):
         c = composite type
         """
 
-        query = """
+        catalog_filter = columns_filter = ""
+        if namespaces is not None:
+            names = ", ".join("'{}'".format(namespace.replace("'", "''")) for namespace in namespaces)
+            catalog_filter = "AND s.nspname IN ({})".format(names)
+            columns_filter = "AND table_schema IN ({})".format(names)
+
+        return """
         SELECT s.nspname as table_schema,
                c.relname as table_name,
                a.attname as column_name,
@@ -227,6 +242,7 @@ class PostgreSQL(BaseSQLQueryRunner):
         JOIN pg_namespace s
         ON c.relnamespace = s.oid
         AND s.nspname NOT IN ('pg_catalog', 'information_schema')
+        {catalog_filter}
         JOIN pg_attribute a
         ON a.attrelid = c.oid
         AND a.attnum > 0
@@ -243,12 +259,62 @@ class PostgreSQL(BaseSQLQueryRunner):
                data_type
         FROM information_schema.columns
         WHERE table_schema NOT IN ('pg_catalog', 'information_schema')
-        """
+        {columns_filter}
+        """.format(
+            catalog_filter=catalog_filter, columns_filter=columns_filter
+        )
 
-        self._get_definitions(schema, query)
+    def _get_tables(self, schema):
+        self._get_definitions(schema, self._tables_query())
 
         return list(schema.values())
 
+    def get_schema_fingerprints(self):
+        # Hashes the definitions of the tables of each schema in the catalog, so only one row per
+        # schema is transferred. The fingerprints cover every table the tables query might return
+        # (and the table and schema ACLs, for grants), so a schema whose tables changed or became
+        # visible is never missed. Aggregating per table first, ordered by integers, keeps it
+        # cheap on catalogs with hundreds of thousands of columns.
+        query = """
+        SELECT table_schema,
+               md5(string_agg(definition, ',' ORDER BY oid) || schema_acl) as fingerprint
+        FROM (
+            SELECT s.nspname as table_schema,
+                   coalesce(s.nspacl::text, '') as schema_acl,
+                   c.oid,
+                   c.relname || ':' || coalesce(c.relacl::text, '') || ':'
+                   || string_agg(a.attname || ':' || a.atttypid || ':' || a.atttypmod, ',' ORDER BY a.attnum)
+                   as definition
+            FROM pg_class c
+            JOIN pg_namespace s
+            ON c.relnamespace = s.oid
+            AND s.nspname NOT IN ('pg_catalog', 'information_schema')
+            JOIN pg_attribute a
+            ON a.attrelid = c.oid
+            AND a.attnum > 0
+            AND NOT a.attisdropped
+            WHERE c.relkind IN ('r', 'v', 'm', 'f', 'p')
+            GROUP BY s.nspname, s.nspacl::text, c.oid
+        ) tables
+        GROUP BY table_schema, schema_acl
+        """
+        results, error = self.run_query(query, None)
+
+        if error is not None:
+            self._handle_run_query_error(error)
+
+        return {row["table_schema"]: row["fingerprint"] for row in results["rows"]}
+
+    def get_namespace_schema(self, namespaces):
+        schema = {}
+        table_namespaces = {}
+        self._get_definitions(schema, self._tables_query(namespaces), table_namespaces)
+
+        tables = {namespace: [] for namespace in namespaces}
+        for table_name, table in schema.items():
+            tables[table_namespaces[table_name]].append(table)
+        return tables
+
     def _get_connection(self):
         self.ssl_config = _get_ssl_config(self.configuration)
         connection = psycopg2.connect(
@@ -263,37 +329,75 @@ class PostgreSQL(BaseSQLQueryRunner):
 
         return connection
 
-    def run_query(self, query, user):
+    def _connect(self):
         connection = self._get_connection()
-        _wait(connection, timeout=10)
+        try:
+            _wait(connection, timeout=10)
+        except BaseException:
+            connection.close()
+            raise
+        finally:
+            # The certificates are only read while connecting.
+            _cleanup_ssl_certs(self.ssl_config)
 
-        cursor = connection.cursor()
+        return connection
 
-        try:
-            cursor.execute(query)
-            _wait(connection)
+    def _execute(self, connection, query):
+        cursor = connection.cursor()
+        cursor.execute(query)
+        _wait(connection, timeout=10)
+        cursor.close()
+
+    def _pooled_connection(self):
+        key = None
+        if self.connection_reset_query is not None and not self.uses_ssh_tunnel:
+            key = connection_pool.key(self, self.configuration)
+
+        return connection_pool.connection(
+            key,
+            self._connect,
+            reset=lambda connection: self._execute(connection, self.connection_reset_query),
+            ping=lambda connection: self._execute(connection, self.noop_query),
+            close=lambda connection: connection.close(),
+        )
 
-            if cursor.description is not None:
-                columns = self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in cursor.description])
-                rows = [dict(zip((column["name"] for column in columns), row)) for row in cursor]
+    def cancel(self):
+        connection = self._running_connection
+        if connection is None:
+            return False
+        connection.cancel()
+        return True
 
-                data = {"columns": columns, "rows": rows}
-                error = None
-            else:
-                error = "Query completed but it returned no data."
+    def run_query(self, query, user):
+        with self._pooled_connection() as connection:
+            cursor = connection.cursor()
+
+            try:
+                self._running_connection = connection
+                cursor.execute(query)
+                # Wake up every second, for threaded workers to interrupt the query (see ThreadedWorker).
+                _wait(connection, timeout=1)
+
+                if cursor.description is not None:
+                    columns = self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in cursor.description])
+                    rows = [dict(zip((column["name"] for column in columns), row)) for row in cursor]
+
+                    data = {"columns": columns, "rows": rows}
+                    error = None
+                else:
+                    error = "Query completed but it returned no data."
+                    data = None
+            except (select.error, OSError):
+                error = "Query interrupted. Please retry."
                 data = None
-        except (select.error, OSError):
-            error = "Query interrupted. Please retry."
-            data = None
-        except psycopg2.DatabaseError as e:
-            error = str(e)
-            data = None
-        except (KeyboardInterrupt, InterruptException, JobTimeoutException):
-            connection.cancel()
-            raise
-        finally:
-            connection.close()
-            _cleanup_ssl_certs(self.ssl_config)
+            except psycopg2.DatabaseError as e:
+                error = str(e)
+                data = None
+            except (KeyboardInterrupt, InterruptException, JobTimeoutException):
+                connection.cancel()
+                raise
+            finally:
+                self._running_connection = None
 
         return data, error
 
@@ -375,6 +479,13 @@ class Redshift(PostgreSQL):
 
         return annotated
 
+    # Redshift doesn't support DISCARD, so its connections aren't pooled.
+    connection_reset_query = None
+
+    def get_schema_fingerprints(self):
+        # Redshift has no string_agg/format_type, so its schema is always refreshed in full.
+        raise NotSupported()
+
     def _get_tables(self, schema):
         # Use svv_columns to include internal & external (Spectrum) tables and views data for Redshift
         # https://docs.aws.amazon.com/redshift/latest/dg/r_SVV_COLUMNS.html
@@ -544,6 +655,9 @@ class CockroachDB(PostgreSQL):
     def type(cls):
         return "cockroach"
 
+    def get_schema_fingerprints(self):
+        raise NotSupported()
+
 
 register(PostgreSQL)
 register(Redshift)
@@ -9,9 +9,14 @@ Prometheus查询运行器实现
 4. 自动处理时间范围(now、时间戳转换等)
 """
 
+import hashlib
+import math
 import os
+import re
+import threading
 import time
 from base64 import b64decode
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from tempfile import NamedTemporaryFile
 from urllib.parse import parse_qs
@@ -19,12 +24,14 @@ from urllib.parse import parse_qs
 import requests
 from dateutil import parser
 
+from redash import redis_connection, settings, statsd_client
 from redash.query_runner import (
     TYPE_DATETIME,
     TYPE_STRING,
     BaseQueryRunner,
     register,
 )
+from redash.utils import json_dumps, json_loads
 
 import logging
 
@@ -99,6 +106,124 @@ def convert_query_range(payload):
     payload.update(query_range)
 
 
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, "y": 31536000}
+DURATION_REGEX = re.compile(r"(\d+)(ms|s|m|h|d|w|y)")
+
+
+def parse_step(value):
+    """
+    解析 step 参数（如 "60"、"1.5"、"1m30s"）
+    :param value: step 参数
+    :return: 秒数，无法解析时返回 None
+    """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    parts = DURATION_REGEX.findall(value)
+    if not parts or "".join(number + unit for number, unit in parts) != value:
+        return None
+    return sum(int(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+
+class RangeQueryCache:
+    """
+    Prometheus 范围查询结果缓存（Redis）。
+
+    按 (Prometheus 地址, 查询参数, step) 缓存对齐到 step 边界的时间序列。Prometheus 在 start + k * step
+    处计算范围查询，因此时间范围对齐到 step 后，每个点的值与查询的时间范围无关：刷新相同查询时只需拉取
+    缓存没有覆盖的尾部（和头部）再合并。最近 PROMETHEUS_RANGE_CACHE_SETTLE_TIME 秒内的点可能还会变化
+    （数据延迟写入），不会被复用。
+    """
+
+    KEY = "prometheus:range:{}"
+
+    @property
+    def enabled(self):
+        return settings.PROMETHEUS_RANGE_CACHE_ENABLED
+
+    def key(self, url, payload):
+        params = {name: value for name, value in payload.items() if name not in ("start", "end")}
+        digest = hashlib.sha256(json_dumps({"url": url, "params": params}, sort_keys=True).encode()).hexdigest()
+        return self.KEY.format(digest)
+
+    def get(self, key):
+        entry = redis_connection.get(key)
+        return json_loads(entry) if entry is not None else None
+
+    def set(self, key, entry):
+        redis_connection.set(key, json_dumps(entry), ex=settings.PROMETHEUS_RANGE_CACHE_TTL)
+
+
+range_query_cache = RangeQueryCache()
+
+
+def merge_series(series, metrics, start, end):
+    """
+    将 metrics 中 [start, end] 内的点合并到 series（{标签: {"metric": 标签, "values": {时间戳: 值}}}）
+    """
+    for metric in metrics:
+        labels = json_dumps(metric["metric"], sort_keys=True)
+        values = series.setdefault(labels, {"metric": metric["metric"], "values": {}})["values"]
+        for timestamp, value in metric["values"]:
+            if start <= timestamp <= end:
+                values[timestamp] = value
+
+
+def series_metrics(series):
+    """
+    将 merge_series 合并的时间序列转换回 Prometheus 的 metrics 数据（保持序列首次出现的顺序，点按时间排序）
+    """
+    return [
+        {"metric": metric["metric"], "values": sorted(metric["values"].items())}
+        for metric in series.values()
+        if metric["values"]
+    ]
+
+
+def split_range(start, end, step, shard_size):
+    """
+    将 [start, end] 按 step 对齐拆分为不超过 shard_size 秒的子区间，
+    只剩一个点的末尾区间并入前一个子区间（如 1 天的区间不会多出一个单点请求）
+    :return: 子区间 (start, end) 列表
+    """
+    span = max(1, math.floor(shard_size / step)) * step
+    shards = []
+    while start <= end:
+        shard_end = start + span - step
+        if end < start + span + step:
+            shard_end = end
+        shards.append((start, shard_end))
+        start = shard_end + step
+    return shards
+
+
+class SessionPool:
+    """
+    每个进程一个的 requests.Session，复用到 Prometheus 的 HTTP 连接（fork 出的进程会新建自己的 Session）
+    """
+
+    def __init__(self):
+        self._pid = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                session = requests.Session()
+                size = max(settings.PROMETHEUS_RANGE_SHARD_CONCURRENCY, requests.adapters.DEFAULT_POOLSIZE)
+                adapter = requests.adapters.HTTPAdapter(pool_connections=size, pool_maxsize=size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session, self._pid = session, os.getpid()
+            return self._session
+
+
+sessions = SessionPool()
+
+
 class Prometheus(BaseQueryRunner):
     should_annotate_query = False
 
@@ -235,6 +360,94 @@ class Prometheus(BaseQueryRunner):
 
         return schema
 
+    def _fetch_range(self, api_endpoint, payload, promehteus_kwargs):
+        """
+        请求 Prometheus 范围查询接口
+        :return: 查询结果中的 metrics 数据
+        """
+        response = sessions.get().get(api_endpoint, params=payload, **promehteus_kwargs)
+        response.raise_for_status()
+
+        return response.json()["data"]["result"]
+
+    def _fetch_range_shards(self, api_endpoint, payload, start, end, step, promehteus_kwargs):
+        """
+        将较长的时间范围按 step 对齐拆分为 PROMETHEUS_RANGE_SHARD_SIZE 秒的子区间，
+        以 PROMETHEUS_RANGE_SHARD_CONCURRENCY 个并发请求分别查询后按时间顺序拼接
+        :return: 查询结果中的 metrics 数据
+        """
+        shards = [(start, end)]
+        if settings.PROMETHEUS_RANGE_SHARD_SIZE > 0:
+            shards = split_range(start, end, step, settings.PROMETHEUS_RANGE_SHARD_SIZE)
+        if len(shards) == 1:
+            return self._fetch_range(api_endpoint, dict(payload, start=[start], end=[end]), promehteus_kwargs)
+
+        def fetch(shard):
+            return self._fetch_range(api_endpoint, dict(payload, start=[shard[0]], end=[shard[1]]), promehteus_kwargs)
+
+        concurrency = max(1, min(settings.PROMETHEUS_RANGE_SHARD_CONCURRENCY, len(shards)))
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(fetch, shards))
+
+        series = {}
+        for (shard_start, shard_end), metrics in zip(shards, results):
+            merge_series(series, metrics, shard_start, shard_end)
+        return series_metrics(series)
+
+    def _query_range(self, api_endpoint, payload, promehteus_kwargs):
+        """
+        执行范围查询。启用缓存时把时间范围对齐到 step 边界，只拉取缓存未覆盖的部分并与缓存合并。
+        :return: 查询结果中的 metrics 数据
+        """
+        step = parse_step(payload["step"][0])
+        try:
+            start, end = float(payload["start"][0]), float(payload["end"][0])
+        except (TypeError, ValueError):
+            start = end = None
+
+        if step is None or step <= 0 or start is None:
+            return self._fetch_range(api_endpoint, payload, promehteus_kwargs)
+
+        # 只缓存整数秒的 step
+        if not range_query_cache.enabled or step < 1 or step != int(step):
+            return self._fetch_range_shards(api_endpoint, payload, start, end, step, promehteus_kwargs)
+
+        step = int(step)
+        start = math.ceil(start / step) * step
+        end = math.floor(end / step) * step
+        if start > end:
+            return self._fetch_range(api_endpoint, payload, promehteus_kwargs)
+
+        key = range_query_cache.key(api_endpoint, payload)
+        entry = range_query_cache.get(key)
+
+        series = {}
+        if entry is not None and entry["start"] <= end and entry["stable_end"] >= start:
+            cached_start, cached_end = max(start, entry["start"]), min(end, entry["stable_end"])
+            merge_series(series, entry["series"], cached_start, cached_end)
+            missing = []
+            if start < cached_start:
+                missing.append((start, cached_start - step))
+            if cached_end < end:
+                missing.append((cached_end + step, end))
+            statsd_client.incr("prometheus.range_cache.hit" if not missing else "prometheus.range_cache.partial")
+        else:
+            missing = [(start, end)]
+            statsd_client.incr("prometheus.range_cache.miss")
+
+        for missing_start, missing_end in missing:
+            metrics = self._fetch_range_shards(
+                api_endpoint, payload, missing_start, missing_end, step, promehteus_kwargs
+            )
+            merge_series(series, metrics, missing_start, missing_end)
+
+        metrics = series_metrics(series)
+
+        settled = math.floor((time.time() - settings.PROMETHEUS_RANGE_CACHE_SETTLE_TIME) / step) * step
+        range_query_cache.set(key, {"start": start, "stable_end": min(end, settled), "series": metrics})
+
+        return metrics
+
     def run_query(self, query, user):
         """
         运行查询
@@ -316,10 +529,7 @@ class Prometheus(BaseQueryRunner):
 
             promehteus_kwargs = self._get_prometheus_kwargs()
 
-            response = requests.get(api_endpoint, params=payload, **promehteus_kwargs)
-            response.raise_for_status()
-
-            metrics = response.json()["data"]["result"]
+            metrics = self._query_range(api_endpoint, payload, promehteus_kwargs)
 
             if len(metrics) == 0:
                 return None, "查询结果为空."
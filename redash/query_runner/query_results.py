@@ -3,33 +3,82 @@
 
 该文件实现了将其他查询结果作为数据源的功能，主要特性包括:
 1. 支持引用其他查询结果(query_xxx)和缓存结果(cached_query_xxx)
-2. 提供SQLite内存数据库作为查询引擎
+2. 提供SQLite内存数据库作为查询引擎，可选DuckDB列式引擎(需要duckdb和pyarrow)
 3. 支持参数化查询(param_query_xxx_{params})
 4. 自动处理列名特殊字符和数据类型推断
 5. 严格的权限检查确保数据安全
 """
 
+import contextlib
 import datetime
 import decimal
 import hashlib
 import logging
+import os
 import re
 import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import repeat
 from urllib.parse import parse_qs
+from urllib.request import pathname2url
 
-from redash import models
+from flask import current_app, has_app_context
+
+from redash import models, settings
 from redash.permissions import has_access, view_only
 from redash.query_runner import (
+    TYPE_BOOLEAN,
+    TYPE_DATE,
+    TYPE_DATETIME,
+    TYPE_FLOAT,
+    TYPE_INTEGER,
     TYPE_STRING,
     BaseQueryRunner,
     JobTimeoutException,
     guess_type,
     register,
 )
-from redash.utils import json_dumps
+from redash.utils import interrupt_thread, json_dumps
+
+try:
+    import duckdb
+    import pyarrow
+    import pyarrow.ipc
+
+    duckdb_enabled = True
+except ImportError:
+    duckdb_enabled = False
 
 logger = logging.getLogger(__name__)
 
+ENGINE_SQLITE = "sqlite"
+ENGINE_DUCKDB = "duckdb"
+
+# SQLite's default SQLITE_MAX_ATTACHED.
+SQLITE_MAX_ATTACHED = 10
+
+DUCKDB_TYPES_MAPPING = {
+    "TINYINT": TYPE_INTEGER,
+    "SMALLINT": TYPE_INTEGER,
+    "INTEGER": TYPE_INTEGER,
+    "BIGINT": TYPE_INTEGER,
+    "HUGEINT": TYPE_INTEGER,
+    "UTINYINT": TYPE_INTEGER,
+    "USMALLINT": TYPE_INTEGER,
+    "UINTEGER": TYPE_INTEGER,
+    "UBIGINT": TYPE_INTEGER,
+    "FLOAT": TYPE_FLOAT,
+    "DOUBLE": TYPE_FLOAT,
+    "BOOLEAN": TYPE_BOOLEAN,
+    "DATE": TYPE_DATE,
+    "VARCHAR": TYPE_STRING,
+}
+
 
 class PermissionError(Exception):
     pass
@@ -82,39 +131,143 @@ def get_query_results(user, query_id, bring_from_cache, params=None):
         else:
             raise Exception("No cached result available for query {}.".format(query.id))
     else:
-        query_text = query.query_text
-        if params is not None:
-            query_text = replace_query_parameters(query_text, params)
+        query_runner, query_text = prepare_source_query(query, params)
+        results = run_source_query(query.id, query_runner, query_text, user)
+
+    return results
 
-        results, error = query.data_source.query_runner.run_query(query_text, user)
-        if error:
-            raise Exception("Failed loading results for query id {}.".format(query.id))
+
+def prepare_source_query(query, params=None):
+    query_text = query.query_text
+    if params is not None:
+        query_text = replace_query_parameters(query_text, params)
+
+    return query.data_source.query_runner, query_text
+
+
+def run_source_query(query_id, query_runner, query_text, user):
+    results, error = query_runner.run_query(query_text, user)
+    if error:
+        raise Exception("Failed loading results for query id {}.".format(query_id))
 
     return results
 
 
-def create_tables_from_query_ids(user, connection, query_ids, query_params, cached_query_ids=[]):
+def fetch_query_results(user, sources, load_table):
+    """
+    Run the queries of `sources` ((table_name, query_id, params) tuples) concurrently, and call
+    `load_table(table_name, results)` on the calling thread as each of them completes.
+
+    Each query may run for up to QUERY_RESULTS_SOURCE_TIMEOUT seconds. If one fails or times out,
+    or the job itself times out, the queries still running are cancelled with their query runner's
+    cancel(). Runners that can't cancel a running query get JobTimeoutException raised in their
+    thread instead, which only takes effect once they return to Python code (so their query may
+    keep running on the data source until then); the job doesn't wait for those threads.
+    """
+    if not sources:
+        return
+
+    # Load the queries (and check permissions) here: the database session isn't shared with the pool.
+    jobs = {}
+    for table_name, query_id, params in sources:
+        query = _load_query(user, query_id)
+        jobs[table_name] = (query.id,) + prepare_source_query(query, params)
+
+    app = current_app._get_current_object() if has_app_context() else None
+    running = {}
+    lock = threading.Lock()
+
+    def run(table_name):
+        with lock:
+            running[table_name] = (threading.get_ident(), time.monotonic(), jobs[table_name][1])
+        try:
+            with app.app_context() if app is not None else contextlib.nullcontext():
+                return run_source_query(*jobs[table_name], user)
+        finally:
+            with lock:
+                running.pop(table_name)
+
+    def cancel_running():
+        with lock:
+            for thread_id, _, query_runner in running.values():
+                if not query_runner.cancel():
+                    interrupt_thread(thread_id, JobTimeoutException)
+
+    timeout = settings.QUERY_RESULTS_SOURCE_TIMEOUT
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, min(settings.QUERY_RESULTS_SOURCE_CONCURRENCY, len(jobs))),
+        thread_name_prefix="query_results",
+    )
+    futures = {executor.submit(run, table_name): table_name for table_name in jobs}
+    try:
+        pending = set(futures)
+        while pending:
+            wait_timeout = None
+            if timeout:
+                with lock:
+                    started = [started for _, started, _ in running.values()]
+                wait_timeout = max(0, min(started) + timeout - time.monotonic()) if started else timeout
+
+            done, pending = wait(pending, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                load_table(futures[future], future.result())
+
+            if timeout:
+                with lock:
+                    timed_out = [
+                        table_name
+                        for table_name, (_, started, _) in running.items()
+                        if time.monotonic() - started >= timeout
+                    ]
+                if timed_out:
+                    raise Exception(
+                        "Timed out loading results for query id {} after {} seconds.".format(
+                            jobs[timed_out[0]][0], timeout
+                        )
+                    )
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        cancel_running()
+        executor.shutdown(wait=False)
+        raise
+    else:
+        executor.shutdown()
+
+
+def create_tables_from_query_ids(user, connection, query_ids, query_params, cached_query_ids=[], engine=ENGINE_SQLITE):
+    load_table = TABLE_LOADERS[engine]
+
+    # Cached tables go first: SQLite can't attach databases once the inserts below opened a transaction.
     for query_id in set(cached_query_ids):
-        results = get_query_results(user, query_id, True)
+        query = _load_query(user, query_id)
+        if query.latest_query_data_id is None:
+            raise Exception("No cached result available for query {}.".format(query.id))
+
         table_name = "cached_query_{query_id}".format(query_id=query_id)
-        create_table(connection, table_name, results)
+        load_cached_table(connection, engine, table_name, query)
 
+    sources = []
     for query in set(query_params):
-        results = get_query_results(user, query[0], False, query[1])
         table_hash = hashlib.md5(
             "query_{query}_{hash}".format(query=query[0], hash=query[1]).encode(), usedforsecurity=False
         ).hexdigest()
         table_name = "query_{query_id}_{param_hash}".format(query_id=query[0], param_hash=table_hash)
-        create_table(connection, table_name, results)
+        sources.append((table_name, query[0], query[1]))
 
     for query_id in set(query_ids):
-        results = get_query_results(user, query_id, False)
         table_name = "query_{query_id}".format(query_id=query_id)
-        create_table(connection, table_name, results)
+        sources.append((table_name, query_id, None))
+
+    fetch_query_results(user, sources, lambda table_name, results: load_table(connection, table_name, results))
+
+
+def sanitize_column_name(name):
+    return re.sub(r'[:."\s]', "_", name, flags=re.UNICODE)
 
 
 def fix_column_name(name):
-    return '"{}"'.format(re.sub(r'[:."\s]', "_", name, flags=re.UNICODE))
+    return '"{}"'.format(sanitize_column_name(name))
 
 
 def flatten(value):
@@ -153,6 +306,269 @@ def create_table(connection, table_name, query_results):
         connection.execute(insert_template, values)
 
 
+def to_arrow_array(values):
+    try:
+        return pyarrow.array(values)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, OverflowError):
+        # Mixed types (or integers beyond int64) have no single Arrow type; store them as text.
+        return pyarrow.array([None if value is None else str(value) for value in values], type=pyarrow.string())
+
+
+def arrow_table(query_results):
+    columns = [column["name"] for column in query_results["columns"]]
+    rows = query_results["rows"]
+    arrays = [to_arrow_array([flatten(row.get(column)) for row in rows]) for column in columns]
+    return pyarrow.Table.from_arrays(arrays, names=[sanitize_column_name(column) for column in columns])
+
+
+def create_duckdb_table(connection, table_name, query_results):
+    """
+    Bulk load the results into a DuckDB table, one column at a time.
+    """
+    table = arrow_table(query_results)
+
+    view_name = "{}_arrow".format(table_name)
+    try:
+        connection.register(view_name, table)
+        connection.execute("CREATE TABLE {} AS SELECT * FROM {}".format(table_name, view_name))
+    except duckdb.Error as exc:
+        raise CreateTableError("Error creating table {}: {}".format(table_name, str(exc)))
+    finally:
+        connection.unregister(view_name)
+
+
+def duckdb_column_type(duckdb_type):
+    type_name = str(duckdb_type)
+    if type_name.startswith("DECIMAL"):
+        return TYPE_FLOAT
+    if type_name.startswith("TIMESTAMP"):
+        return TYPE_DATETIME
+
+    return DUCKDB_TYPES_MAPPING.get(type_name, TYPE_STRING)
+
+
+class SQLiteCachedTable:
+    """
+    A query result loaded into its own SQLite database (in memory, or a file in the table cache
+    directory), which executions attach instead of loading the result again.
+    """
+
+    file_extension = "sqlite"
+
+    def __init__(self, uri, size, connection=None):
+        self.uri = uri
+        self.size = size
+        # In-memory databases only live as long as a connection to them is open.
+        self._connection = connection
+
+    @classmethod
+    def load(cls, query_results):
+        uri = "file:redash_cached_table_{}?mode=memory&cache=shared".format(uuid.uuid4().hex)
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        create_table(connection, "data", query_results)
+        connection.commit()
+
+        (page_count,) = connection.execute("PRAGMA page_count").fetchone()
+        (page_size,) = connection.execute("PRAGMA page_size").fetchone()
+        return cls(uri, page_count * page_size, connection)
+
+    @classmethod
+    def open(cls, path):
+        return cls("file:{}?mode=ro".format(pathname2url(path)), os.path.getsize(path))
+
+    @staticmethod
+    def write(path, query_results):
+        connection = sqlite3.connect(path)
+        try:
+            create_table(connection, "data", query_results)
+            connection.commit()
+        finally:
+            connection.close()
+
+    def attach(self, connection, table_name):
+        # Several queries may share a result, and a database can only be attached once.
+        schema = "cached_table_{}".format(hashlib.md5(self.uri.encode(), usedforsecurity=False).hexdigest())
+        attached = [db[1] for db in connection.execute("PRAGMA database_list") if db[1] not in ("main", "temp")]
+
+        if schema in attached:
+            connection.execute("CREATE TEMP VIEW {} AS SELECT * FROM {}.data".format(table_name, schema))
+            return
+
+        connection.execute("ATTACH DATABASE ? AS {}".format(schema), (self.uri,))
+        if len(attached) < SQLITE_MAX_ATTACHED - 1:
+            if self._connection is None:
+                connection.execute("PRAGMA {}.mmap_size = {}".format(schema, self.size))
+            connection.execute("CREATE TEMP VIEW {} AS SELECT * FROM {}.data".format(table_name, schema))
+        else:
+            # Out of attachment slots (one is kept free for this): copy the table instead.
+            connection.execute("CREATE TABLE {} AS SELECT * FROM {}.data".format(table_name, schema))
+            connection.execute("DETACH DATABASE {}".format(schema))
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+
+
+class ArrowCachedTable:
+    """
+    A query result converted to an Arrow table (in memory, or memory-mapped from an Arrow IPC file
+    in the table cache directory), which DuckDB executions scan in place.
+    """
+
+    file_extension = "arrow"
+
+    def __init__(self, table):
+        self.table = table
+        self.size = table.nbytes
+
+    @classmethod
+    def load(cls, query_results):
+        return cls(arrow_table(query_results))
+
+    @classmethod
+    def open(cls, path):
+        return cls(pyarrow.ipc.open_file(pyarrow.memory_map(path)).read_all())
+
+    @staticmethod
+    def write(path, query_results):
+        table = arrow_table(query_results)
+        with pyarrow.OSFile(path, "wb") as sink, pyarrow.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    def attach(self, connection, table_name):
+        connection.register(table_name, self.table)
+
+    def close(self):
+        pass
+
+
+class TableCache:
+    """
+    Per-process LRU cache of loaded cached_query_N tables, keyed by engine and query result id and
+    bounded by the tables' size in bytes. Query results never change (a refresh creates a new
+    result), so entries never go stale.
+    """
+
+    def __init__(self):
+        self._tables = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            table = self._tables.get(key)
+            if table is not None:
+                self._tables.move_to_end(key)
+            return table
+
+    def add(self, key, table):
+        """
+        Returns whether the table was kept. Tables that weren't are left for the caller to close.
+        """
+        max_size = settings.QUERY_RESULTS_TABLE_CACHE_MAX_SIZE
+        if table.size > max_size:
+            return False
+
+        with self._lock:
+            if key in self._tables:
+                return False
+
+            self._tables[key] = table
+            self._size += table.size
+            while self._size > max_size:
+                _, evicted = self._tables.popitem(last=False)
+                self._size -= evicted.size
+                evicted.close()
+
+        return True
+
+    def clear(self):
+        with self._lock:
+            for table in self._tables.values():
+                table.close()
+            self._tables.clear()
+            self._size = 0
+
+
+table_cache = TableCache()
+
+
+def prune_table_cache_dir(directory, max_size):
+    """
+    Remove the least recently used files until the directory is within max_size bytes.
+    """
+    files = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(".tmp"):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_size = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total_size <= max_size:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+
+def open_cached_table(table_class, query):
+    directory = settings.QUERY_RESULTS_TABLE_CACHE_DIR
+    if not directory:
+        return table_class.load(query.latest_query_data.data)
+
+    path = os.path.join(directory, "{}.{}".format(query.latest_query_data_id, table_class.file_extension))
+    try:
+        # Other worker processes may have written it already; bump its mtime for the LRU pruning.
+        os.utime(path)
+        return table_class.open(path)
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    try:
+        table_class.write(tmp_path, query.latest_query_data.data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    table = table_class.open(path)
+    prune_table_cache_dir(directory, settings.QUERY_RESULTS_TABLE_CACHE_DIR_MAX_SIZE)
+    return table
+
+
+def load_cached_table(connection, engine, table_name, query):
+    """
+    Load the query's latest result as `table_name`, reusing the table loaded by earlier executions
+    as long as the result hasn't changed.
+    """
+    key = (engine, query.latest_query_data_id)
+    table = table_cache.get(key)
+    kept = True
+    if table is None:
+        table = open_cached_table(CACHED_TABLE_CLASSES[engine], query)
+        kept = table_cache.add(key, table)
+
+    try:
+        table.attach(connection, table_name)
+    finally:
+        if not kept:
+            table.close()
+
+
+TABLE_LOADERS = {ENGINE_SQLITE: create_table, ENGINE_DUCKDB: create_duckdb_table}
+CACHED_TABLE_CLASSES = {ENGINE_SQLITE: SQLiteCachedTable, ENGINE_DUCKDB: ArrowCachedTable}
+
+
 def prepare_parameterized_query(query, query_params):
     for params in query_params:
         table_hash = hashlib.md5(
@@ -170,14 +586,30 @@ class Results(BaseQueryRunner):
 
     @classmethod
     def configuration_schema(cls):
-        return {"type": "object", "properties": {}}
+        return {
+            "type": "object",
+            "properties": {
+                "engine": {
+                    "type": "string",
+                    "title": "Engine",
+                    "default": ENGINE_SQLITE,
+                    "extendedEnum": [
+                        {"value": ENGINE_SQLITE, "name": "SQLite"},
+                        {"value": ENGINE_DUCKDB, "name": "DuckDB (columnar)"},
+                    ],
+                },
+            },
+        }
 
     @classmethod
     def name(cls):
         return "Query Results"
 
     def run_query(self, query, user):
-        connection = sqlite3.connect(":memory:")
+        if self.configuration.get("engine", ENGINE_SQLITE) == ENGINE_DUCKDB:
+            return self._run_duckdb_query(query, user)
+
+        connection = sqlite3.connect(":memory:", uri=True)
 
         query_ids = extract_query_ids(query)
 
@@ -223,5 +655,41 @@ class Results(BaseQueryRunner):
             connection.close()
         return data, error
 
+    def _run_duckdb_query(self, query, user):
+        if not duckdb_enabled:
+            return None, "The DuckDB engine requires the duckdb and pyarrow packages."
+
+        query_params = extract_query_params(query)
+
+        connection = duckdb.connect(":memory:")
+        try:
+            create_tables_from_query_ids(
+                user,
+                connection,
+                extract_query_ids(query),
+                query_params,
+                extract_cached_query_ids(query),
+                engine=ENGINE_DUCKDB,
+            )
+
+            cursor = connection.execute(prepare_parameterized_query(query, query_params))
+            if cursor.description is None:
+                return None, "Query completed but it returned no data."
+
+            columns = self.fetch_columns([(i[0], duckdb_column_type(i[1])) for i in cursor.description])
+            table = cursor.to_arrow_table()
+            values = [column.to_pylist() for column in table.columns]
+            column_names = [c["name"] for c in columns]
+            rows = list(map(dict, map(zip, repeat(column_names), zip(*values))))
+
+            return {"columns": columns, "rows": rows}, None
+        except (KeyboardInterrupt, JobTimeoutException):
+            connection.interrupt()
+            raise
+        except duckdb.Error as e:
+            return None, str(e)
+        finally:
+            connection.close()
+
 
 register(Results)
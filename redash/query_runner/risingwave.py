@@ -1,8 +1,10 @@
-from redash.query_runner import register
+from redash.query_runner import NotSupported, register
 from redash.query_runner.pg import PostgreSQL
 
 
 class RisingWave(PostgreSQL):
+    connection_reset_query = None
+
     @classmethod
     def type(cls):
         return "risingwave"
@@ -41,5 +43,8 @@ class RisingWave(PostgreSQL):
 
         return list(schema.values())
 
+    def get_schema_fingerprints(self):
+        raise NotSupported()
+
 
 register(RisingWave)
@@ -0,0 +1,127 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from sshtunnel import open_tunnel
+
+from redash import settings, statsd_client
+
+logger = logging.getLogger(__name__)
+
+
+class Tunnel:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.server = None
+        self.users = 0
+        self.released_at = time.monotonic()
+
+
+class SSHTunnelPool:
+    """
+    Per-process pool of SSH tunnels, shared by the queries going through the same bastion (and SSH
+    user) to the same remote address. A tunnel is reopened when its SSH session died, and closed
+    once it had no queries for SSH_TUNNEL_MAX_IDLE_TIME seconds (by sweep(), which runs when a query
+    releases a tunnel and which long-lived workers also call periodically, see
+    ThreadedWorker.monitor_jobs).
+
+    Tunnels are only shared when SSH_TUNNEL_POOL_ENABLED is set; otherwise every query opens its
+    own tunnel, which is closed afterwards.
+    """
+
+    def __init__(self):
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._tunnels = {}
+
+    @property
+    def enabled(self):
+        return settings.SSH_TUNNEL_POOL_ENABLED
+
+    @contextmanager
+    def tunnel(self, bastion_address, remote_address, auth):
+        """Yield the local address of a tunnel to remote_address through the SSH server at bastion_address."""
+        if not self.enabled:
+            with open_tunnel(bastion_address, remote_bind_address=remote_address, **auth) as server:
+                yield server.local_bind_address
+            return
+
+        key = (tuple(bastion_address), auth.get("ssh_username"), tuple(remote_address))
+        self._check_pid()
+        with self._lock:
+            tunnel = self._tunnels.setdefault(key, Tunnel())
+            tunnel.users += 1
+
+        try:
+            with tunnel.lock:
+                if tunnel.server is not None and tunnel.server.is_active:
+                    statsd_client.incr("query_runner.ssh_tunnel.hit")
+                else:
+                    statsd_client.incr("query_runner.ssh_tunnel.miss")
+                    self._stop(tunnel.server)
+                    tunnel.server = None
+                    server = open_tunnel(
+                        bastion_address,
+                        remote_bind_address=remote_address,
+                        set_keepalive=settings.SSH_TUNNEL_KEEPALIVE,
+                        **auth,
+                    )
+                    server.start()
+                    tunnel.server = server
+                local_address = tunnel.server.local_bind_address
+
+            yield local_address
+        finally:
+            self._release(key, tunnel)
+
+    def _release(self, key, tunnel):
+        with self._lock:
+            tunnel.users -= 1
+            tunnel.released_at = time.monotonic()
+        self.sweep()
+
+    def sweep(self):
+        """Close the tunnels that had no queries for SSH_TUNNEL_MAX_IDLE_TIME seconds, or failed to open."""
+        self._check_pid()
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, tunnel in list(self._tunnels.items()):
+                idle = tunnel.users == 0 and now - tunnel.released_at > settings.SSH_TUNNEL_MAX_IDLE_TIME
+                if idle or (tunnel.users == 0 and tunnel.server is None):
+                    del self._tunnels[key]
+                    expired.append(tunnel.server)
+            statsd_client.gauge("query_runner.ssh_tunnel.open", len(self._tunnels))
+
+        for server in expired:
+            self._stop(server)
+
+    def _check_pid(self):
+        # Tunnels inherited from a parent process are served by threads that didn't survive the fork.
+        if self._pid != os.getpid():
+            self._reset_state()
+
+    @staticmethod
+    def _stop(server):
+        if server is None:
+            return
+        try:
+            server.stop()
+        except Exception:
+            logger.debug("Failed closing SSH tunnel", exc_info=True)
+
+    def clear(self):
+        self._check_pid()
+        with self._lock:
+            servers = [tunnel.server for tunnel in self._tunnels.values() if tunnel.users == 0]
+            self._tunnels = {key: tunnel for key, tunnel in self._tunnels.items() if tunnel.users > 0}
+        for server in servers:
+            self._stop(server)
+
+
+ssh_tunnel_pool = SSHTunnelPool()
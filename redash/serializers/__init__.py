@@ -11,11 +11,17 @@ from rq.timeouts import JobTimeoutException
 
 from redash import models
 from redash.models.parameterized_query import ParameterizedQuery
-from redash.permissions import has_access, view_only
+from redash.permissions import (
+    groups_grant_access,
+    has_access_to_object,
+    view_only,
+)
 from redash.serializers.query_result import (
     serialize_query_result,
     serialize_query_result_to_dsv,
+    serialize_query_result_to_dsv_stream,
     serialize_query_result_to_xlsx,
+    serialize_query_result_to_xlsx_file,
 )
 
 
@@ -50,19 +56,15 @@ def public_widget(widget):
 
 
 def public_dashboard(dashboard):
-    dashboard_dict = project(
-        serialize_dashboard(dashboard, with_favorite_state=False),
-        ("name", "layout", "dashboard_filters_enabled", "updated_at", "created_at", "options"),
-    )
-
-    widget_list = (
-        models.Widget.query.filter(models.Widget.dashboard_id == dashboard.id)
-        .outerjoin(models.Visualization)
-        .outerjoin(models.Query)
-    )
-
-    dashboard_dict["widgets"] = [public_widget(w) for w in widget_list]
-    return dashboard_dict
+    return {
+        "name": dashboard.name,
+        "layout": dashboard.layout,
+        "dashboard_filters_enabled": dashboard.dashboard_filters_enabled,
+        "updated_at": dashboard.updated_at,
+        "created_at": dashboard.created_at,
+        "options": dashboard.options,
+        "widgets": [public_widget(w) for w in dashboard.load_widgets(with_query_users=False)],
+    }
 
 
 class Serializer:
@@ -196,16 +198,44 @@ def serialize_alert(alert, full=True):
     return d
 
 
+def accessible_query_ids(queries, user, need_view_only):
+    """
+    Return the ids of the queries the user has access to. Same as calling has_access for each
+    query, but the data source groups (or the dashboard API keys for API users) of all the
+    queries are loaded at once.
+    """
+    if not queries:
+        return set()
+
+    if user.is_api_user():
+        api_keys = models.Query.dashboard_api_keys_by_id({q.id for q in queries})
+        return {q.id for q in queries if has_access_to_object(q, user.id, need_view_only, api_keys[q.id])}
+
+    if "admin" in user.permissions:
+        return {q.id for q in queries}
+
+    groups = models.DataSource.groups_by_id({q.data_source_id for q in queries if q.data_source_id})
+    return {
+        q.id for q in queries if groups_grant_access(groups.get(q.data_source_id, {}), user.group_ids, need_view_only)
+    }
+
+
 def serialize_dashboard(obj, with_widgets=False, user=None, with_favorite_state=True):
     layout = obj.layout
 
     widgets = []
 
     if with_widgets:
-        for w in obj.widgets:
+        dashboard_widgets = obj.load_widgets()
+        accessible_queries = set()
+        if user:
+            queries = [w.visualization.query_rel for w in dashboard_widgets if w.visualization_id is not None]
+            accessible_queries = accessible_query_ids(queries, user, view_only)
+
+        for w in dashboard_widgets:
             if w.visualization_id is None:
                 widgets.append(serialize_widget(w))
-            elif user and has_access(w.visualization.query_rel, user, view_only):
+            elif w.visualization.query_id in accessible_queries:
                 widgets.append(serialize_widget(w))
             else:
                 widget = project(
@@ -1,10 +1,12 @@
 import csv
 import io
+import tempfile
 
 import xlsxwriter
 from dateutil.parser import isoparse as parse_date
 from funcy import project, rpartial
 
+from redash import settings
 from redash.authentication.org_resolving import current_org
 from redash.query_runner import TYPE_BOOLEAN, TYPE_DATE, TYPE_DATETIME
 
@@ -80,45 +82,64 @@ def serialize_query_result(query_result, is_api_user):
         return query_result.to_dict()
 
 
-def serialize_query_result_to_dsv(query_result, delimiter):
-    s = io.StringIO()
+def serialize_query_result_to_dsv_stream(query_result, delimiter, chunk_rows=None):
+    """
+    Return a generator of CSV/TSV chunks, converting one row at a time so the
+    whole file is never held in memory.
+    """
+    chunk_rows = chunk_rows or settings.QUERY_RESULTS_EXPORT_CHUNK_ROWS
+    fieldnames, special_columns = _get_column_lists(query_result.data_columns or [])
+    converters = [special_columns.get(name) for name in fieldnames]
+
+    def generate():
+        s = io.StringIO()
+        writer = csv.writer(s, delimiter=delimiter)
+        writer.writerow(fieldnames)
 
-    query_data = query_result.data
+        for i, row in enumerate(query_result.iter_data_rows(fieldnames), 1):
+            writer.writerow([convert(value) if convert else value for convert, value in zip(converters, row)])
 
-    fieldnames, special_columns = _get_column_lists(query_data["columns"] or [])
+            if i % chunk_rows == 0:
+                yield s.getvalue()
+                s.seek(0)
+                s.truncate()
 
-    writer = csv.DictWriter(s, extrasaction="ignore", fieldnames=fieldnames, delimiter=delimiter)
-    writer.writeheader()
+        yield s.getvalue()
 
-    for row in query_data["rows"]:
-        for col_name, converter in special_columns.items():
-            if col_name in row:
-                row[col_name] = converter(row[col_name])
+    return generate()
 
-        writer.writerow(row)
 
-    return s.getvalue()
+def serialize_query_result_to_dsv(query_result, delimiter):
+    return "".join(serialize_query_result_to_dsv_stream(query_result, delimiter))
 
 
-def serialize_query_result_to_xlsx(query_result):
-    output = io.BytesIO()
+def serialize_query_result_to_xlsx_file(query_result):
+    """
+    Build the workbook in a temporary file that is spooled to disk once it grows
+    past QUERY_RESULTS_EXPORT_SPOOL_MAX_SIZE. Returns the file, rewound.
+    """
+    output = tempfile.SpooledTemporaryFile(max_size=settings.QUERY_RESULTS_EXPORT_SPOOL_MAX_SIZE)
 
-    query_data = query_result.data
     book = xlsxwriter.Workbook(output, {"constant_memory": True})
     sheet = book.add_worksheet("result")
 
     column_names = []
-    for c, col in enumerate(query_data["columns"]):
+    for c, col in enumerate(query_result.data_columns or []):
         sheet.write(0, c, col["name"])
         column_names.append(col["name"])
 
-    for r, row in enumerate(query_data["rows"]):
-        for c, name in enumerate(column_names):
-            v = row.get(name)
+    for r, row in enumerate(query_result.iter_data_rows(column_names)):
+        for c, v in enumerate(row):
             if isinstance(v, (dict, list)):
                 v = str(v)
             sheet.write(r + 1, c, v)
 
     book.close()
+    output.seek(0)
 
-    return output.getvalue()
+    return output
+
+
+def serialize_query_result_to_xlsx(query_result):
+    with serialize_query_result_to_xlsx_file(query_result) as output:
+        return output.read()
@@ -49,10 +49,49 @@ QUERY_RESULTS_EXPIRED_TTL_ENABLED = parse_boolean(os.environ.get("REDASH_QUERY_R
 # default set query results expired ttl 86400 seconds
 QUERY_RESULTS_EXPIRED_TTL = int(os.environ.get("REDASH_QUERY_RESULTS_EXPIRED_TTL", "86400"))
 
+# Cache serialized query result responses (by result id, and the latest result per query hash) in Redis.
+# Results larger than QUERY_RESULTS_CACHE_MAX_ITEM_SIZE bytes are not cached.
+QUERY_RESULTS_CACHE_ENABLED = parse_boolean(os.environ.get("REDASH_QUERY_RESULTS_CACHE_ENABLED", "false"))
+QUERY_RESULTS_CACHE_TTL = int(os.environ.get("REDASH_QUERY_RESULTS_CACHE_TTL", "600"))
+QUERY_RESULTS_CACHE_MAX_ITEM_SIZE = int(os.environ.get("REDASH_QUERY_RESULTS_CACHE_MAX_ITEM_SIZE", str(1024 * 1024)))
+
+# Cache serialized public dashboard responses in Redis, keyed on the dashboard version and the last
+# change of its widgets, visualizations and queries.
+PUBLIC_DASHBOARD_CACHE_ENABLED = parse_boolean(os.environ.get("REDASH_PUBLIC_DASHBOARD_CACHE_ENABLED", "false"))
+PUBLIC_DASHBOARD_CACHE_TTL = int(os.environ.get("REDASH_PUBLIC_DASHBOARD_CACHE_TTL", "300"))
+
+# Number of rows written per chunk when streaming CSV/TSV downloads, and the size (in bytes)
+# an XLSX download may reach in memory before it is spooled to a temporary file on disk.
+QUERY_RESULTS_EXPORT_CHUNK_ROWS = int(os.environ.get("REDASH_QUERY_RESULTS_EXPORT_CHUNK_ROWS", "1000"))
+QUERY_RESULTS_EXPORT_SPOOL_MAX_SIZE = int(
+    os.environ.get("REDASH_QUERY_RESULTS_EXPORT_SPOOL_MAX_SIZE", str(8 * 1024 * 1024))
+)
+
+# The Query Results data source keeps the cached_query_N tables it loaded, keyed by query result id,
+# so later executions can skip loading them again. Tables are kept in memory up to
+# QUERY_RESULTS_TABLE_CACHE_MAX_SIZE bytes per worker process (0 disables it). When
+# QUERY_RESULTS_TABLE_CACHE_DIR is set, they're also written there as files shared by all worker
+# processes on the host, up to QUERY_RESULTS_TABLE_CACHE_DIR_MAX_SIZE bytes.
+QUERY_RESULTS_TABLE_CACHE_MAX_SIZE = int(
+    os.environ.get("REDASH_QUERY_RESULTS_TABLE_CACHE_MAX_SIZE", str(128 * 1024 * 1024))
+)
+QUERY_RESULTS_TABLE_CACHE_DIR = os.environ.get("REDASH_QUERY_RESULTS_TABLE_CACHE_DIR")
+QUERY_RESULTS_TABLE_CACHE_DIR_MAX_SIZE = int(
+    os.environ.get("REDASH_QUERY_RESULTS_TABLE_CACHE_DIR_MAX_SIZE", str(1024 * 1024 * 1024))
+)
+
+# How many of the queries referenced by a Query Results query (query_N) run at the same time, and
+# how long each of them may run, in seconds (0 for no limit other than the job's own time limit).
+QUERY_RESULTS_SOURCE_CONCURRENCY = int(os.environ.get("REDASH_QUERY_RESULTS_SOURCE_CONCURRENCY", "4"))
+QUERY_RESULTS_SOURCE_TIMEOUT = int(os.environ.get("REDASH_QUERY_RESULTS_SOURCE_TIMEOUT", "0"))
+
 SCHEMAS_REFRESH_SCHEDULE = int(os.environ.get("REDASH_SCHEMAS_REFRESH_SCHEDULE", 30))
 SCHEMAS_REFRESH_TIMEOUT = int(os.environ.get("REDASH_SCHEMAS_REFRESH_TIMEOUT", 300))
 
 AUTH_TYPE = os.environ.get("REDASH_AUTH_TYPE", "api_key")
+# Users and API users resolved from API keys (and from query ids for HMAC signed URLs) are cached
+# for this many seconds. Set to 0 to disable.
+AUTH_PRINCIPAL_CACHE_TTL = int(os.environ.get("REDASH_AUTH_PRINCIPAL_CACHE_TTL", "30"))
 INVITATION_TOKEN_MAX_AGE = int(os.environ.get("REDASH_INVITATION_TOKEN_MAX_AGE", 60 * 60 * 24 * 7))
 
 # The secret key to use in the Flask app for various cryptographic features
@@ -207,9 +246,52 @@ SCHEDULED_QUERY_TIME_LIMIT = int(os.environ.get("REDASH_SCHEDULED_QUERY_TIME_LIM
 # Time limit (in seconds) for adhoc queries. Set this to -1 to execute without a time limit.
 ADHOC_QUERY_TIME_LIMIT = int(os.environ.get("REDASH_ADHOC_QUERY_TIME_LIMIT", -1))
 
+# Keep query runner connections open between queries, in workers that run many jobs in the same
+# process. Up to QUERY_RUNNER_POOL_MAX_SIZE idle connections are kept per data source options;
+# they are checked when idle for over QUERY_RUNNER_POOL_PING_AFTER seconds and closed after
+# QUERY_RUNNER_POOL_MAX_IDLE_TIME seconds. Only runners that can reset sessions use the pool.
+QUERY_RUNNER_POOL_ENABLED = parse_boolean(os.environ.get("REDASH_QUERY_RUNNER_POOL_ENABLED", "false"))
+QUERY_RUNNER_POOL_MAX_SIZE = int(os.environ.get("REDASH_QUERY_RUNNER_POOL_MAX_SIZE", "4"))
+QUERY_RUNNER_POOL_MAX_IDLE_TIME = int(os.environ.get("REDASH_QUERY_RUNNER_POOL_MAX_IDLE_TIME", "300"))
+QUERY_RUNNER_POOL_PING_AFTER = int(os.environ.get("REDASH_QUERY_RUNNER_POOL_PING_AFTER", "30"))
+
+# Keep the SSH tunnels of data sources open between the queries of a worker process (see the
+# threaded worker, `rq worker --threads`), sharing one per bastion and remote address, instead of
+# opening one per query. They send keepalives every SSH_TUNNEL_KEEPALIVE seconds and are closed
+# after SSH_TUNNEL_MAX_IDLE_TIME seconds without queries.
+SSH_TUNNEL_POOL_ENABLED = parse_boolean(os.environ.get("REDASH_SSH_TUNNEL_POOL_ENABLED", "false"))
+SSH_TUNNEL_MAX_IDLE_TIME = int(os.environ.get("REDASH_SSH_TUNNEL_MAX_IDLE_TIME", "300"))
+SSH_TUNNEL_KEEPALIVE = float(os.environ.get("REDASH_SSH_TUNNEL_KEEPALIVE", "30"))
+
+# Cache Prometheus range query results in Redis, so refreshing a query only fetches the points
+# after (or before) the cached ones. Points of the last PROMETHEUS_RANGE_CACHE_SETTLE_TIME seconds
+# may still change (late samples), so they are fetched again on every refresh.
+PROMETHEUS_RANGE_CACHE_ENABLED = parse_boolean(os.environ.get("REDASH_PROMETHEUS_RANGE_CACHE_ENABLED", "false"))
+PROMETHEUS_RANGE_CACHE_TTL = int(os.environ.get("REDASH_PROMETHEUS_RANGE_CACHE_TTL", "3600"))
+PROMETHEUS_RANGE_CACHE_SETTLE_TIME = int(os.environ.get("REDASH_PROMETHEUS_RANGE_CACHE_SETTLE_TIME", "60"))
+# Prometheus range queries over more than PROMETHEUS_RANGE_SHARD_SIZE seconds are split into
+# step-aligned ranges of that size, fetched PROMETHEUS_RANGE_SHARD_CONCURRENCY at a time
+# (PROMETHEUS_RANGE_SHARD_SIZE=0 fetches the whole range at once).
+PROMETHEUS_RANGE_SHARD_SIZE = int(os.environ.get("REDASH_PROMETHEUS_RANGE_SHARD_SIZE", str(24 * 3600)))
+PROMETHEUS_RANGE_SHARD_CONCURRENCY = int(os.environ.get("REDASH_PROMETHEUS_RANGE_SHARD_CONCURRENCY", "4"))
+
 JOB_EXPIRY_TIME = int(os.environ.get("REDASH_JOB_EXPIRY_TIME", 3600 * 12))
 JOB_DEFAULT_FAILURE_TTL = int(os.environ.get("REDASH_JOB_DEFAULT_FAILURE_TTL", 7 * 24 * 60 * 60))
 
+# Job status streams (/api/jobs/stream) hold a web worker for as long as they are open, so with
+# gunicorn's default sync workers a few open pages would stall the web server. Only enable them when
+# gunicorn serves many connections per worker (e.g. REDASH_GUNICORN_THREADS=32, which runs the gthread
+# worker class, or REDASH_GUNICORN_WORKER_CLASS=gevent). While disabled, the endpoint returns 404 and
+# clients keep polling /api/jobs/<job_id>.
+JOB_STATUS_STREAM_ENABLED = parse_boolean(os.environ.get("REDASH_JOB_STATUS_STREAM_ENABLED", "false"))
+# Job status streams are closed after JOB_STATUS_STREAM_TIMEOUT seconds and the
+# client reconnects with the jobs that are still running. While open, a stream re-reads its jobs
+# every JOB_STATUS_STREAM_RECHECK_INTERVAL seconds, to notice jobs that ended without a notification
+# (e.g. a killed worker).
+JOB_STATUS_STREAM_TIMEOUT = int(os.environ.get("REDASH_JOB_STATUS_STREAM_TIMEOUT", "25"))
+JOB_STATUS_STREAM_RECHECK_INTERVAL = int(os.environ.get("REDASH_JOB_STATUS_STREAM_RECHECK_INTERVAL", "5"))
+JOB_STATUS_STREAM_MAX_JOBS = int(os.environ.get("REDASH_JOB_STATUS_STREAM_MAX_JOBS", "100"))
+
 LOG_LEVEL = os.environ.get("REDASH_LOG_LEVEL", "INFO")
 LOG_STDOUT = parse_boolean(os.environ.get("REDASH_LOG_STDOUT", "false"))
 LOG_PREFIX = os.environ.get("REDASH_LOG_PREFIX", "")
@@ -255,6 +337,13 @@ REDASH_ALERTS_DEFAULT_MAIL_BODY_TEMPLATE_FILE = os.environ.get(
     "REDASH_ALERTS_DEFAULT_MAIL_BODY_TEMPLATE_FILE", fix_assets_path("templates/emails/alert.html")
 )
 
+# Alert notifications are sent to up to this many destinations at a time. Failed deliveries are
+# retried as separate jobs, up to ALERTS_NOTIFICATION_MAX_RETRIES times, waiting
+# ALERTS_NOTIFICATION_RETRY_BACKOFF seconds before the first retry and twice as long before each next one.
+ALERTS_NOTIFICATION_CONCURRENCY = int(os.environ.get("REDASH_ALERTS_NOTIFICATION_CONCURRENCY", "8"))
+ALERTS_NOTIFICATION_MAX_RETRIES = int(os.environ.get("REDASH_ALERTS_NOTIFICATION_MAX_RETRIES", "3"))
+ALERTS_NOTIFICATION_RETRY_BACKOFF = int(os.environ.get("REDASH_ALERTS_NOTIFICATION_RETRY_BACKOFF", "30"))
+
 # How many requests are allowed per IP to the login page before
 # being throttled?
 # See https://flask-limiter.readthedocs.io/en/stable/#rate-limit-string-notation
@@ -316,6 +405,15 @@ additional_destinations = array_from_string(os.environ.get("REDASH_ADDITIONAL_DE
 DESTINATIONS = distinct(enabled_destinations + additional_destinations)
 
 EVENT_REPORTING_WEBHOOKS = array_from_string(os.environ.get("REDASH_EVENT_REPORTING_WEBHOOKS", ""))
+# When set, events are posted to the webhooks this many at a time, in an "events" envelope wrapping
+# the usual per-event payloads. Webhooks have to support it, so by default every event is posted alone.
+EVENT_REPORTING_WEBHOOKS_BATCH_SIZE = int(os.environ.get("REDASH_EVENT_REPORTING_WEBHOOKS_BATCH_SIZE", "0"))
+
+# Events are buffered in Redis and written to the database every EVENTS_FLUSH_INTERVAL seconds,
+# EVENTS_FLUSH_BATCH_SIZE events per INSERT. When disabled, every event is recorded by its own job.
+EVENTS_BUFFER_ENABLED = parse_boolean(os.environ.get("REDASH_EVENTS_BUFFER_ENABLED", "true"))
+EVENTS_FLUSH_INTERVAL = int(os.environ.get("REDASH_EVENTS_FLUSH_INTERVAL", "10"))
+EVENTS_FLUSH_BATCH_SIZE = int(os.environ.get("REDASH_EVENTS_FLUSH_BATCH_SIZE", "1000"))
 
 # Support for Sentry (https://getsentry.com/). Just set your Sentry DSN to enable it:
 SENTRY_DSN = os.environ.get("REDASH_SENTRY_DSN", "")
@@ -382,6 +480,8 @@ SQLPARSE_FORMAT_OPTIONS = {
     "reindent": parse_boolean(os.environ.get("SQLPARSE_FORMAT_REINDENT", "true")),
     "keyword_case": os.environ.get("SQLPARSE_FORMAT_KEYWORD_CASE", "upper"),
 }
+# Number of (query text, limit settings) pairs whose auto-limited text is kept in memory.
+QUERY_AUTO_LIMIT_CACHE_SIZE = int(os.environ.get("REDASH_QUERY_AUTO_LIMIT_CACHE_SIZE", "256"))
 
 # requests
 REQUESTS_ALLOW_REDIRECTS = parse_boolean(os.environ.get("REDASH_REQUESTS_ALLOW_REDIRECTS", "false"))
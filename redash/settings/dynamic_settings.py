@@ -27,6 +27,9 @@ def periodic_jobs():
 
 # This provides the ability to override the way we store QueryResult's data column.
 # Reference implementation: redash.models.DBPersistence
+# Set it to a class or to its import path. For example, to store new results in the
+# compact columnar format (previously stored JSON results stay readable):
+# QueryResultPersistence = "redash.models.persistence.ColumnarPersistence"
 QueryResultPersistence = None
 
 
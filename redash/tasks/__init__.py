@@ -4,6 +4,8 @@ from redash import rq_redis_connection
 from redash.tasks.alerts import check_alerts_for_query
 from redash.tasks.failure_report import send_aggregated_errors
 from redash.tasks.general import (
+    buffer_event,
+    flush_events,
     record_event,
     send_mail,
     sync_user_details,
@@ -12,6 +14,7 @@ from redash.tasks.general import (
 from redash.tasks.queries import (
     cleanup_query_results,
     empty_schedules,
+    enqueue_queries,
     enqueue_query,
     execute_query,
     refresh_queries,
@@ -1,20 +1,113 @@
 import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from flask import current_app
+from sqlalchemy.orm import joinedload
 
-from redash import models, utils
+from redash import models, settings, statsd_client, utils
 from redash.worker import get_job_logger, job
 
 logger = get_job_logger(__name__)
 
 
+def _load_subscriptions(alert):
+    """
+    Load the alert's subscriptions with everything the destinations read, and render its templates.
+
+    Destinations build their payloads on the dispatching threads, which must not lazy-load anything
+    through this thread's database session.
+    """
+    subscriptions = (
+        models.AlertSubscription.query.options(
+            joinedload(models.AlertSubscription.user), joinedload(models.AlertSubscription.destination)
+        )
+        .filter(models.AlertSubscription.alert_id == alert.id)
+        .all()
+    )
+    if subscriptions and alert.query_rel.latest_query_data is not None:
+        alert.render_custom_templates()
+
+    return subscriptions
+
+
+def _notify(app, subscription, alert, new_state, host, metadata):
+    with app.app_context():
+        subscription.notify(alert, alert.query_rel, subscription.user, new_state, app, host, metadata)
+
+
+def _retry_later(alert, subscription, new_state, metadata, attempt):
+    if attempt > settings.ALERTS_NOTIFICATION_MAX_RETRIES:
+        logger.error("Giving up notifying subscription %d of alert %d.", subscription.id, alert.id)
+        statsd_client.incr("alerts.notifications.given_up")
+        return
+
+    # Imported here because redash.tasks.schedule imports the query tasks, which import this module.
+    from redash.tasks.schedule import rq_scheduler
+
+    delay = settings.ALERTS_NOTIFICATION_RETRY_BACKOFF * 2 ** (attempt - 1)
+    logger.info("Retrying subscription %d of alert %d in %d seconds.", subscription.id, alert.id, delay)
+    rq_scheduler.enqueue_in(
+        datetime.timedelta(seconds=delay),
+        retry_notification,
+        alert.id,
+        subscription.id,
+        new_state,
+        metadata,
+        attempt,
+        queue_name="default",
+        timeout=300,
+    )
+    statsd_client.incr("alerts.notifications.retried")
+
+
 def notify_subscriptions(alert, new_state, metadata):
+    """
+    Notify all of the alert's subscriptions concurrently, through at most ALERTS_NOTIFICATION_CONCURRENCY
+    threads. Failed deliveries are retried later as separate jobs.
+    """
+    host = utils.base_url(alert.query_rel.org)
+    subscriptions = _load_subscriptions(alert)
+    if not subscriptions:
+        return
+
+    app = current_app._get_current_object()
+    max_workers = min(settings.ALERTS_NOTIFICATION_CONCURRENCY, len(subscriptions))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_notify, app, subscription, alert, new_state, host, metadata): subscription
+            for subscription in subscriptions
+        }
+        failed = []
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception:
+                logger.exception("Error with processing destination")
+                failed.append(futures[future])
+
+    for subscription in failed:
+        _retry_later(alert, subscription, new_state, metadata, attempt=1)
+
+
+@job("default", timeout=300)
+def retry_notification(alert_id, subscription_id, new_state, metadata, attempt):
+    subscription = models.AlertSubscription.query.get(subscription_id)
+    if subscription is None or subscription.alert_id != alert_id:
+        logger.info("Subscription %d of alert %d no longer exists.", subscription_id, alert_id)
+        return
+
+    alert = subscription.alert
+    if alert.state != new_state:
+        logger.info("Alert %d is no longer %s, not retrying its notification.", alert_id, new_state)
+        return
+
     host = utils.base_url(alert.query_rel.org)
-    for subscription in alert.subscriptions:
-        try:
-            subscription.notify(alert, alert.query_rel, subscription.user, new_state, current_app, host, metadata)
-        except Exception:
-            logger.exception("Error with processing destination")
+    try:
+        subscription.notify(alert, alert.query_rel, subscription.user, new_state, current_app, host, metadata)
+    except Exception:
+        logger.exception("Error with processing destination")
+        _retry_later(alert, subscription, new_state, metadata, attempt + 1)
 
 
 def should_notify(alert, new_state):
@@ -30,10 +123,14 @@ def check_alerts_for_query(query_id, metadata):
     logger.debug("Checking query %d for alerts", query_id)
 
     query = models.Query.query.get(query_id)
+    # Alerts on the same column with the same selector share the value picked from the result.
+    selected_values = {}
 
     for alert in query.alerts:
         logger.info("Checking alert (%d) of query %d.", alert.id, query_id)
-        new_state = alert.evaluate()
+        started_at = time.time()
+        new_state = alert.evaluate(selected_values)
+        statsd_client.timing("alerts.evaluate", (time.time() - started_at) * 1000)
 
         if should_notify(alert, new_state):
             logger.info("Alert %d new state: %s", alert.id, new_state)
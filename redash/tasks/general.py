@@ -1,10 +1,13 @@
 import requests
 from flask_mail import Message
+from sqlalchemy.exc import InterfaceError, OperationalError
 
-from redash import mail, models, settings
+from redash import mail, models, redis_connection, settings, statsd_client
+from redash.destinations import http_session
 from redash.models import users
 from redash.query_runner import NotSupported
 from redash.tasks.worker import Queue
+from redash.utils import json_dumps, json_loads
 from redash.version_check import run_version_check
 from redash.worker import get_job_logger, job
 
@@ -30,6 +33,159 @@ def record_event(raw_event):
             logger.exception("Failed posting to %s", hook)
 
 
+EVENTS_BUFFER_KEY = "events:buffer"
+# The batch flush_events is writing. It's only removed once written, so a flush that was killed
+# midway doesn't lose it: the next one writes it first.
+EVENTS_PROCESSING_KEY = "events:processing"
+# Events the database rejected (or that aren't valid JSON), kept for inspection.
+EVENTS_DEAD_LETTER_KEY = "events:dead_letter"
+EVENTS_DEAD_LETTER_MAX_SIZE = 1000
+EVENTS_FLUSH_LOCK_KEY = "events:flush_lock"
+EVENT_SCHEMA = "iglu:io.redash.webhooks/event/jsonschema/1-0-0"
+EVENTS_BATCH_SCHEMA = "iglu:io.redash.webhooks/events/jsonschema/1-0-0"
+
+
+def buffer_event(raw_event):
+    """
+    Queues the event for the next flush_events run, or records it with its own job when event
+    buffering is disabled.
+    """
+    if settings.EVENTS_BUFFER_ENABLED:
+        redis_connection.rpush(EVENTS_BUFFER_KEY, json_dumps(raw_event))
+    else:
+        record_event.delay(raw_event)
+
+
+def forward_events(events):
+    """
+    Posts the events to the event reporting webhooks, one request per event with the same payload
+    record_event posts. When EVENT_REPORTING_WEBHOOKS_BATCH_SIZE is set, they are posted that many
+    at a time instead, wrapped in an "events" envelope the webhooks need to understand.
+    """
+    batch_size = settings.EVENT_REPORTING_WEBHOOKS_BATCH_SIZE
+    if batch_size > 0:
+        payloads = [
+            {
+                "schema": EVENTS_BATCH_SCHEMA,
+                "data": [{"schema": EVENT_SCHEMA, "data": event} for event in events[i : i + batch_size]],
+            }
+            for i in range(0, len(events), batch_size)
+        ]
+    else:
+        payloads = [{"schema": EVENT_SCHEMA, "data": event} for event in events]
+
+    for hook in settings.EVENT_REPORTING_WEBHOOKS:
+        logger.debug("Forwarding %d events to: %s", len(events), hook)
+        for data in payloads:
+            try:
+                response = http_session.post(hook, json=data)
+                if response.status_code != 200:
+                    logger.error("Failed posting to %s: %s", hook, response.content)
+            except Exception:
+                logger.exception("Failed posting to %s", hook)
+
+
+def dead_letter_event(item):
+    statsd_client.incr("events.dead_lettered")
+    with redis_connection.pipeline() as pipe:
+        pipe.rpush(EVENTS_DEAD_LETTER_KEY, item)
+        pipe.ltrim(EVENTS_DEAD_LETTER_KEY, -EVENTS_DEAD_LETTER_MAX_SIZE, -1)
+        pipe.execute()
+
+
+def record_events(items):
+    """
+    Writes the buffered events in the processing batch to the database, and empties the batch.
+
+    If the batch can't be inserted, its events are inserted one at a time, and the ones that fail
+    are moved to the dead letter list, so that a bad event can't hold up the others. Database
+    connection errors are raised instead, leaving the events not written yet in the batch.
+    """
+    raw_events = []
+    malformed = []
+    for item in items:
+        try:
+            raw_events.append(json_loads(item))
+        except ValueError:
+            malformed.append(item)
+
+    try:
+        events = models.Event.record_many(raw_events)
+        models.db.session.commit()
+    except (OperationalError, InterfaceError):
+        models.db.session.rollback()
+        raise
+    except Exception:
+        models.db.session.rollback()
+        logger.warning("Failed inserting %d events, inserting them one at a time.", len(raw_events), exc_info=True)
+        return record_events_one_by_one(items)
+
+    for item in malformed:
+        logger.warning("Dropping malformed event: %s", item)
+        dead_letter_event(item)
+    redis_connection.delete(EVENTS_PROCESSING_KEY)
+    return events
+
+
+def record_events_one_by_one(items):
+    events = []
+    for item in items:
+        try:
+            # record_many consumes the event, so parse it again rather than reusing the batch's.
+            events.extend(models.Event.record_many([json_loads(item)]))
+            models.db.session.commit()
+        except (OperationalError, InterfaceError):
+            models.db.session.rollback()
+            raise
+        except Exception:
+            models.db.session.rollback()
+            logger.warning("Dropping event that can't be inserted: %s", item, exc_info=True)
+            dead_letter_event(item)
+        redis_connection.lpop(EVENTS_PROCESSING_KEY)
+
+    return events
+
+
+def flush_events():
+    """
+    Moves the buffered events to the database, EVENTS_FLUSH_BATCH_SIZE at a time, and forwards
+    them to the event reporting webhooks. Each batch is moved to a processing list until it's
+    written, and a batch left there by a flush that didn't finish is written first.
+    """
+    lock = redis_connection.lock(EVENTS_FLUSH_LOCK_KEY, timeout=300)
+    if not lock.acquire(blocking=False):
+        logger.info("Events are already being flushed.")
+        return 0
+
+    batch_size = settings.EVENTS_FLUSH_BATCH_SIZE
+    flushed = 0
+    try:
+        while True:
+            items = redis_connection.lrange(EVENTS_PROCESSING_KEY, 0, -1)
+            unfinished = bool(items)
+            if not unfinished:
+                with redis_connection.pipeline() as pipe:
+                    for _ in range(batch_size):
+                        pipe.lmove(EVENTS_BUFFER_KEY, EVENTS_PROCESSING_KEY, "LEFT", "RIGHT")
+                    items = [item for item in pipe.execute() if item is not None]
+
+            if not items:
+                break
+
+            events = record_events(items)
+            forward_events(events)
+            flushed += len(events)
+
+            if not unfinished and len(items) < batch_size:
+                break
+    finally:
+        lock.release()
+
+    statsd_client.incr("events.flushed", flushed)
+    logger.info("Flushed %d events.", flushed)
+    return flushed
+
+
 def version_check():
     run_version_check()
 
@@ -1,4 +1,11 @@
-from .execution import enqueue_query, execute_query
+from .execution import (
+    CANCELLED_MESSAGE,
+    JOB_STATUS_CHANNEL,
+    enqueue_queries,
+    enqueue_query,
+    execute_query,
+    publish_job_status,
+)
 from .maintenance import (
     cleanup_query_results,
     empty_schedules,
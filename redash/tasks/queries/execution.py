@@ -1,7 +1,9 @@
 import signal
 import sys
+import threading
 import time
-from collections import deque
+from collections import defaultdict, deque
+from uuid import uuid4
 
 import redis
 from rq import get_current_job
@@ -9,16 +11,38 @@ from rq.exceptions import NoSuchJobError
 from rq.job import JobStatus
 from rq.timeouts import JobTimeoutException
 
-from redash import models, redis_connection, settings
+from redash import models, redis_connection, rq_redis_connection, settings
 from redash.query_runner import InterruptException
 from redash.tasks.alerts import check_alerts_for_query
 from redash.tasks.failure_report import track_failure
 from redash.tasks.worker import Job, Queue
-from redash.utils import gen_query_hash, utcnow
+from redash.utils import gen_query_hash, json_dumps, utcnow
 from redash.worker import get_job_logger
 
 logger = get_job_logger(__name__)
 TIMEOUT_MESSAGE = "Query exceeded Redash query execution time limit."
+CANCELLED_MESSAGE = "Query cancelled by user."
+JOB_STATUS_CHANNEL = "job_status:{}"
+
+
+def publish_job_status(job_id, status, error="", query_result_id=None, updated_at=0):
+    """
+    Notify the job status streams watching job_id. The message has the same fields as the job
+    returned by serialize_job (status 2 is started, 3 finished and 4 failed or cancelled).
+    """
+    message = {
+        "id": job_id,
+        "updated_at": updated_at,
+        "status": status,
+        "error": error,
+        "result": query_result_id,
+        "query_result_id": query_result_id,
+    }
+    try:
+        redis_connection.publish(JOB_STATUS_CHANNEL.format(job_id), json_dumps(message))
+    except redis.RedisError:
+        # Streams re-read their jobs periodically, so a lost notification only delays them.
+        logger.warning("Failed publishing status of job %s", job_id, exc_info=True)
 
 
 def _job_lock_id(query_hash, data_source_id):
@@ -29,6 +53,38 @@ def _unlock(query_hash, data_source_id):
     redis_connection.delete(_job_lock_id(query_hash, data_source_id))
 
 
+def _enqueue_kwargs(data_source, user_id, is_api_key, scheduled_query, metadata):
+    if scheduled_query:
+        queue_name = data_source.scheduled_queue_name
+        scheduled_query_id = scheduled_query.id
+    else:
+        queue_name = data_source.queue_name
+        scheduled_query_id = None
+
+    time_limit = settings.dynamic_settings.query_time_limit(scheduled_query, user_id, data_source.org_id)
+    metadata["Queue"] = queue_name
+
+    enqueue_kwargs = {
+        "user_id": user_id,
+        "scheduled_query_id": scheduled_query_id,
+        "is_api_key": is_api_key,
+        "job_timeout": time_limit,
+        "failure_ttl": settings.JOB_DEFAULT_FAILURE_TTL,
+        "meta": {
+            "data_source_id": data_source.id,
+            "org_id": data_source.org_id,
+            "scheduled": scheduled_query_id is not None,
+            "query_id": metadata.get("query_id"),
+            "user_id": user_id,
+        },
+    }
+
+    if not scheduled_query:
+        enqueue_kwargs["result_ttl"] = settings.JOB_EXPIRY_TIME
+
+    return queue_name, enqueue_kwargs
+
+
 def enqueue_query(query, data_source, user_id, is_api_key=False, scheduled_query=None, metadata={}):
     query_hash = gen_query_hash(query)
     logger.info("Inserting job for %s with metadata=%s", query_hash, metadata)
@@ -72,35 +128,10 @@ def enqueue_query(query, data_source, user_id, is_api_key=False, scheduled_query
             if not job:
                 pipe.multi()
 
-                if scheduled_query:
-                    queue_name = data_source.scheduled_queue_name
-                    scheduled_query_id = scheduled_query.id
-                else:
-                    queue_name = data_source.queue_name
-                    scheduled_query_id = None
-
-                time_limit = settings.dynamic_settings.query_time_limit(scheduled_query, user_id, data_source.org_id)
-                metadata["Queue"] = queue_name
-
+                queue_name, enqueue_kwargs = _enqueue_kwargs(
+                    data_source, user_id, is_api_key, scheduled_query, metadata
+                )
                 queue = Queue(queue_name)
-                enqueue_kwargs = {
-                    "user_id": user_id,
-                    "scheduled_query_id": scheduled_query_id,
-                    "is_api_key": is_api_key,
-                    "job_timeout": time_limit,
-                    "failure_ttl": settings.JOB_DEFAULT_FAILURE_TTL,
-                    "meta": {
-                        "data_source_id": data_source.id,
-                        "org_id": data_source.org_id,
-                        "scheduled": scheduled_query_id is not None,
-                        "query_id": metadata.get("query_id"),
-                        "user_id": user_id,
-                    },
-                }
-
-                if not scheduled_query:
-                    enqueue_kwargs["result_ttl"] = settings.JOB_EXPIRY_TIME
-
                 job = queue.enqueue(execute_query, query, data_source.id, metadata, **enqueue_kwargs)
 
                 logger.info("[%s] Created new job: %s", query_hash, job.id)
@@ -123,6 +154,131 @@ def enqueue_query(query, data_source, user_id, is_api_key=False, scheduled_query
     return job
 
 
+def _live_jobs(job_ids):
+    """Map lock ids to the jobs they point to, leaving out locks of complete, cancelled or expired jobs."""
+    lock_ids = list(job_ids)
+    jobs = Job.fetch_many([job_ids[lock_id] for lock_id in lock_ids], connection=rq_redis_connection)
+
+    live_jobs = {}
+    for lock_id, job in zip(lock_ids, jobs):
+        if job is None:
+            message = "job found has expired"
+        elif job.get_status(refresh=False) in [JobStatus.FINISHED, JobStatus.FAILED]:
+            message = "job found is complete (%s)" % job.get_status(refresh=False)
+        elif job.is_cancelled:
+            message = "job found has been cancelled"
+        else:
+            logger.info("[%s] Found existing job: %s", lock_id, job.id)
+            live_jobs[lock_id] = job
+            continue
+
+        logger.info("[%s] %s, replacing lock", lock_id, message)
+
+    return live_jobs
+
+
+def _enqueue_many(requests, job_ids):
+    """Enqueue a job with the given id for each of the lock ids in requests through a single pipeline."""
+    job_datas = defaultdict(list)
+    for lock_id, request in requests.items():
+        metadata = request.get("metadata", {})
+        queue_name, enqueue_kwargs = _enqueue_kwargs(
+            request["data_source"],
+            request["user_id"],
+            request.get("is_api_key", False),
+            request.get("scheduled_query"),
+            metadata,
+        )
+        job_data = Queue.prepare_data(
+            execute_query,
+            args=(request["query"], request["data_source"].id, metadata),
+            kwargs={key: enqueue_kwargs.pop(key) for key in ("user_id", "scheduled_query_id", "is_api_key")},
+            timeout=enqueue_kwargs.pop("job_timeout"),
+            job_id=job_ids[lock_id],
+            **enqueue_kwargs,
+        )
+        job_datas[queue_name].append((lock_id, job_data))
+
+    jobs = {}
+    pipe = rq_redis_connection.pipeline()
+    for queue_name, items in job_datas.items():
+        queue = Queue(queue_name, connection=rq_redis_connection)
+        lock_ids, datas = zip(*items)
+        jobs.update(zip(lock_ids, queue.enqueue_many(list(datas), pipeline=pipe)))
+    pipe.execute()
+
+    return jobs
+
+
+def enqueue_queries(requests):
+    """
+    Bulk version of enqueue_query, used when refreshing scheduled queries.
+
+    Each request is a dict of enqueue_query's arguments. Requests for the same query hash and data
+    source are enqueued once. The existing locks are read with one MGET, and the locks of the new jobs
+    are taken with one transaction before any job is enqueued: missing locks are set with SET NX, and
+    locks of complete, cancelled or expired jobs are replaced under WATCH. Only the requests whose lock
+    was taken are enqueued, the others are retried and pick up the job of whoever took their lock.
+
+    Returns the job of each request, or None when it could not be enqueued.
+    """
+    lock_ids = [_job_lock_id(gen_query_hash(request["query"]), request["data_source"].id) for request in requests]
+    pending = {}
+    for lock_id, request in zip(lock_ids, requests):
+        pending.setdefault(lock_id, request)
+
+    logger.info("Inserting jobs for %d queries (%d unique)", len(requests), len(pending))
+    jobs = {}
+    try_count = 0
+
+    while pending and try_count < 5:
+        try_count += 1
+
+        lock_values = redis_connection.mget(list(pending))
+        existing = {lock_id: job_id for lock_id, job_id in zip(pending, lock_values) if job_id}
+        live_jobs = _live_jobs(existing)
+        for lock_id, job in live_jobs.items():
+            jobs[lock_id] = job
+            del pending[lock_id]
+
+        missing = [lock_id for lock_id in pending if lock_id not in existing]
+        stale = [lock_id for lock_id in existing if lock_id not in live_jobs]
+
+        pipe = redis_connection.pipeline()
+        try:
+            if stale:
+                pipe.watch(*stale)
+                # Locks changed since they were read are left for the next try.
+                stale = [lock_id for lock_id, job_id in zip(stale, pipe.mget(stale)) if job_id == existing[lock_id]]
+
+            claims = missing + stale
+            if not claims:
+                continue
+
+            job_ids = {lock_id: str(uuid4()) for lock_id in claims}
+            pipe.multi()
+            for lock_id in missing:
+                pipe.set(lock_id, job_ids[lock_id], settings.JOB_EXPIRY_TIME, nx=True)
+            for lock_id in stale:
+                pipe.set(lock_id, job_ids[lock_id], settings.JOB_EXPIRY_TIME)
+            taken = [lock_id for lock_id, result in zip(claims, pipe.execute()) if result]
+        except redis.WatchError:
+            continue
+        finally:
+            pipe.reset()
+
+        if taken:
+            new_jobs = _enqueue_many({lock_id: pending.pop(lock_id) for lock_id in taken}, job_ids)
+            for lock_id, job in new_jobs.items():
+                logger.info("[%s] Created new job: %s", lock_id, job.id)
+            jobs.update(new_jobs)
+
+    for lock_id in pending:
+        logger.error("[Manager][%s] Failed adding job for query.", lock_id)
+
+    return [jobs.get(lock_id) for lock_id in lock_ids]
+
+
 def signal_handler(*args):
     raise InterruptException
 
@@ -195,11 +351,14 @@ class QueryExecutor:
             models.scheduled_queries_executions.update(self.query_model.id)
 
     def run(self):
-        signal.signal(signal.SIGINT, signal_handler)
+        # Jobs of threaded workers are interrupted by their worker instead (and can't set signal handlers).
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, signal_handler)
         started_at = time.time()
 
         logger.debug("Executing query:\n%s", self.query)
         self._log_progress("executing_query")
+        publish_job_status(self.job.id, 2, updated_at=self.job.started_at or 0)
 
         query_runner = self.data_source.query_runner
         annotated_query = self._annotate_query(query_runner)
@@ -232,6 +391,7 @@ class QueryExecutor:
             if self.is_scheduled_query:
                 self.query_model = models.db.session.merge(self.query_model, load=False)
                 track_failure(self.query_model, error)
+            publish_job_status(self.job.id, 4, error=error, updated_at=self.job.started_at or 0)
             raise result
         else:
             if self.query_model and self.query_model.schedule_failures > 0:
@@ -253,6 +413,8 @@ class QueryExecutor:
             updated_query_ids = models.Query.update_latest_result(query_result)
 
             models.db.session.commit()  # make sure that alert sees the latest query result
+            # A reader may have re-cached the previous result between store_result and the commit.
+            models.query_result_cache.invalidate_latest(self.data_source.id, self.query_hash)
             self._log_progress("checking_alerts")
             for query_id in updated_query_ids:
                 check_alerts_for_query.delay(query_id, self.metadata)
@@ -260,6 +422,7 @@ class QueryExecutor:
 
             result = query_result.id
             models.db.session.commit()
+            publish_job_status(self.job.id, 3, query_result_id=result, updated_at=self.job.started_at or 0)
             return result
 
     def _annotate_query(self, query_runner):
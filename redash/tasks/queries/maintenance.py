@@ -13,7 +13,7 @@ from redash.tasks.failure_report import track_failure
 from redash.utils import json_dumps, sentry
 from redash.worker import get_job_logger, job
 
-from .execution import enqueue_query
+from .execution import enqueue_queries
 
 logger = get_job_logger(__name__)
 
@@ -84,6 +84,7 @@ def refresh_queries():
     started_at = time.time()
     logger.info("Refreshing queries...")
     enqueued = []
+    requests = []
     for query in models.Query.outdated_queries():
         if not _should_refresh_query(query):
             continue
@@ -91,12 +92,14 @@ def refresh_queries():
         try:
             query_text = _apply_default_parameters(query)
             query_text = _apply_auto_limit(query_text, query)
-            enqueue_query(
-                query_text,
-                query.data_source,
-                query.user_id,
-                scheduled_query=query,
-                metadata={"query_id": query.id, "Username": query.user.get_actual_user()},
+            requests.append(
+                {
+                    "query": query_text,
+                    "data_source": query.data_source,
+                    "user_id": query.user_id,
+                    "scheduled_query": query,
+                    "metadata": {"query_id": query.id, "Username": query.user.get_actual_user()},
+                }
             )
             enqueued.append(query)
         except Exception as e:
@@ -105,6 +108,17 @@ def refresh_queries():
             error = RefreshQueriesError(message).with_traceback(e.__traceback__)
             sentry.capture_exception(error)
 
+    if requests:
+        try:
+            jobs = enqueue_queries(requests)
+            enqueued = [query for query, job in zip(enqueued, jobs) if job is not None]
+        except Exception as e:
+            message = "Could not enqueue %d queries due to %s" % (len(requests), repr(e))
+            logging.info(message)
+            error = RefreshQueriesError(message).with_traceback(e.__traceback__)
+            sentry.capture_exception(error)
+            enqueued = []
+
     status = {
         "started_at": started_at,
         "outdated_queries_count": len(enqueued),
@@ -132,10 +146,14 @@ def cleanup_query_results():
     )
 
     unused_query_results = models.QueryResult.unused(settings.QUERY_RESULTS_CLEANUP_MAX_AGE)
-    deleted_count = models.QueryResult.query.filter(
-        models.QueryResult.id.in_(unused_query_results.limit(settings.QUERY_RESULTS_CLEANUP_COUNT).subquery())
-    ).delete(synchronize_session=False)
+    unused_query_result_ids = [
+        query_result.id for query_result in unused_query_results.limit(settings.QUERY_RESULTS_CLEANUP_COUNT)
+    ]
+    deleted_count = models.QueryResult.query.filter(models.QueryResult.id.in_(unused_query_result_ids)).delete(
+        synchronize_session=False
+    )
     models.db.session.commit()
+    models.query_result_cache.invalidate(unused_query_result_ids)
     logger.info("Deleted %d unused query results.", deleted_count)
 
 
@@ -8,7 +8,7 @@ from rq_scheduler import Scheduler
 
 from redash import rq_redis_connection, settings
 from redash.tasks.failure_report import send_aggregated_errors
-from redash.tasks.general import sync_user_details, version_check
+from redash.tasks.general import flush_events, sync_user_details, version_check
 from redash.tasks.queries import (
     cleanup_query_results,
     empty_schedules,
@@ -79,6 +79,16 @@ def periodic_job_definitions():
         },
     ]
 
+    if settings.EVENTS_BUFFER_ENABLED:
+        jobs.append(
+            {
+                "func": flush_events,
+                "timeout": 300,
+                "interval": timedelta(seconds=settings.EVENTS_FLUSH_INTERVAL),
+                "result_ttl": 600,
+            }
+        )
+
     if settings.VERSION_CHECK:
         jobs.append({"func": version_check, "interval": timedelta(days=1)})
 
@@ -1,19 +1,34 @@
 import errno
+import math
 import os
 import signal
 import sys
+import threading
+import time
+from contextlib import contextmanager
 
+from flask import current_app, has_app_context
 from rq import Queue as BaseQueue
 from rq.job import Job as BaseJob
 from rq.job import JobStatus
-from rq.timeouts import HorseMonitorTimeoutException
+from rq.timeouts import (
+    BaseDeathPenalty,
+    HorseMonitorTimeoutException,
+    JobTimeoutException,
+)
 from rq.utils import utcnow
 from rq.worker import (
     HerokuWorker,  # HerokuWorker implements graceful shutdown on SIGTERM
+    StopRequested,
     Worker,
+    WorkerStatus,
 )
 
 from redash import statsd_client
+from redash.query_runner import InterruptException
+from redash.query_runner.connection_pool import connection_pool
+from redash.query_runner.ssh_tunnel_pool import ssh_tunnel_pool
+from redash.utils import interrupt_thread
 
 # HerokuWorker does not work in OSX https://github.com/getredash/redash/issues/5413
 if sys.platform == "darwin":
@@ -44,6 +59,11 @@ class StatsdRecordingQueue(BaseQueue):
         statsd_client.incr("rq.jobs.created.{}".format(self.name))
         return job
 
+    def enqueue_many(self, *args, **kwargs):
+        jobs = super().enqueue_many(*args, **kwargs)
+        statsd_client.incr("rq.jobs.created.{}".format(self.name), len(jobs))
+        return jobs
+
 
 class CancellableQueue(BaseQueue):
     job_class = CancellableJob
@@ -53,22 +73,28 @@ class RedashQueue(StatsdRecordingQueue, CancellableQueue):
     pass
 
 
+@contextmanager
+def record_job_metrics(job, queue):
+    statsd_client.incr("rq.jobs.running.{}".format(queue.name))
+    statsd_client.incr("rq.jobs.started.{}".format(queue.name))
+    try:
+        yield
+    finally:
+        statsd_client.decr("rq.jobs.running.{}".format(queue.name))
+        if job.get_status() == JobStatus.FINISHED:
+            statsd_client.incr("rq.jobs.finished.{}".format(queue.name))
+        else:
+            statsd_client.incr("rq.jobs.failed.{}".format(queue.name))
+
+
 class StatsdRecordingWorker(BaseWorker):
     """
     RQ Worker Mixin that overrides `execute_job` to increment/modify metrics via Statsd
     """
 
     def execute_job(self, job, queue):
-        statsd_client.incr("rq.jobs.running.{}".format(queue.name))
-        statsd_client.incr("rq.jobs.started.{}".format(queue.name))
-        try:
+        with record_job_metrics(job, queue):
             super().execute_job(job, queue)
-        finally:
-            statsd_client.decr("rq.jobs.running.{}".format(queue.name))
-            if job.get_status() == JobStatus.FINISHED:
-                statsd_client.incr("rq.jobs.finished.{}".format(queue.name))
-            else:
-                statsd_client.incr("rq.jobs.failed.{}".format(queue.name))
 
 
 class HardLimitingWorker(BaseWorker):
@@ -195,6 +221,205 @@ class RedashWorker(StatsdRecordingWorker, HardLimitingWorker):
     queue_class = RedashQueue
 
 
+class ThreadDeathPenalty(BaseDeathPenalty):
+    """
+    Time limit for jobs running in threads, which can't use SIGALRM (only the main thread gets
+    signals): a timer raises the exception in the job's thread instead.
+    """
+
+    def __init__(self, timeout, exception=JobTimeoutException, **kwargs):
+        super().__init__(timeout, exception, **kwargs)
+        self._thread_id = threading.get_ident()
+        self._timer = None
+
+    def setup_death_penalty(self):
+        if self._timeout > 0:
+            self._timer = threading.Timer(self._timeout, interrupt_thread, (self._thread_id, self._exception))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def cancel_death_penalty(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+class RunningJob:
+    def __init__(self, job, queue, thread):
+        self.job = job
+        self.queue = queue
+        self.thread = thread
+        self.started_at = time.monotonic()
+        self.interrupted = False
+        # Whoever gets there first records the job's result: its thread, or the hard limit.
+        self.lock = threading.Lock()
+        self.result_recorded = False
+        self.abandoned = False
+
+
+class ThreadedWorker(BaseWorker):
+    """
+    Worker that runs up to `concurrency` jobs at the same time, in threads of its own process,
+    instead of forking a work horse for every job. Meant for queues of I/O bound jobs (like queries
+    waiting on their data sources): jobs share the process's database, Redis and query runner
+    connections, and don't pay for a fork.
+
+    Threads can't be killed, so time limits and cancellations are enforced cooperatively, by raising
+    JobTimeoutException or InterruptException in the job's thread. Python raises them the next time
+    the thread runs Python code, so code blocking in a C call (e.g. a query runner waiting on a
+    socket without a timeout) only notices them once the call returns. A job still running
+    `grace_period` seconds after its time limit is failed, and the worker stops once its other jobs
+    are done, to be replaced by a new process.
+    """
+
+    grace_period = 15
+    death_penalty_class = ThreadDeathPenalty
+    queue_class = RedashQueue
+    job_class = CancellableJob
+
+    def __init__(self, *args, concurrency=4, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.concurrency = concurrency
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._running = {}
+        self._running_lock = threading.Lock()
+        self._local = threading.local()
+        self._app = current_app._get_current_object() if has_app_context() else None
+
+    def running_jobs(self):
+        with self._running_lock:
+            return list(self._running.values())
+
+    def execute_job(self, job, queue):
+        while not self._slots.acquire(timeout=self.job_monitoring_interval):
+            self.monitor_jobs()
+
+        thread = threading.Thread(target=self.run_job, args=(job, queue), name="job-{}".format(job.id), daemon=True)
+        with self._running_lock:
+            self._running[job.id] = RunningJob(job, queue, thread)
+        self.set_state(WorkerStatus.BUSY)
+        thread.start()
+
+    def run_job(self, job, queue):
+        with self._running_lock:
+            self._local.running = self._running[job.id]
+        try:
+            with record_job_metrics(job, queue):
+                if self._app is not None:
+                    with self._app.app_context():
+                        self.perform_job(job, queue)
+                else:
+                    self.perform_job(job, queue)
+        finally:
+            with self._running_lock:
+                self._running.pop(job.id, None)
+            self._slots.release()
+
+    def may_record_result(self):
+        """
+        Whether the current thread may record the result of its job: a job's thread can't once
+        enforce_hard_limit failed the job (which the job keeps running past), as it would overwrite that.
+        """
+        running = getattr(self._local, "running", None)
+        if running is None:
+            return True
+        with running.lock:
+            if running.abandoned:
+                self.log.warning("Not recording the result of job %s, failed by its time limit.", running.job.id)
+                return False
+            running.result_recorded = True
+            return True
+
+    def handle_job_success(self, job, queue, started_job_registry):
+        if self.may_record_result():
+            super().handle_job_success(job, queue, started_job_registry)
+
+    def handle_job_failure(self, job, queue, started_job_registry=None, exc_string=""):
+        if self.may_record_result():
+            super().handle_job_failure(job, queue, started_job_registry=started_job_registry, exc_string=exc_string)
+
+    def dequeue_job_and_maintain_ttl(self, timeout, max_idle_time=None):
+        # Wait for jobs in short rounds, to look after the running jobs in between.
+        if timeout is None:
+            return super().dequeue_job_and_maintain_ttl(timeout, max_idle_time)
+
+        idle_since = time.monotonic()
+        while not self._stop_requested:
+            wait = min(timeout, self.job_monitoring_interval)
+            if max_idle_time is not None:
+                wait = min(wait, math.ceil(max_idle_time - (time.monotonic() - idle_since)))
+                if wait <= 0:
+                    return None
+
+            result = super().dequeue_job_and_maintain_ttl(wait, max_idle_time=wait)
+            if result is not None:
+                return result
+            self.monitor_jobs()
+
+        raise StopRequested()
+
+    def monitor_jobs(self):
+        """
+        Keep the running jobs alive, and stop the ones that were cancelled or are past their time limit.
+        Also closes the pooled query runner connections and SSH tunnels that were idle for too long.
+        """
+        connection_pool.sweep()
+        ssh_tunnel_pool.sweep()
+
+        running = self.running_jobs()
+        if not running:
+            return
+
+        jobs = self.job_class.fetch_many([r.job.id for r in running], connection=self.connection)
+        now = time.monotonic()
+        for r, job in zip(running, jobs):
+            timeout = r.job.timeout or self.queue_class.DEFAULT_TIMEOUT
+            if timeout != -1 and now - r.started_at > timeout + self.grace_period:
+                self.enforce_hard_limit(r, timeout)
+                continue
+
+            self.maintain_heartbeats(r.job)
+            if job is not None and job.is_cancelled and not r.interrupted:
+                r.interrupted = True
+                interrupt_thread(r.thread.ident, InterruptException)
+                self.log.warning("Job %s has been cancelled.", r.job.id)
+
+    def enforce_hard_limit(self, running, timeout):
+        with running.lock:
+            if running.result_recorded:
+                # The job just finished.
+                return
+            running.abandoned = True
+
+        self.log.warning(
+            "Job %s exceeded timeout of %ds (+%ds grace period) but its thread did not stop. "
+            "Failing the job and stopping the worker.",
+            running.job.id,
+            timeout,
+            self.grace_period,
+        )
+        with self._running_lock:
+            self._running.pop(running.job.id, None)
+        self.handle_job_failure(
+            running.job, queue=running.queue, exc_string="Job exceeded its time limit and its thread did not stop."
+        )
+        self._stop_requested = True
+
+    def request_force_stop(self, signum, frame):
+        for r in self.running_jobs():
+            interrupt_thread(r.thread.ident, InterruptException)
+        super().request_force_stop(signum, frame)
+
+    def teardown(self):
+        # Let the running jobs finish (stopping those that can't) before leaving.
+        running = self.running_jobs()
+        while running:
+            running[0].thread.join(self.job_monitoring_interval)
+            self.monitor_jobs()
+            running = self.running_jobs()
+        super().teardown()
+
+
 Job = CancellableJob
 Queue = RedashQueue
 Worker = RedashWorker
@@ -1,6 +1,7 @@
 import binascii
 import codecs
 import csv
+import ctypes
 import datetime
 import decimal
 import hashlib
@@ -226,6 +227,11 @@ def to_filename(s):
     return s.strip("_")
 
 
+def interrupt_thread(thread_id, exception_class):
+    """Raise exception_class in the given thread, the next time it runs Python code."""
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id), ctypes.py_object(exception_class))
+
+
 def deprecated():
     def wrapper(K):
         setattr(K, "deprecated", True)
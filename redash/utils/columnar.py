@@ -0,0 +1,229 @@
+"""
+Compact, versioned columnar encoding for query result data.
+
+The encoded value is plain ASCII, so it can live in the same text column as the
+legacy JSON payloads:
+
+    RDC<version>:<base64(header length | header JSON | column blocks)>
+
+Each column is stored as its own zlib-compressed block: ints and floats as
+packed 64-bit arrays with a null mask, booleans as one byte per value and
+anything else as a JSON list. A single column (or just the row count) can be
+read without decoding the rest of the result, and rows are only materialized
+as dicts when asked for.
+"""
+import array
+import base64
+import math
+import struct
+import sys
+import zlib
+from itertools import repeat
+
+from redash.utils import json_dumps, json_loads
+
+VERSION = 1
+PREFIX = "RDC{}:".format(VERSION)
+COMPRESSION_LEVEL = 1
+
+KIND_INT = "int64"
+KIND_FLOAT = "float64"
+KIND_BOOL = "bool"
+KIND_JSON = "json"
+
+_TYPECODES = {KIND_INT: "q", KIND_FLOAT: "d"}
+_INT64_MIN = -(2**63)
+_INT64_MAX = 2**63 - 1
+_BOOL_NULL = 2
+
+
+class UnsupportedVersionError(ValueError):
+    pass
+
+
+def is_columnar(text):
+    return isinstance(text, str) and text.startswith("RDC") and text[3:].split(":", 1)[0].isdigit()
+
+
+def _detect_kind(values):
+    kind = None
+    for value in values:
+        if value is None:
+            continue
+
+        value_type = type(value)
+        if value_type is bool:
+            value_kind = KIND_BOOL
+        elif value_type is int:
+            if not _INT64_MIN <= value <= _INT64_MAX:
+                return KIND_JSON
+            value_kind = KIND_INT
+        elif value_type is float:
+            value_kind = KIND_FLOAT
+        else:
+            return KIND_JSON
+
+        if kind is None:
+            kind = value_kind
+        elif kind != value_kind:
+            return KIND_JSON
+
+    return kind or KIND_JSON
+
+
+def _encode_column(values, kind, level):
+    if kind == KIND_JSON:
+        raw = json_dumps(values).encode("utf-8")
+    elif kind == KIND_BOOL:
+        raw = bytes(_BOOL_NULL if v is None else int(v) for v in values)
+    else:
+        nulls = bytearray(len(values))
+        typed = array.array(_TYPECODES[kind])
+        for i, value in enumerate(values):
+            # NaN and Inf are stored as nulls, like json_dumps does.
+            if value is None or (kind == KIND_FLOAT and (math.isnan(value) or math.isinf(value))):
+                nulls[i] = 1
+                typed.append(0)
+            else:
+                typed.append(value)
+        if sys.byteorder == "big":
+            typed.byteswap()
+        raw = bytes(nulls) + typed.tobytes()
+
+    return zlib.compress(raw, level)
+
+
+def _decode_column(block, kind, row_count):
+    raw = zlib.decompress(block)
+
+    if kind == KIND_JSON:
+        return json_loads(raw)
+
+    if kind == KIND_BOOL:
+        return [None if b == _BOOL_NULL else b == 1 for b in raw]
+
+    nulls = raw[:row_count]
+    typed = array.array(_TYPECODES[kind])
+    typed.frombytes(raw[row_count:])
+    if sys.byteorder == "big":
+        typed.byteswap()
+    values = typed.tolist()
+
+    if b"\x01" in nulls:
+        values = [None if is_null else value for is_null, value in zip(nulls, values)]
+
+    return values
+
+
+def _column_names(data):
+    columns = data.get("columns")
+    rows = data.get("rows")
+    if not isinstance(columns, list) or not isinstance(rows, list):
+        return None
+
+    names = [column.get("name") if isinstance(column, dict) else None for column in columns]
+    if not all(isinstance(name, str) for name in names) or len(set(names)) != len(names):
+        return None
+
+    # Rows must have exactly the declared columns, otherwise the columnar form
+    # would not round-trip to the same dicts.
+    name_set = set(names)
+    for row in rows:
+        if not isinstance(row, dict) or row.keys() != name_set:
+            return None
+
+    return names
+
+
+def encode(data, level=COMPRESSION_LEVEL):
+    """
+    Encode a query result data dict (``{"columns": [...], "rows": [...]}``).
+
+    Returns None when the data can't be represented losslessly (missing/extra row keys,
+    duplicate column names, etc.), in which case the caller should fall back to JSON.
+    """
+    if not isinstance(data, dict):
+        return None
+
+    names = _column_names(data)
+    if names is None:
+        return None
+
+    rows = data["rows"]
+    blocks = []
+    block_headers = []
+    offset = 0
+    for name in names:
+        values = [row[name] for row in rows]
+        kind = _detect_kind(values)
+        block = _encode_column(values, kind, level)
+        block_headers.append({"kind": kind, "offset": offset, "length": len(block)})
+        blocks.append(block)
+        offset += len(block)
+
+    header = {
+        "columns": data["columns"],
+        "row_count": len(rows),
+        "blocks": block_headers,
+        "extra": {k: v for k, v in data.items() if k not in ("columns", "rows")},
+    }
+    header = json_dumps(header).encode("utf-8")
+    payload = b"".join([struct.pack(">I", len(header)), header] + blocks)
+
+    return PREFIX + base64.b64encode(payload).decode("ascii")
+
+
+class ColumnarResult:
+    """
+    Read-only view over an encoded result. Columns are decoded lazily and cached.
+    """
+
+    def __init__(self, text):
+        version, _, encoded = text[3:].partition(":")
+        if int(version) != VERSION:
+            raise UnsupportedVersionError("Unsupported columnar result version: {}".format(version))
+
+        payload = base64.b64decode(encoded)
+        (header_length,) = struct.unpack_from(">I", payload)
+        header = json_loads(payload[4 : 4 + header_length])
+
+        self.columns = header["columns"]
+        self.row_count = header["row_count"]
+        self.extra = header["extra"]
+        self._blocks = header["blocks"]
+        self._payload = memoryview(payload)[4 + header_length :]
+        self._index = {column["name"]: i for i, column in enumerate(self.columns)}
+        self._decoded = {}
+
+    @property
+    def column_names(self):
+        return [column["name"] for column in self.columns]
+
+    def column_kind(self, name):
+        return self._blocks[self._index[name]]["kind"]
+
+    def column(self, name):
+        if name not in self._decoded:
+            block = self._blocks[self._index[name]]
+            data = self._payload[block["offset"] : block["offset"] + block["length"]]
+            self._decoded[name] = _decode_column(data, block["kind"], self.row_count)
+
+        return self._decoded[name]
+
+    def rows(self, columns=None):
+        names = self.column_names if columns is None else columns
+        if not names:
+            return [{} for _ in range(self.row_count)]
+
+        values = [self.column(name) for name in names]
+        return list(map(dict, map(zip, repeat(names), zip(*values))))
+
+    def to_dict(self):
+        data = dict(self.extra)
+        data["columns"] = self.columns
+        data["rows"] = self.rows()
+        return data
+
+
+def decode(text):
+    return ColumnarResult(text).to_dict()
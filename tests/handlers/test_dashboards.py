@@ -1,4 +1,6 @@
-from redash.models import AccessPermission, ApiKey, Dashboard, db
+from flask import g
+
+from redash.models import AccessPermission, ApiKey, ApiUser, Dashboard, db
 from redash.permissions import ACCESS_TYPE_MODIFY
 from redash.serializers import serialize_dashboard
 from redash.utils import json_loads
@@ -87,6 +89,47 @@ class TestDashboardResourceGet(BaseTestCase):
         self.assertEqual(rv.status_code, 404)
 
 
+class TestSerializeDashboardQueryCount(BaseTestCase):
+    def create_dashboard(self, widget_count):
+        dashboard = self.factory.create_dashboard()
+        for i in range(widget_count):
+            if i % 2:
+                data_source = self.factory.create_data_source(group=self.factory.default_group)
+            else:
+                data_source = self.factory.data_source
+            query = self.factory.create_query(data_source=data_source)
+            vis = self.factory.create_visualization(query_rel=query)
+            self.factory.create_widget(visualization=vis, dashboard=dashboard)
+        self.factory.create_widget(visualization=None, dashboard=dashboard, text="text")
+        db.session.commit()
+        return dashboard
+
+    def count_queries(self, dashboard, user):
+        db.session.expire_all()
+        with self.app.test_request_context():
+            g.queries_count = 0
+            serialized = serialize_dashboard(dashboard, with_widgets=True, user=user)
+            self.assertFalse(any(w.get("restricted") for w in serialized["widgets"]))
+            return g.queries_count
+
+    def test_query_count_does_not_depend_on_widget_count(self):
+        small = self.create_dashboard(2)
+        large = self.create_dashboard(20)
+
+        self.assertEqual(self.count_queries(small, self.factory.user), self.count_queries(large, self.factory.user))
+
+    def test_query_count_does_not_depend_on_widget_count_for_api_users(self):
+        small = self.create_dashboard(2)
+        large = self.create_dashboard(20)
+        counts = []
+        for dashboard in (small, large):
+            api_key = self.factory.create_api_key(object=dashboard)
+            db.session.commit()
+            counts.append(self.count_queries(dashboard, ApiUser(api_key, self.factory.org, [])))
+
+        self.assertEqual(counts[0], counts[1])
+
+
 class TestDashboardResourcePost(BaseTestCase):
     def test_update_dashboard(self):
         d = self.factory.create_dashboard()
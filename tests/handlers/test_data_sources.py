@@ -1,5 +1,9 @@
+from urllib.parse import urlencode
+
+import mock
 from funcy import pairwise
 
+from redash import models
 from redash.models import DataSource
 from tests import BaseTestCase
 
@@ -23,6 +27,76 @@ class TestDataSourceGetSchema(BaseTestCase):
         self.assertEqual(response.status_code, 404)
 
 
+class TestDataSourceSchemaTables(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tables = [
+            {"name": name, "columns": ["id"]} for name in ("events", "sales.Orders", "sales.refunds", "users")
+        ]
+        models.schema_cache.update(self.factory.data_source.id, {"": self.tables}, {})
+
+    def get(self, resource, **args):
+        return self.make_request(
+            "get",
+            "/api/data_sources/{}/schema/{}?{}".format(self.factory.data_source.id, resource, urlencode(args, True)),
+        )
+
+    def test_lists_table_names_in_pages(self):
+        rv = self.get("tables", limit=3)
+        self.assertEqual(
+            rv.json, {"tables": ["events", "sales.Orders", "sales.refunds"], "next": "sales.refunds", "count": 4}
+        )
+
+        rv = self.get("tables", limit=3, after=rv.json["next"])
+        self.assertEqual(rv.json, {"tables": ["users"], "next": None, "count": 4})
+
+    def test_lists_table_names_by_prefix(self):
+        rv = self.get("tables", prefix="sales.")
+        self.assertEqual(rv.json["tables"], ["sales.Orders", "sales.refunds"])
+
+        rv = self.get("tables", prefix="sales.", after="sales.Orders")
+        self.assertEqual(rv.json["tables"], ["sales.refunds"])
+
+    def test_searches_table_names(self):
+        rv = self.get("tables", q="ORDER")
+        self.assertEqual(rv.json["tables"], ["sales.Orders"])
+
+        rv = self.get("tables", q="s", limit=2)
+        self.assertEqual(rv.json["tables"], ["events", "sales.Orders"])
+
+        rv = self.get("tables", q="s", limit=2, after=rv.json["next"])
+        self.assertEqual(rv.json["tables"], ["sales.refunds", "users"])
+
+    def test_searches_table_names_in_chunks(self):
+        with mock.patch.object(models.schema_cache, "SEARCH_CHUNK_SIZE", 1):
+            self.assertEqual(self.get("tables", q="s", limit=2).json["tables"], ["events", "sales.Orders"])
+            self.assertEqual(self.get("tables", q="user").json["tables"], ["users"])
+
+    def test_returns_columns_of_tables(self):
+        rv = self.get("columns", table=["users", "events", "missing"])
+        self.assertEqual(rv.json, {"tables": [self.tables[3], self.tables[0]]})
+
+    def test_returns_job_when_schema_isnt_cached(self):
+        models.schema_cache.delete(self.factory.data_source.id)
+
+        with mock.patch("redash.handlers.data_sources.get_schema") as get_schema:
+            get_schema.delay.return_value = mock.Mock(id="job", is_started=False, is_cancelled=False, result=None)
+            get_schema.delay.return_value.get_status.return_value = "queued"
+            rv = self.get("tables")
+
+        get_schema.delay.assert_called_once_with(self.factory.data_source.id, False)
+        self.assertEqual(rv.json["job"]["id"], "job")
+
+    def test_validates_arguments(self):
+        self.assertEqual(self.get("tables", limit=0).status_code, 400)
+        self.assertEqual(self.get("columns").status_code, 400)
+
+    def test_requires_access_to_data_source(self):
+        data_source = self.factory.create_data_source(group=self.factory.create_group())
+        rv = self.make_request("get", "/api/data_sources/{}/schema/tables".format(data_source.id))
+        self.assertEqual(rv.status_code, 403)
+
+
 class TestDataSourceListGet(BaseTestCase):
     def test_returns_each_data_source_once(self):
         group = self.factory.create_group()
@@ -1,4 +1,9 @@
+from flask import g
+from mock import patch
+
+from redash import settings
 from redash.models import db
+from redash.serializers import public_dashboard
 from tests import BaseTestCase
 
 
@@ -108,6 +113,59 @@ class TestAPIPublicDashboard(BaseTestCase):
         )
         self.assertEqual(res.status_code, 404)
 
+    def create_dashboard(self, widget_count=2):
+        dashboard = self.factory.create_dashboard()
+        for i in range(widget_count):
+            vis = self.factory.create_visualization(name="Chart {}".format(i))
+            self.factory.create_widget(visualization=vis, dashboard=dashboard)
+        self.factory.create_widget(visualization=None, dashboard=dashboard, text="text")
+        api_key = self.factory.create_api_key(object=dashboard)
+        db.session.commit()
+        return dashboard, api_key
+
+    def test_returns_widgets(self):
+        dashboard, api_key = self.create_dashboard()
+
+        res = self.make_request("get", "/api/dashboards/public/{}".format(api_key.api_key), user=False)
+
+        self.assertEqual(res.json["name"], dashboard.name)
+        widgets = res.json["widgets"]
+        self.assertEqual([w.get("visualization", {}).get("name") for w in widgets], ["Chart 0", "Chart 1", None])
+        self.assertEqual(widgets[0]["visualization"]["query"]["name"], "Query")
+        self.assertEqual(widgets[2]["text"], "text")
+
+    def test_serializes_with_constant_number_of_queries(self):
+        counts = []
+        for widget_count in (2, 20):
+            dashboard, _ = self.create_dashboard(widget_count)
+            db.session.expire_all()
+            with self.app.test_request_context():
+                g.queries_count = 0
+                public_dashboard(dashboard)
+                counts.append(g.queries_count)
+
+        self.assertEqual(counts[0], counts[1])
+
+    def test_caches_response(self):
+        dashboard, api_key = self.create_dashboard()
+        path = "/api/dashboards/public/{}".format(api_key.api_key)
+
+        with patch.object(settings, "PUBLIC_DASHBOARD_CACHE_ENABLED", True):
+            first = self.make_request("get", path, user=False)
+            with patch("redash.handlers.dashboards.public_dashboard") as serialize:
+                second = self.make_request("get", path, user=False)
+
+            serialize.assert_not_called()
+            self.assertEqual(first.json, second.json)
+
+            vis = dashboard.widgets[0].visualization
+            vis.name = "Renamed"
+            db.session.commit()
+
+            third = self.make_request("get", path, user=False)
+
+        self.assertEqual(third.json["widgets"][0]["visualization"]["name"], "Renamed")
+
     # Not relevant for now, as tokens in api_keys table are only created for dashboards. Once this changes, we should
     # add this test.
     # def test_token_doesnt_belong_to_dashboard(self):
@@ -1,5 +1,11 @@
+import mock
+
+from redash import models, redis_connection, settings
 from redash.handlers.query_results import error_messages, run_query
 from redash.models import db
+from redash.tasks import Job
+from redash.tasks.queries import JOB_STATUS_CHANNEL, publish_job_status
+from redash.utils import columnar, json_loads
 from tests import BaseTestCase
 
 
@@ -404,6 +410,85 @@ class TestQueryDropdownsResource(BaseTestCase):
         self.assertEqual(rv.status_code, 403)
 
 
+class TestQueryResultDataPage(BaseTestCase):
+    def setUp(self):
+        super(TestQueryResultDataPage, self).setUp()
+        data = {
+            "columns": [{"name": "id", "type": "integer"}, {"name": "name", "type": "string"}],
+            "rows": [{"id": i, "name": "name-{}".format(i)} for i in range(5)],
+        }
+        self.query_result = self.factory.create_query_result(data=data)
+
+    def test_returns_page_of_rows(self):
+        rv = self.make_request(
+            "get",
+            "/api/query_results/{}?offset=1&limit=2&columns=name&order_by=-id".format(self.query_result.id),
+        )
+
+        self.assertEqual(rv.status_code, 200)
+        data = rv.json["query_result"]["data"]
+        self.assertEqual(data["columns"], [{"name": "name", "type": "string"}])
+        self.assertEqual(data["rows"], [{"name": "name-3"}, {"name": "name-2"}])
+        self.assertEqual(data["total_row_count"], 5)
+
+    def test_only_decodes_projected_columns(self):
+        self.query_result._data = columnar.encode(self.query_result.data)
+        db.session.commit()
+
+        with mock.patch("redash.models.persistence.deserialize_query_result_data") as deserialize:
+            rv = self.make_request("get", "/api/query_results/{}?limit=2&columns=name".format(self.query_result.id))
+
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.json["query_result"]["data"]["rows"], [{"name": "name-0"}, {"name": "name-1"}])
+        deserialize.assert_not_called()
+
+    def test_rejects_unknown_columns(self):
+        rv = self.make_request("get", "/api/query_results/{}?columns=nope".format(self.query_result.id))
+        self.assertEqual(rv.status_code, 400)
+
+    def test_rejects_invalid_offset(self):
+        rv = self.make_request("get", "/api/query_results/{}?offset=-1".format(self.query_result.id))
+        self.assertEqual(rv.status_code, 400)
+
+        rv = self.make_request("get", "/api/query_results/{}?limit=abc".format(self.query_result.id))
+        self.assertEqual(rv.status_code, 400)
+
+
+class TestQueryResultDsvResponse(BaseTestCase):
+    def test_streams_csv_file(self):
+        query = self.factory.create_query()
+        data = {
+            "rows": [{"test": 1, "flag": True}, {"test": 2, "flag": False}],
+            "columns": [{"name": "test", "type": "integer"}, {"name": "flag", "type": "boolean"}],
+        }
+        query_result = self.factory.create_query_result(data=data)
+
+        rv = self.make_request(
+            "get",
+            "/api/queries/{}/results/{}.csv".format(query.id, query_result.id),
+            is_json=False,
+        )
+        self.assertEqual(rv.status_code, 200)
+        self.assertTrue(rv.is_streamed)
+        self.assertEqual(rv.data.decode("utf-8"), "test,flag\r\n1,true\r\n2,false\r\n")
+
+    def test_streams_tsv_file(self):
+        query = self.factory.create_query()
+        data = {
+            "rows": [{"test": 1, "test2": "a"}],
+            "columns": [{"name": "test", "type": "integer"}, {"name": "test2", "type": "string"}],
+        }
+        query_result = self.factory.create_query_result(data=data)
+
+        rv = self.make_request(
+            "get",
+            "/api/queries/{}/results/{}.tsv".format(query.id, query_result.id),
+            is_json=False,
+        )
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.data.decode("utf-8"), "test\ttest2\r\n1\ta\r\n")
+
+
 class TestQueryResultExcelResponse(BaseTestCase):
     def test_renders_excel_file(self):
         query = self.factory.create_query()
@@ -415,6 +500,7 @@ class TestQueryResultExcelResponse(BaseTestCase):
             is_json=False,
         )
         self.assertEqual(rv.status_code, 200)
+        self.assertEqual(int(rv.headers["Content-Length"]), len(rv.data))
 
     def test_renders_excel_file_when_rows_have_missing_columns(self):
         query = self.factory.create_query()
@@ -454,3 +540,209 @@ class TestJobResource(BaseTestCase):
         job = self.make_request("get", f"/api/jobs/{job_id}").json["job"]
         self.assertEqual(job["status"], FAILED)
         self.assertTrue("cancelled" in job["error"])
+
+    def test_publishes_cancelled_status(self):
+        query = self.factory.create_query()
+        job_id = self.make_request("post", f"/api/queries/{query.id}/results", data={"parameters": {}}).json["job"][
+            "id"
+        ]
+        pubsub = redis_connection.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(JOB_STATUS_CHANNEL.format(job_id))
+
+        self.make_request("delete", f"/api/jobs/{job_id}")
+
+        messages = [pubsub.get_message(timeout=0.1) for _ in range(3)]
+        pubsub.close()
+        job = json_loads(next(message for message in messages if message)["data"])
+        self.assertEqual(job["status"], 4)
+        self.assertTrue("cancelled" in job["error"])
+
+
+@mock.patch.object(settings, "QUERY_RESULTS_CACHE_ENABLED", True)
+class TestQueryResultResponseCache(BaseTestCase):
+    def test_serves_cached_response_for_query_result(self):
+        query_result = self.factory.create_query_result()
+        models.query_result_cache.set_response(query_result.id, '{"query_result": {"cached": true}}')
+
+        rv = self.make_request("get", "/api/query_results/{}".format(query_result.id))
+
+        self.assertEqual(200, rv.status_code)
+        self.assertEqual({"query_result": {"cached": True}}, rv.json)
+
+    def test_caches_response_for_query_result(self):
+        query_result = self.factory.create_query_result()
+
+        rv = self.make_request("get", "/api/query_results/{}".format(query_result.id))
+
+        self.assertEqual(rv.json, json_loads(models.query_result_cache.get_response(query_result.id)))
+
+    def test_serves_latest_result_from_cache(self):
+        query_result = self.factory.create_query_result()
+        data = {"data_source_id": self.factory.data_source.id, "query": query_result.query_text}
+
+        rv = self.make_request("post", "/api/query_results", data=data)
+        self.assertEqual(query_result.id, rv.json["query_result"]["id"])
+
+        with mock.patch.object(models.QueryResult, "get_latest") as get_latest:
+            rv = self.make_request("post", "/api/query_results", data=data)
+
+        get_latest.assert_not_called()
+        self.assertEqual(query_result.id, rv.json["query_result"]["id"])
+
+
+class TestDashboardQueryResultsAPI(BaseTestCase):
+    def add_widget(self, dashboard, query):
+        visualization = self.factory.create_visualization(query_rel=query)
+        self.factory.create_widget(dashboard=dashboard, visualization=visualization)
+
+    def execute(self, dashboard, queries, user=None):
+        return self.make_request(
+            "post", "/api/dashboards/{}/results".format(dashboard.id), data={"queries": queries}, user=user
+        )
+
+    def test_returns_cached_results_and_enqueues_misses(self):
+        dashboard = self.factory.create_dashboard()
+        cached = self.factory.create_query()
+        fresh = self.factory.create_query(query_text="SELECT 2")
+        self.add_widget(dashboard, cached)
+        self.add_widget(dashboard, fresh)
+        query_result = self.factory.create_query_result()
+
+        with mock.patch.object(
+            models.QueryResult, "get_latest_many", wraps=models.QueryResult.get_latest_many
+        ) as get_latest_many:
+            rv = self.execute(dashboard, [{"query_id": cached.id, "max_age": 60}, {"query_id": fresh.id}])
+
+        self.assertEqual(rv.status_code, 200)
+        get_latest_many.assert_called_once()
+        cached_result, fresh_result = rv.json["results"]
+        self.assertEqual(cached_result["query_id"], cached.id)
+        self.assertEqual(cached_result["query_result"]["id"], query_result.id)
+        self.assertEqual(fresh_result["query_id"], fresh.id)
+        self.assertIn("job", fresh_result)
+        self.assertNotEqual(fresh_result["job"]["status"], 4)
+
+    def test_max_age_zero_skips_the_cache(self):
+        dashboard = self.factory.create_dashboard()
+        query = self.factory.create_query()
+        self.add_widget(dashboard, query)
+        self.factory.create_query_result()
+
+        with mock.patch("redash.handlers.query_results.enqueue_queries", return_value=[None]) as enqueue_queries:
+            rv = self.execute(dashboard, [{"query_id": query.id, "max_age": 0}])
+
+        self.assertEqual(len(enqueue_queries.call_args[0][0]), 1)
+        self.assertEqual(rv.json["results"][0]["job"]["status"], 4)
+
+    def test_query_not_on_dashboard(self):
+        dashboard = self.factory.create_dashboard()
+        query = self.factory.create_query()
+
+        rv = self.execute(dashboard, [{"query_id": query.id}])
+
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.json["results"][0]["job"]["status"], 4)
+
+    def test_has_no_access_to_data_source(self):
+        dashboard = self.factory.create_dashboard()
+        ds = self.factory.create_data_source(group=self.factory.create_group())
+        query = self.factory.create_query(data_source=ds)
+        self.add_widget(dashboard, query)
+
+        rv = self.execute(dashboard, [{"query_id": query.id}])
+
+        self.assertDictEqual(rv.json["results"][0], dict(error_messages["no_permission"][0], query_id=query.id))
+
+    def test_unsafe_query_on_view_only_data_source(self):
+        dashboard = self.factory.create_dashboard()
+        ds = self.factory.create_data_source(group=self.factory.org.default_group, view_only=True)
+        query = self.factory.create_query(
+            data_source=ds,
+            query_text="SELECT '{{name}}'",
+            options={"parameters": [{"name": "name", "type": "text"}]},
+        )
+        self.add_widget(dashboard, query)
+
+        rv = self.execute(dashboard, [{"query_id": query.id, "parameters": {"name": "x"}}])
+
+        self.assertDictEqual(rv.json["results"][0], dict(error_messages["unsafe_on_view_only"][0], query_id=query.id))
+
+    def test_rejects_malformed_queries(self):
+        dashboard = self.factory.create_dashboard()
+
+        rv = self.execute(dashboard, [{"max_age": 60}])
+        self.assertEqual(rv.status_code, 400)
+
+        rv = self.make_request("post", "/api/dashboards/{}/results".format(dashboard.id), data={"queries": "1"})
+        self.assertEqual(rv.status_code, 400)
+
+
+class TestJobStatusStreamResource(BaseTestCase):
+    def setUp(self):
+        super(TestJobStatusStreamResource, self).setUp()
+        patcher = mock.patch.object(settings, "JOB_STATUS_STREAM_ENABLED", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stream(self, *job_ids):
+        query_string = "&".join("job_id={}".format(job_id) for job_id in job_ids)
+        rv = self.make_request("get", "/api/jobs/stream?{}".format(query_string))
+        events = []
+        for chunk in rv.data.decode().split("\n\n"):
+            lines = dict(line.split(": ", 1) for line in chunk.splitlines() if not line.startswith(":"))
+            if lines:
+                events.append((lines["event"], json_loads(lines["data"])))
+        return rv, events
+
+    def enqueue(self, query_text):
+        query = self.factory.create_query(query_text=query_text)
+        return self.make_request("post", f"/api/queries/{query.id}/results", data={"parameters": {}}).json["job"]["id"]
+
+    def test_multiplexes_published_statuses(self):
+        job_ids = [self.enqueue("SELECT 1"), self.enqueue("SELECT 2")]
+
+        fetch_jobs = Job.fetch_many
+
+        def publish_while_streaming(ids, connection):
+            jobs = fetch_jobs(ids, connection=connection)
+            publish_job_status(job_ids[0], 2)
+            publish_job_status(job_ids[0], 3, query_result_id=10)
+            publish_job_status(job_ids[1], 4, error="broken")
+            return jobs
+
+        with mock.patch.object(Job, "fetch_many", side_effect=publish_while_streaming) as fetch_many:
+            rv, events = self.stream(*job_ids)
+
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.mimetype, "text/event-stream")
+        fetch_many.assert_called_once()
+        statuses = [(data["id"], data["status"]) for event, data in events if event == "job"]
+        self.assertEqual(
+            statuses, [(job_ids[0], 1), (job_ids[1], 1), (job_ids[0], 2), (job_ids[0], 3), (job_ids[1], 4)]
+        )
+        self.assertEqual(events[3][1]["query_result_id"], 10)
+        self.assertEqual(events[-1], ("close", {"pending": []}))
+
+    @mock.patch.object(settings, "JOB_STATUS_STREAM_TIMEOUT", 0.2)
+    def test_closes_with_pending_jobs_after_timeout(self):
+        job_id = self.enqueue("SELECT 1")
+
+        rv, events = self.stream(job_id, "missing")
+
+        self.assertEqual((events[0][1]["id"], events[0][1]["status"]), (job_id, 1))
+        self.assertEqual(events[1][1]["id"], "missing")
+        self.assertEqual(events[1][1]["status"], 4)
+        self.assertEqual(events[-1], ("close", {"pending": [job_id]}))
+
+    def test_requires_job_ids(self):
+        rv = self.make_request("get", "/api/jobs/stream")
+        self.assertEqual(rv.status_code, 400)
+
+        with mock.patch.object(settings, "JOB_STATUS_STREAM_MAX_JOBS", 1):
+            rv = self.make_request("get", "/api/jobs/stream?job_id=a&job_id=b")
+        self.assertEqual(rv.status_code, 400)
+
+    @mock.patch.object(settings, "JOB_STATUS_STREAM_ENABLED", False)
+    def test_returns_404_when_disabled(self):
+        rv = self.make_request("get", "/api/jobs/stream?job_id=a")
+        self.assertEqual(rv.status_code, 404)
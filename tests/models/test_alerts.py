@@ -1,7 +1,10 @@
 import textwrap
 from unittest import TestCase
 
-from redash.models import OPERATORS, Alert, db, next_state
+import mock
+
+from redash.models import OPERATORS, Alert, QueryResult, db, next_state
+from redash.utils import columnar
 from tests import BaseTestCase
 
 
@@ -122,6 +125,32 @@ class TestAlertEvaluate(BaseTestCase):
         alert = self.create_alert(get_results(None))
         self.assertEqual(alert.evaluate(), Alert.UNKNOWN_STATE)
 
+    def test_evaluates_columnar_results_decoding_only_the_alert_column(self):
+        results = {
+            "rows": [{"foo": i, "bar": "x" * 10} for i in range(5)],
+            "columns": [{"name": "foo", "type": "INTEGER"}, {"name": "bar", "type": "STRING"}],
+        }
+        alert = self.create_alert(results, value="4")
+        alert.options["selector"] = "max"
+        query_result = alert.query_rel.latest_query_data
+        query_result._data = columnar.encode(results)
+
+        self.assertEqual(alert.evaluate(), Alert.TRIGGERED_STATE)
+        self.assertEqual(["foo"], list(query_result.columnar_data._decoded))
+
+    def test_alerts_share_selected_values(self):
+        alert = self.create_alert(get_results(1))
+        other_alert = self.factory.create_alert(
+            query_rel=alert.query_rel, options={"selector": "first", "op": "!=", "column": "foo", "value": "1"}
+        )
+        selected_values = {}
+
+        with mock.patch.object(QueryResult, "column_values", autospec=True, return_value=[1]) as column_values:
+            self.assertEqual(alert.evaluate(selected_values), Alert.TRIGGERED_STATE)
+            self.assertEqual(other_alert.evaluate(selected_values), Alert.OK_STATE)
+
+        column_values.assert_called_once()
+
 
 class TestNextState(TestCase):
     def test_numeric_value(self):
@@ -191,6 +220,17 @@ class TestAlertRenderTemplate(BaseTestCase):
         result = alert.render_template(textwrap.dedent(custom_alert))
         self.assertMultiLineEqual(result, textwrap.dedent(expected))
 
+    def test_render_template_is_memoized_per_state(self):
+        alert = self.create_alert(get_results(1))
+
+        with mock.patch.object(Alert, "_render_template", autospec=True, return_value="rendered") as render:
+            alert.render_template("{{ALERT_STATUS}}")
+            alert.render_template("{{ALERT_STATUS}}")
+            alert.state = Alert.TRIGGERED_STATE
+            alert.render_template("{{ALERT_STATUS}}")
+
+        self.assertEqual(2, render.call_count)
+
     def test_render_custom_alert_template_query_table(self):
         alert = self.create_alert(get_results(1))
         custom_alert = """
@@ -1,12 +1,20 @@
 import mock
 from mock import patch
 
-from redash.models import DataSource, Query, QueryResult
+from redash import redis_connection
+from redash.models import DataSource, Query, QueryResult, schema_cache
+from redash.query_runner import NotSupported
 from redash.utils.configuration import ConfigurationContainer
 from tests import BaseTestCase
 
 
 class DataSourceTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        fingerprints = patch("redash.query_runner.pg.PostgreSQL.get_schema_fingerprints", side_effect=NotSupported)
+        fingerprints.start()
+        self.addCleanup(fingerprints.stop)
+
     def test_get_schema(self):
         return_value = [{"name": "table", "columns": []}]
 
@@ -86,16 +94,92 @@ class DataSourceTest(BaseTestCase):
 
             self.assertEqual(out_schema, sorted_schema)
 
-    @patch("redash.redis_connection.set")
-    def test_expires_schema(self, mock_redis):
+    def test_expires_schema(self):
         # default of 30min + 7 days
         expected_ttl = 606600
 
         with mock.patch("redash.query_runner.pg.PostgreSQL.get_schema") as patched_get_schema:
-            patched_get_schema.return_value = None
+            patched_get_schema.return_value = [{"name": "table", "columns": []}]
             self.factory.data_source.get_schema(refresh=True)
 
-        mock_redis.assert_called_with("data_source:schema:1", "null", ex=expected_ttl)
+        for key in (schema_cache.TABLES_KEY, schema_cache.NAMESPACES_KEY):
+            self.assertAlmostEqual(
+                redis_connection.ttl(key.format(self.factory.data_source.id)), expected_ttl, delta=5
+            )
+
+
+class TestDataSourceIncrementalSchema(BaseTestCase):
+    def refresh(self, fingerprints, tables):
+        with patch("redash.query_runner.pg.PostgreSQL.get_schema_fingerprints", return_value=fingerprints), patch(
+            "redash.query_runner.pg.PostgreSQL.get_namespace_schema",
+            side_effect=lambda namespaces: {namespace: tables[namespace] for namespace in namespaces},
+        ) as get_namespace_schema, patch("redash.query_runner.pg.PostgreSQL.get_schema") as get_schema:
+            schema = self.factory.data_source.get_schema(refresh=True)
+
+        get_schema.assert_not_called()
+        return schema, get_namespace_schema
+
+    def test_fetches_only_changed_namespaces(self):
+        tables = {
+            "public": [{"name": "users", "columns": ["name", "id"]}],
+            "sales": [{"name": "sales.orders", "columns": ["id"]}, {"name": "sales.refunds", "columns": ["id"]}],
+        }
+        schema, get_namespace_schema = self.refresh({"public": "a", "sales": "b"}, tables)
+
+        get_namespace_schema.assert_called_once_with(["public", "sales"])
+        self.assertEqual([table["name"] for table in schema], ["sales.orders", "sales.refunds", "users"])
+        self.assertEqual(schema[2]["columns"], ["id", "name"])
+
+        tables["sales"] = [{"name": "sales.orders", "columns": ["id", "total"]}]
+        schema, get_namespace_schema = self.refresh({"public": "a", "sales": "c"}, tables)
+
+        get_namespace_schema.assert_called_once_with(["sales"])
+        self.assertEqual(
+            schema,
+            [{"name": "sales.orders", "columns": ["id", "total"]}, {"name": "users", "columns": ["id", "name"]}],
+        )
+        self.assertEqual(self.factory.data_source.get_cached_schema(), schema)
+
+    def test_skips_fetching_when_nothing_changed(self):
+        tables = {"public": [{"name": "users", "columns": ["id"]}]}
+        self.refresh({"public": "a"}, tables)
+
+        schema, get_namespace_schema = self.refresh({"public": "a"}, tables)
+
+        get_namespace_schema.assert_not_called()
+        self.assertEqual(schema, tables["public"])
+
+    def test_drops_removed_namespaces(self):
+        tables = {"public": [{"name": "users", "columns": ["id"]}], "sales": [{"name": "sales.orders", "columns": []}]}
+        self.refresh({"public": "a", "sales": "b"}, tables)
+
+        schema, _ = self.refresh({"public": "a"}, tables)
+
+        self.assertEqual(schema, tables["public"])
+
+    def test_indexes_table_names(self):
+        tables = {"public": [{"name": "users", "columns": ["id"]}], "sales": [{"name": "sales.orders", "columns": []}]}
+        self.refresh({"public": "a", "sales": "b"}, tables)
+        self.assertEqual(schema_cache.list_names(self.factory.data_source.id), ["sales.orders", "users"])
+
+        self.refresh({"public": "a"}, tables)
+        self.assertEqual(schema_cache.list_names(self.factory.data_source.id), ["users"])
+
+    def test_replaces_schema_of_full_refresh(self):
+        with patch("redash.query_runner.pg.PostgreSQL.get_schema_fingerprints", side_effect=NotSupported), patch(
+            "redash.query_runner.pg.PostgreSQL.get_schema", return_value=[{"name": "old", "columns": []}]
+        ):
+            self.factory.data_source.get_schema(refresh=True)
+
+        schema, _ = self.refresh({"public": "a"}, {"public": [{"name": "users", "columns": []}]})
+
+        self.assertEqual(schema, [{"name": "users", "columns": []}])
+
+    def test_caches_data_source_without_tables(self):
+        schema, _ = self.refresh({}, {})
+
+        self.assertEqual(schema, [])
+        self.assertEqual(self.factory.data_source.get_cached_schema(), [])
 
 
 class TestDataSourceCreate(BaseTestCase):
@@ -162,9 +246,13 @@ class TestDataSourceDelete(BaseTestCase):
         self.assertIsNone(DataSource.query.get(data_source.id))
         self.assertEqual(0, QueryResult.query.filter(QueryResult.data_source == data_source).count())
 
-    @patch("redash.redis_connection.delete")
-    def test_deletes_schema(self, mock_redis):
+    def test_deletes_schema(self):
         data_source = self.factory.create_data_source()
+        with patch("redash.query_runner.pg.PostgreSQL.get_schema_fingerprints", side_effect=NotSupported), patch(
+            "redash.query_runner.pg.PostgreSQL.get_schema", return_value=[]
+        ):
+            data_source.get_schema()
+
         data_source.delete()
 
-        mock_redis.assert_called_with(data_source._schema_key)
+        self.assertIsNone(data_source.get_cached_schema())
@@ -0,0 +1,76 @@
+import datetime
+
+import mock
+
+from redash import models, redis_connection, settings
+from redash.models.query_result_cache import QueryResultCache
+from redash.utils import utcnow
+from tests import BaseTestCase
+
+
+class QueryResultCacheTest(BaseTestCase):
+    def setUp(self):
+        super(QueryResultCacheTest, self).setUp()
+        self.cache = QueryResultCache()
+        patcher = mock.patch.object(settings, "QUERY_RESULTS_CACHE_ENABLED", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_or_set_response_serializes_once(self):
+        serialize = mock.Mock(return_value='{"query_result": {}}')
+
+        self.assertEqual('{"query_result": {}}', self.cache.get_or_set_response(1, serialize))
+        self.assertEqual('{"query_result": {}}', self.cache.get_or_set_response(1, serialize))
+        serialize.assert_called_once_with()
+
+    def test_public_and_private_responses_are_separate(self):
+        self.cache.set_response(1, "private")
+
+        self.assertEqual("private", self.cache.get_response(1))
+        self.assertIsNone(self.cache.get_response(1, public=True))
+
+    def test_skips_responses_larger_than_max_item_size(self):
+        with mock.patch.object(settings, "QUERY_RESULTS_CACHE_MAX_ITEM_SIZE", 10):
+            self.cache.set_response(1, "x" * 11)
+
+        self.assertIsNone(self.cache.get_response(1))
+
+    def test_does_nothing_when_disabled(self):
+        with mock.patch.object(settings, "QUERY_RESULTS_CACHE_ENABLED", False):
+            self.cache.set_response(1, "response")
+            self.assertIsNone(self.cache.get_response(1))
+
+        self.assertEqual([], redis_connection.keys("query_result:*"))
+
+    def test_invalidate_removes_responses(self):
+        self.cache.set_response(1, "private")
+        self.cache.set_response(1, "public", public=True)
+        self.cache.set_response(2, "other")
+
+        self.cache.invalidate([1])
+
+        self.assertIsNone(self.cache.get_response(1))
+        self.assertIsNone(self.cache.get_response(1, public=True))
+        self.assertEqual("other", self.cache.get_response(2))
+
+    def test_get_latest_id(self):
+        qr = self.factory.create_query_result()
+        self.cache.set_latest(qr)
+
+        self.assertEqual(qr.id, self.cache.get_latest_id(qr.data_source_id, qr.query_hash, 60))
+        self.assertEqual(qr.id, self.cache.get_latest_id(qr.data_source_id, qr.query_hash, -1))
+        self.assertIsNone(self.cache.get_latest_id(qr.data_source_id, "other hash", 60))
+
+    def test_get_latest_id_respects_max_age(self):
+        qr = self.factory.create_query_result(retrieved_at=utcnow() - datetime.timedelta(hours=1))
+        self.cache.set_latest(qr)
+
+        self.assertIsNone(self.cache.get_latest_id(qr.data_source_id, qr.query_hash, 60))
+
+    def test_store_result_invalidates_latest(self):
+        qr = self.factory.create_query_result()
+        self.cache.set_latest(qr)
+
+        models.QueryResult.store_result(qr.org_id, qr.data_source, qr.query_hash, qr.query_text, {}, 0, utcnow())
+
+        self.assertIsNone(self.cache.get_latest_id(qr.data_source_id, qr.query_hash, -1))
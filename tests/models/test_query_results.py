@@ -1,7 +1,8 @@
 import datetime
 
 from redash import models
-from redash.utils import utcnow
+from redash.models import ColumnarPersistence
+from redash.utils import columnar, json_loads, utcnow
 from tests import BaseTestCase
 
 
@@ -58,6 +59,30 @@ class QueryResultTest(BaseTestCase):
 
         self.assertEqual(found_query_result.id, qr.id)
 
+    def test_get_latest_many_returns_the_most_recent_result_of_each_lookup(self):
+        self.factory.create_query_result(retrieved_at=utcnow() - datetime.timedelta(seconds=30))
+        qr = self.factory.create_query_result()
+        other_data_source = self.factory.create_data_source()
+        other_qr = self.factory.create_query_result(data_source=other_data_source)
+        missing = (qr.data_source_id, "missing", 60)
+
+        lookups = [(qr.data_source_id, qr.query_hash, 60), (other_data_source.id, qr.query_hash, -1), missing]
+        found = models.QueryResult.get_latest_many(lookups)
+
+        self.assertEqual(found[lookups[0]].id, qr.id)
+        self.assertEqual(found[lookups[1]].id, other_qr.id)
+        self.assertNotIn(missing, found)
+
+    def test_get_latest_many_applies_the_max_age_of_each_lookup(self):
+        qr = self.factory.create_query_result(retrieved_at=utcnow() - datetime.timedelta(seconds=90))
+
+        fresh = (qr.data_source_id, qr.query_hash, 60)
+        stale = (qr.data_source_id, qr.query_hash, 120)
+        found = models.QueryResult.get_latest_many([fresh, stale])
+
+        self.assertNotIn(fresh, found)
+        self.assertEqual(found[stale].id, qr.id)
+
     def test_store_result_does_not_modify_query_update_at(self):
         original_updated_at = utcnow() - datetime.timedelta(hours=1)
         query = self.factory.create_query(updated_at=original_updated_at)
@@ -73,3 +98,72 @@ class QueryResultTest(BaseTestCase):
         )
 
         self.assertEqual(original_updated_at, query.updated_at)
+
+
+class QueryResultPersistenceTest(BaseTestCase):
+    data = {
+        "columns": [{"name": "id", "type": "integer"}, {"name": "name", "type": "string"}],
+        "rows": [{"id": 1, "name": "a"}, {"id": 2, "name": None}],
+    }
+
+    def test_stores_json_by_default(self):
+        qr = self.factory.create_query_result(data=self.data)
+
+        self.assertEqual(json_loads(qr._data), self.data)
+        self.assertEqual(qr.data, self.data)
+
+    def test_reads_columnar_and_json_results(self):
+        columnar_qr = self.factory.create_query_result(data=None)
+        columnar_qr._data = columnar.encode(self.data)
+        json_qr = self.factory.create_query_result(data=self.data)
+        models.db.session.commit()
+        models.db.session.expire_all()
+
+        self.assertEqual(models.QueryResult.query.get(columnar_qr.id).data, self.data)
+        self.assertEqual(models.QueryResult.query.get(json_qr.id).data, self.data)
+
+    def test_columnar_persistence_serializes_columnar(self):
+        persistence = ColumnarPersistence()
+
+        self.assertTrue(columnar.is_columnar(persistence.serialize_data(self.data)))
+        self.assertEqual(
+            json_loads(persistence.serialize_data({"columns": {}, "rows": []})), {"columns": {}, "rows": []}
+        )
+
+    def test_data_is_updated_when_raw_value_changes(self):
+        qr = self.factory.create_query_result(data=self.data)
+        self.assertEqual(qr.data, self.data)
+
+        qr.data = {"columns": [], "rows": []}
+
+        self.assertEqual(qr.data, {"columns": [], "rows": []})
+
+    def test_data_page(self):
+        data = {
+            "columns": [{"name": "id", "type": "integer"}, {"name": "name", "type": "string"}],
+            "rows": [{"id": i, "name": "name-{}".format(i % 3)} for i in range(10)],
+        }
+        json_qr = self.factory.create_query_result(data=data)
+        columnar_qr = self.factory.create_query_result(data=None)
+        columnar_qr._data = columnar.encode(data)
+
+        for qr in (json_qr, columnar_qr):
+            page = qr.data_page(columns=["id"], offset=2, limit=3, order_by=[("name", True), ("id", False)])
+
+            self.assertEqual(page["columns"], [{"name": "id", "type": "integer"}])
+            self.assertEqual(page["rows"], [{"id": 8}, {"id": 1}, {"id": 4}])
+            self.assertEqual(page["total_row_count"], 10)
+
+            page = qr.data_page(offset=8)
+            self.assertEqual(page["rows"], data["rows"][8:])
+            self.assertEqual(page["columns"], data["columns"])
+
+    def test_data_page_sorts_nulls_and_mixed_types(self):
+        qr = self.factory.create_query_result(data=None)
+        qr._data = columnar.encode(
+            {"columns": [{"name": "value"}], "rows": [{"value": "b"}, {"value": None}, {"value": 1}]}
+        )
+
+        self.assertEqual(
+            qr.data_page(order_by=[("value", False)])["rows"], [{"value": None}, {"value": 1}, {"value": "b"}]
+        )
@@ -1,6 +1,15 @@
+import re
 import unittest
 
-from redash.query_runner import BaseQueryRunner, BaseSQLQueryRunner
+import mock
+
+from redash import query_runner
+from redash.query_runner import (
+    BaseQueryRunner,
+    BaseSQLQueryRunner,
+    apply_auto_limit,
+    split_sql_statements,
+)
 from redash.utils import gen_query_hash
 
 
@@ -130,5 +139,53 @@ class TestBaseSQLQueryRunner(unittest.TestCase):
         self.assertEqual(gen_query_hash(origin_query_text), base_runner.gen_query_hash(origin_query_text, True))
 
 
+class TestSplitSQLStatements(unittest.TestCase):
+    queries = [
+        "",
+        "  SELECT *\nFROM table  \n",
+        "SELECT 'go' FROM table WHERE a = 1",
+        "SELECT 1; SELECT 2;",
+        "SELECT 1 -- comment",
+        "SELECT /* comment */ 1",
+        "SELECT 1\nGO\nSELECT 2",
+    ]
+
+    def test_single_statements_are_not_parsed(self):
+        with mock.patch("sqlparse.engine.FilterStack") as filter_stack:
+            self.assertEqual(["SELECT *\nFROM table"], split_sql_statements("  SELECT *\nFROM table  \n"))
+
+        filter_stack.assert_not_called()
+
+    def test_fast_path_matches_parsing(self):
+        for query in self.queries:
+            with mock.patch.object(query_runner, "STATEMENT_SEPARATORS_REGEX", re.compile("")):
+                expected = split_sql_statements(query)
+
+            self.assertEqual(expected, split_sql_statements(query), query)
+
+
+class TestApplyAutoLimitCache(unittest.TestCase):
+    def setUp(self):
+        apply_auto_limit.cache_clear()
+
+    def test_reuses_results_for_same_text_and_settings(self):
+        runner = BaseSQLQueryRunner({})
+
+        self.assertEqual("SELECT 1 LIMIT 1000", runner.apply_auto_limit("SELECT 1", True))
+        self.assertEqual("SELECT 1 LIMIT 1000", BaseSQLQueryRunner({}).apply_auto_limit("SELECT 1", True))
+
+        self.assertEqual(1, apply_auto_limit.cache_info().hits)
+
+    def test_limit_settings_are_part_of_the_key(self):
+        class TopQueryRunner(BaseSQLQueryRunner):
+            limit_query = " TOP 1000"
+            limit_keywords = ["TOP"]
+            limit_after_select = True
+
+        self.assertEqual("SELECT 1 LIMIT 1000", BaseSQLQueryRunner({}).apply_auto_limit("SELECT 1", True))
+        self.assertEqual("SELECT TOP 1000 1", TopQueryRunner({}).apply_auto_limit("SELECT 1", True))
+        self.assertEqual("SELECT 1", BaseSQLQueryRunner({}).apply_auto_limit("SELECT 1", False))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,182 @@
+from unittest import TestCase, mock
+
+from redash import settings
+from redash.query_runner.connection_pool import ConnectionPool
+from redash.query_runner.pg import PostgreSQL, Redshift
+
+
+class FakeConnection:
+    def __init__(self):
+        self.resets = 0
+        self.pings = 0
+        self.closed = False
+
+
+class ConnectionPoolTestCase(TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool()
+        self.created = []
+        patcher = mock.patch.object(settings, "QUERY_RUNNER_POOL_ENABLED", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def connect(self):
+        connection = FakeConnection()
+        self.created.append(connection)
+        return connection
+
+    def reset(self, connection):
+        connection.resets += 1
+
+    def ping(self, connection):
+        connection.pings += 1
+
+    def close(self, connection):
+        connection.closed = True
+
+    def use(self, key="pg:1", reset=None, ping=None):
+        with self.pool.connection(key, self.connect, reset or self.reset, ping or self.ping, self.close) as connection:
+            return connection
+
+
+class TestConnectionPool(ConnectionPoolTestCase):
+    def test_reuses_connections(self):
+        first = self.use()
+        second = self.use()
+
+        self.assertIs(first, second)
+        self.assertEqual(len(self.created), 1)
+        self.assertEqual(first.resets, 2)
+        self.assertFalse(first.closed)
+
+    def test_keeps_connections_per_key(self):
+        first = self.use("pg:1")
+        second = self.use("pg:2")
+
+        self.assertIsNot(first, second)
+        self.assertIs(self.use("pg:1"), first)
+
+    def test_discards_connections_that_fail_to_reset(self):
+        def reset(connection):
+            raise Exception("connection lost")
+
+        first = self.use(reset=reset)
+        second = self.use()
+
+        self.assertTrue(first.closed)
+        self.assertIsNot(first, second)
+
+    def test_discards_connections_when_the_query_fails(self):
+        with self.assertRaises(KeyError):
+            with self.pool.connection("pg:1", self.connect, self.reset, self.ping, self.close):
+                raise KeyError()
+
+        self.assertTrue(self.created[0].closed)
+        self.assertIsNot(self.use(), self.created[0])
+
+    def test_does_not_pool_without_key(self):
+        first = self.use(key=None)
+        second = self.use(key=None)
+
+        self.assertTrue(first.closed)
+        self.assertIsNot(first, second)
+        self.assertEqual(first.resets, 0)
+
+    def test_does_not_pool_when_disabled(self):
+        with mock.patch.object(settings, "QUERY_RUNNER_POOL_ENABLED", False):
+            first = self.use()
+            second = self.use()
+
+        self.assertTrue(first.closed)
+        self.assertIsNot(first, second)
+
+    def test_caps_idle_connections(self):
+        with mock.patch.object(settings, "QUERY_RUNNER_POOL_MAX_SIZE", 1):
+            with self.pool.connection("pg:1", self.connect, self.reset, self.ping, self.close) as first:
+                second = self.use()
+            self.assertTrue(first.closed)
+            self.assertIs(self.use(), second)
+
+    def test_pings_connections_idle_for_a_while(self):
+        with mock.patch("time.monotonic", return_value=1000):
+            connection = self.use()
+        with mock.patch("time.monotonic", return_value=1000 + settings.QUERY_RUNNER_POOL_PING_AFTER + 1):
+            self.assertIs(self.use(), connection)
+        self.assertEqual(connection.pings, 1)
+
+    def test_discards_connections_that_fail_the_ping(self):
+        def ping(connection):
+            raise Exception("server closed the connection")
+
+        with mock.patch("time.monotonic", return_value=1000):
+            first = self.use()
+        with mock.patch("time.monotonic", return_value=1000 + settings.QUERY_RUNNER_POOL_PING_AFTER + 1):
+            second = self.use(ping=ping)
+
+        self.assertTrue(first.closed)
+        self.assertIsNot(first, second)
+
+    def test_closes_expired_connections(self):
+        with mock.patch("time.monotonic", return_value=1000):
+            first = self.use("pg:1")
+        with mock.patch("time.monotonic", return_value=1000 + settings.QUERY_RUNNER_POOL_MAX_IDLE_TIME + 1):
+            self.use("pg:2")
+
+        self.assertTrue(first.closed)
+        self.assertEqual(len(self.created), 2)
+
+    def test_sweep_closes_expired_connections(self):
+        with mock.patch("time.monotonic", return_value=1000):
+            expired = self.use("pg:1")
+        with mock.patch("time.monotonic", return_value=1000 + settings.QUERY_RUNNER_POOL_MAX_IDLE_TIME):
+            recent = self.use("pg:2")
+        with mock.patch("time.monotonic", return_value=1000 + settings.QUERY_RUNNER_POOL_MAX_IDLE_TIME + 1):
+            self.pool.sweep()
+            self.assertTrue(expired.closed)
+            self.assertFalse(recent.closed)
+            self.assertIs(self.use("pg:2"), recent)
+
+    def test_forgets_connections_after_fork(self):
+        first = self.use()
+        with mock.patch("os.getpid", return_value=-1):
+            second = self.use()
+
+        self.assertIsNot(first, second)
+        self.assertFalse(first.closed)
+
+    def test_clear_closes_idle_connections(self):
+        connection = self.use()
+        self.pool.clear()
+
+        self.assertTrue(connection.closed)
+        self.assertIsNot(self.use(), connection)
+
+
+class TestPostgreSQLPooling(TestCase):
+    def test_key_depends_on_options(self):
+        runner = PostgreSQL({"host": "localhost", "dbname": "a"})
+        other = PostgreSQL({"host": "localhost", "dbname": "b"})
+
+        self.assertEqual(
+            ConnectionPool.key(runner, runner.configuration),
+            ConnectionPool.key(runner, {"dbname": "a", "host": "localhost"}),
+        )
+        self.assertNotEqual(
+            ConnectionPool.key(runner, runner.configuration), ConnectionPool.key(other, other.configuration)
+        )
+
+    def test_pools_postgresql_connections(self):
+        runner = PostgreSQL({"host": "localhost", "dbname": "a"})
+        with mock.patch("redash.query_runner.pg.connection_pool.connection") as connection:
+            runner._pooled_connection()
+        self.assertIsNotNone(connection.call_args[0][0])
+
+    def test_does_not_pool_redshift_or_ssh_tunnel_connections(self):
+        redshift = Redshift({"host": "localhost", "dbname": "a"})
+        tunneled = PostgreSQL({"host": "localhost", "dbname": "a"})
+        tunneled.uses_ssh_tunnel = True
+
+        for runner in (redshift, tunneled):
+            with mock.patch("redash.query_runner.pg.connection_pool.connection") as connection:
+                runner._pooled_connection()
+            self.assertIsNone(connection.call_args[0][0])
@@ -1,6 +1,10 @@
-from unittest import TestCase
+import contextlib
+from unittest import TestCase, mock
 
-from redash.query_runner.pg import build_schema
+import psycopg2
+
+from redash.query_runner import NotSupported
+from redash.query_runner.pg import PostgreSQL, Redshift, build_schema
 
 
 class TestBuildSchema(TestCase):
@@ -41,3 +45,52 @@ class TestBuildSchema(TestCase):
         self.assertListEqual(
             schema["main.users"]["columns"], [{"name": "id", "type": "integer"}, {"name": "name", "type": "varchar"}]
         )
+
+
+class TestGetNamespaceSchema(TestCase):
+    def test_groups_tables_by_namespace(self):
+        rows = [
+            {"table_schema": "public", "table_name": "users", "column_name": "id", "data_type": "integer"},
+            {"table_schema": "sales", "table_name": "orders", "column_name": "id", "data_type": "integer"},
+            {"table_schema": "sales", "table_name": "orders", "column_name": "total", "data_type": "numeric"},
+        ]
+        runner = PostgreSQL({})
+
+        with mock.patch.object(runner, "run_query", return_value=({"rows": rows}, None)) as run_query:
+            tables = runner.get_namespace_schema(["public", "sales", "o'brien"])
+
+        self.assertIn("AND table_schema IN ('public', 'sales', 'o''brien')", run_query.call_args[0][0])
+        self.assertEqual(tables["public"], [{"name": "users", "columns": [{"name": "id", "type": "integer"}]}])
+        self.assertEqual([table["name"] for table in tables["sales"]], ["sales.orders"])
+        self.assertEqual(tables["o'brien"], [])
+
+    def test_fingerprints_by_namespace(self):
+        rows = [{"table_schema": "public", "fingerprint": "a"}, {"table_schema": "sales", "fingerprint": "b"}]
+        runner = PostgreSQL({})
+
+        with mock.patch.object(runner, "run_query", return_value=({"rows": rows}, None)):
+            self.assertEqual(runner.get_schema_fingerprints(), {"public": "a", "sales": "b"})
+
+    def test_redshift_doesnt_support_fingerprints(self):
+        self.assertRaises(NotSupported, Redshift({}).get_schema_fingerprints)
+
+
+class TestCancel(TestCase):
+    def test_cancels_the_running_query(self):
+        runner = PostgreSQL({"host": "db", "dbname": "redash"})
+        connection = mock.MagicMock()
+
+        def execute(query):
+            self.assertTrue(runner.cancel())
+            raise psycopg2.extensions.QueryCanceledError("canceling statement due to user request")
+
+        connection.cursor.return_value.execute.side_effect = execute
+        with mock.patch.object(PostgreSQL, "_pooled_connection", return_value=contextlib.nullcontext(connection)):
+            data, error = runner.run_query("SELECT pg_sleep(60)", None)
+
+        connection.cancel.assert_called_once_with()
+        self.assertIsNone(data)
+        self.assertEqual(error, "canceling statement due to user request")
+
+    def test_does_nothing_without_a_running_query(self):
+        self.assertFalse(PostgreSQL({"host": "db", "dbname": "redash"}).cancel())
@@ -1,10 +1,23 @@
+import threading
 import time
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest import TestCase
+from urllib.parse import parse_qs, urlparse
 
 import mock
+import requests
 
-from redash.query_runner.prometheus import Prometheus, get_instant_rows, get_range_rows
+from redash import settings
+from redash.query_runner.prometheus import (
+    Prometheus,
+    get_instant_rows,
+    get_range_rows,
+    parse_step,
+    split_range,
+)
+from redash.utils import json_dumps
+from tests import BaseTestCase
 
 
 class TestPrometheus(TestCase):
@@ -315,79 +328,17 @@ class TestPrometheus(TestCase):
         requests_get_mock.assert_called_once_with("url/api/v1/label/__name__/values", **prometheus_kwargs)
         cleanup_cert_files_mock.assert_called_once_with(prometheus_kwargs)
 
-    @mock.patch("redash.query_runner.prometheus.requests.get")
+    @mock.patch("redash.query_runner.prometheus.sessions")
     @mock.patch("redash.query_runner.prometheus.Prometheus._cleanup_cert_files")
     def test_run_query(
         self,
         cleanup_cert_files_mock: mock.MagicMock,
-        requests_get_mock: mock.MagicMock,
+        sessions_mock: mock.MagicMock,
     ):
-        # 1. case: successful run instant query
-        prometheus = Prometheus({"url": "url"})
+        session_get_mock = sessions_mock.get.return_value.get
         prometheus_kwargs = {"verify": True, "cert": ()}
-
+        now_datetime = datetime(2018, 1, 26, 12, 0, 0)
         timestamp_expected_7400 = datetime.fromtimestamp(1516937400.781)
-
-        rows = [
-            {
-                "name": "example_metric_name",
-                "foo_bar": "foo",
-                "timestamp": timestamp_expected_7400,
-                "value": "7400_foo",
-            },
-            {
-                "name": "example_metric_name",
-                "foo_bar": "bar",
-                "timestamp": timestamp_expected_7400,
-                "value": "7400_bar",
-            },
-        ]
-        columns = [
-            {"friendly_name": "timestamp", "type": "datetime", "name": "timestamp"},
-            {"friendly_name": "value", "type": "string", "name": "value"},
-            {"friendly_name": "name", "type": "string", "name": "name"},
-            {"friendly_name": "foo_bar", "type": "string", "name": "foo_bar"},
-        ]
-
-        data_expected = {"rows": rows, "columns": columns}
-
-        requests_get_mock.return_value = mock.Mock(
-            json=mock.Mock(return_value={"data": {"result": self.instant_query_result}})
-        )
-
-        data, error = prometheus.run_query("http_requests_total", "user")
-
-        self.assertEqual(data, data_expected)
-        self.assertIsNone(error)
-        requests_get_mock.assert_called_once_with(
-            "url/api/v1/query", params={"query": ["http_requests_total"]}, **prometheus_kwargs
-        )
-        cleanup_cert_files_mock.assert_called_once_with(prometheus_kwargs)
-
-        cleanup_cert_files_mock.reset_mock()
-        requests_get_mock.reset_mock()
-
-        # 2. case: successful run instant query with empty result
-        prometheus = Prometheus({"url": "url"})
-        prometheus_kwargs = {"verify": True, "cert": ()}
-
-        requests_get_mock.return_value = mock.Mock(json=mock.Mock(return_value={"data": {"result": []}}))
-
-        data, error = prometheus.run_query("http_requests_total", "user")
-
-        self.assertIsNone(data)
-        self.assertEqual(error, "query result is empty.")
-        requests_get_mock.assert_called_once_with(
-            "url/api/v1/query", params={"query": ["http_requests_total"]}, **prometheus_kwargs
-        )
-        cleanup_cert_files_mock.assert_called_once_with(prometheus_kwargs)
-
-        cleanup_cert_files_mock.reset_mock()
-        requests_get_mock.reset_mock()
-
-        # 3. case: successful run range query with start and end
-        prometheus = Prometheus({"url": "url"})
-        prometheus_kwargs = {"verify": True, "cert": ()}
         timestamp_expected_8000 = datetime.fromtimestamp(1516938000.781)
 
         rows = [
@@ -423,117 +374,269 @@ class TestPrometheus(TestCase):
             {"friendly_name": "foo_bar", "type": "string", "name": "foo_bar"},
         ]
 
-        data_expected = {"rows": rows, "columns": columns}
+        def run_query(query):
+            prometheus = Prometheus({"url": "url"})
+            with mock.patch.object(Prometheus, "_get_datetime_now", return_value=now_datetime):
+                return prometheus.run_query(query, "user")
+
+        def assert_requested(start, end, step):
+            session_get_mock.assert_called_once_with(
+                "url/api/v1/query_range",
+                params={
+                    "query": ["http_requests_total"],
+                    "start": [time.mktime(start.timetuple())],
+                    "end": [time.mktime(end.timetuple())],
+                    "step": [step],
+                },
+                **prometheus_kwargs,
+            )
+            cleanup_cert_files_mock.assert_called_once_with(prometheus_kwargs)
+            cleanup_cert_files_mock.reset_mock()
+            session_get_mock.reset_mock()
 
-        requests_get_mock.return_value = mock.Mock(
+        session_get_mock.return_value = mock.Mock(
             json=mock.Mock(return_value={"data": {"result": self.range_query_result}})
         )
 
-        start_timestamp_expected = int(time.mktime(datetime(2018, 1, 26).timetuple()))
-        end_timestamp_expected = int(time.mktime(datetime(2018, 1, 27).timetuple()))
-        data, error = prometheus.run_query(
-            "http_requests_total&start=2018-01-26T00:00:00.000Z&end=2018-01-27T00:00:00.000Z&step=60s", "user"
-        )
+        # 1. case: query without a range is run over the last hour
+        data, error = run_query("http_requests_total")
 
-        self.assertEqual(data, data_expected)
+        self.assertEqual(data, {"rows": rows, "columns": columns, "query_type": "query"})
         self.assertIsNone(error)
-        requests_get_mock.assert_called_once_with(
-            "url/api/v1/query_range",
-            params={
-                "query": ["http_requests_total"],
-                "start": [start_timestamp_expected],
-                "end": [end_timestamp_expected],
-                "step": ["60s"],
-            },
-            **prometheus_kwargs,
-        )
-        cleanup_cert_files_mock.assert_called_once_with(prometheus_kwargs)
+        assert_requested(datetime(2018, 1, 26, 11), now_datetime, "1s")
 
-        cleanup_cert_files_mock.reset_mock()
-        requests_get_mock.reset_mock()
+        # 2. case: range query over one day with start and end is a single request
+        data, error = run_query(
+            "http_requests_total&start=2018-01-26T00:00:00.000Z&end=2018-01-27T00:00:00.000Z&step=60s"
+        )
 
-        # 4. case: successful run range query with start and without end
-        prometheus = Prometheus({"url": "url"})
-        prometheus_kwargs = {"verify": True, "cert": ()}
+        self.assertEqual(data, {"rows": rows, "columns": columns, "query_type": "query_range"})
+        self.assertIsNone(error)
+        assert_requested(datetime(2018, 1, 26), datetime(2018, 1, 27), "60s")
 
-        rows = [
-            {
-                "name": "example_metric_name",
-                "foo_bar": "foo",
-                "timestamp": timestamp_expected_7400,
-                "value": "7400_foo",
-            },
-            {
-                "name": "example_metric_name",
-                "foo_bar": "foo",
-                "timestamp": timestamp_expected_8000,
-                "value": "8000_foo",
-            },
-            {
-                "name": "example_metric_name",
-                "foo_bar": "bar",
-                "timestamp": timestamp_expected_7400,
-                "value": "7400_bar",
-            },
-            {
-                "name": "example_metric_name",
-                "foo_bar": "bar",
-                "timestamp": timestamp_expected_8000,
-                "value": "8000_bar",
-            },
-        ]
-        columns = [
-            {"friendly_name": "timestamp", "type": "datetime", "name": "timestamp"},
-            {"friendly_name": "value", "type": "string", "name": "value"},
-            {"friendly_name": "name", "type": "string", "name": "name"},
-            {"friendly_name": "foo_bar", "type": "string", "name": "foo_bar"},
-        ]
+        # 3. case: range query with start and without end runs until now
+        data, error = run_query("http_requests_total&start=2018-01-26T00:00:00.000Z&step=60s")
 
-        data_expected = {"rows": rows, "columns": columns}
+        self.assertEqual(data, {"rows": rows, "columns": columns, "query_type": "query_range"})
+        self.assertIsNone(error)
+        assert_requested(datetime(2018, 1, 26), now_datetime, "60s")
 
-        now_datetime = datetime(2023, 12, 12, 11, 00, 00)
-        end_timestamp_expected = int(time.mktime(now_datetime.timetuple()))
+        # 4. case: empty result
+        session_get_mock.return_value = mock.Mock(json=mock.Mock(return_value={"data": {"result": []}}))
 
-        requests_get_mock.return_value = mock.Mock(
-            json=mock.Mock(return_value={"data": {"result": self.range_query_result}})
-        )
+        data, error = run_query("http_requests_total")
 
-        with mock.patch("redash.query_runner.prometheus.Prometheus._get_datetime_now") as get_datetime_now_mock:
-            get_datetime_now_mock.return_value = now_datetime
-            data, error = prometheus.run_query("http_requests_total&start=2018-01-26T00:00:00.000Z&step=60s", "user")
+        self.assertIsNone(data)
+        self.assertEqual(error, "查询结果为空.")
+        assert_requested(datetime(2018, 1, 26, 11), now_datetime, "1s")
 
-        self.assertEqual(data, data_expected)
-        self.assertIsNone(error)
-        requests_get_mock.assert_called_once_with(
-            "url/api/v1/query_range",
-            params={
-                "query": ["http_requests_total"],
-                "start": [start_timestamp_expected],
-                "end": [end_timestamp_expected],
-                "step": ["60s"],
-            },
-            **prometheus_kwargs,
-        )
-        cleanup_cert_files_mock.assert_called_once_with(prometheus_kwargs)
+        # 5. case: request errors are returned
+        session_get_mock.side_effect = requests.ConnectionError("connection refused")
 
-        cleanup_cert_files_mock.reset_mock()
-        requests_get_mock.reset_mock()
-        data = None
-        error = None
+        data, error = run_query("http_requests_total")
 
-        # 5. case: run query with exception
-        prometheus = Prometheus({"url": "url"})
-        prometheus_kwargs = {"verify": True, "cert": ()}
+        self.assertIsNone(data)
+        self.assertEqual(error, "connection refused")
+        assert_requested(datetime(2018, 1, 26, 11), now_datetime, "1s")
 
-        requests_get_mock.side_effect = Exception("test exception")
+        # 6. case: other exceptions are raised
+        session_get_mock.side_effect = Exception("test exception")
 
         with self.assertRaises(Exception) as exception_obj:
-            data, error = prometheus.run_query("http_requests_total", "user")
+            run_query("http_requests_total")
 
-        self.assertIsNone(data)
-        self.assertIsNone(error)
         self.assertEqual(str(exception_obj.exception), "test exception")
-        requests_get_mock.assert_called_once_with(
-            "url/api/v1/query", params={"query": ["http_requests_total"]}, **prometheus_kwargs
-        )
-        cleanup_cert_files_mock.assert_called_once_with(prometheus_kwargs)
+        assert_requested(datetime(2018, 1, 26, 11), now_datetime, "1s")
+
+
+class FakePrometheus(ThreadingHTTPServer):
+    """Prometheus HTTP API serving two series whose values are a function of the timestamp."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakePrometheusHandler)
+        self.requests = []
+        self.delay = 0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        self.url = "http://127.0.0.1:{}".format(self.server_address[1])
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+class FakePrometheusHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        start, end, step = float(params["start"]), float(params["end"]), parse_step(params["step"])
+        with self.server.lock:
+            self.server.requests.append((start, end, step))
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+        time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.active -= 1
+
+        timestamps = []
+        timestamp = start
+        while timestamp <= end:
+            timestamps.append(timestamp)
+            timestamp += step
+        result = [
+            {"metric": {"__name__": "up", "instance": instance}, "values": [[t, str(t * i)] for t in timestamps]}
+            for i, instance in enumerate(["a", "b"], start=1)
+        ]
+        body = json_dumps({"status": "success", "data": {"resultType": "matrix", "result": result}}).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakePrometheusTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = FakePrometheus()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.prometheus = Prometheus({"url": self.server.url})
+
+    def run_query(self, start, end, step="60s"):
+        query = "query=up&start={}&end={}&step={}".format(start, end, step)
+        data, error = self.prometheus.run_query(query, None)
+        self.assertIsNone(error)
+        return data
+
+
+class TestRangeQueryCache(FakePrometheusTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(settings, "PROMETHEUS_RANGE_CACHE_ENABLED", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def uncached(self, start, end, step="60s"):
+        with mock.patch.object(settings, "PROMETHEUS_RANGE_CACHE_ENABLED", False):
+            return self.run_query(start, end, step)
+
+    def test_fetches_only_new_points(self):
+        self.run_query("2024-01-01T00:00:00Z", "2024-01-01T06:00:00Z")
+        self.server.requests.clear()
+
+        data = self.run_query("2024-01-01T00:05:00Z", "2024-01-01T06:05:00Z")
+
+        self.assertEqual(len(self.server.requests), 1)
+        start, end, _ = self.server.requests[0]
+        self.assertEqual(end - start, 240)
+        self.assertEqual(data, self.uncached("2024-01-01T00:05:00Z", "2024-01-01T06:05:00Z"))
+
+    def test_fetches_missing_head(self):
+        self.run_query("2024-01-01T01:00:00Z", "2024-01-01T06:00:00Z")
+        self.server.requests.clear()
+
+        data = self.run_query("2024-01-01T00:00:00Z", "2024-01-01T06:00:00Z")
+
+        self.assertEqual(len(self.server.requests), 1)
+        start, end, _ = self.server.requests[0]
+        self.assertEqual(end - start, 3600 - 60)
+        self.assertEqual(data, self.uncached("2024-01-01T00:00:00Z", "2024-01-01T06:00:00Z"))
+
+    def test_serves_repeated_queries_from_cache(self):
+        first = self.run_query("2024-01-01T00:00:00Z", "2024-01-01T06:00:00Z")
+        self.server.requests.clear()
+
+        self.assertEqual(self.run_query("2024-01-01T00:00:00Z", "2024-01-01T06:00:00Z"), first)
+        self.assertEqual(self.server.requests, [])
+
+    def test_aligns_points_to_step(self):
+        data = self.run_query("2024-01-01T00:00:30Z", "2024-01-01T01:00:00Z")
+
+        start, _, _ = self.server.requests[0]
+        self.assertEqual(start % 60, 0)
+        self.assertEqual(data["rows"][0]["timestamp"], datetime.fromtimestamp(start))
+
+    def test_caches_each_step(self):
+        self.run_query("2024-01-01T00:00:00Z", "2024-01-01T06:00:00Z", step="60s")
+        self.run_query("2024-01-01T00:00:00Z", "2024-01-01T06:00:00Z", step="30s")
+
+        self.assertEqual([step for _, _, step in self.server.requests], [60, 30])
+        self.assertEqual(self.server.requests[0][:2], self.server.requests[1][:2])
+
+    def test_fetches_recent_points_again(self):
+        self.uncached("2024-01-01T00:00:00Z", "2024-01-01T06:00:00Z")
+        end = self.server.requests[0][1]
+        self.server.requests.clear()
+
+        with mock.patch("redash.query_runner.prometheus.time.time", return_value=end + 30):
+            self.run_query("2024-01-01T00:00:00Z", "2024-01-01T06:00:00Z")
+            self.run_query("2024-01-01T00:00:00Z", "2024-01-01T06:00:00Z")
+
+        # The points of the last PROMETHEUS_RANGE_CACHE_SETTLE_TIME seconds may still change.
+        self.assertEqual(self.server.requests[1][:2], (end, end))
+
+    def test_shards_missing_ranges(self):
+        self.run_query("2024-01-01T00:00:00Z", "2024-01-02T00:00:00Z")
+        self.server.requests.clear()
+
+        with mock.patch.object(settings, "PROMETHEUS_RANGE_SHARD_SIZE", 3600):
+            data = self.run_query("2024-01-01T00:00:00Z", "2024-01-02T03:00:00Z")
+
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(data, self.uncached("2024-01-01T00:00:00Z", "2024-01-02T03:00:00Z"))
+
+    def test_parse_step(self):
+        self.assertEqual(parse_step("60"), 60)
+        self.assertEqual(parse_step("1m30s"), 90)
+        self.assertIsNone(parse_step("1x"))
+
+
+class TestRangeQuerySharding(FakePrometheusTestCase):
+    def test_splits_long_ranges(self):
+        with mock.patch.object(settings, "PROMETHEUS_RANGE_SHARD_SIZE", 0):
+            expected = self.run_query("2024-01-01T00:00:30Z", "2024-01-04T00:00:00Z", step="90s")
+        self.server.requests.clear()
+
+        with mock.patch.object(settings, "PROMETHEUS_RANGE_SHARD_SIZE", 86400):
+            data = self.run_query("2024-01-01T00:00:30Z", "2024-01-04T00:00:00Z", step="90s")
+
+        self.assertEqual(data, expected)
+        shards = sorted(self.server.requests)
+        self.assertEqual(len(shards), 3)
+        for (_, end, step), (next_start, _, _) in zip(shards, shards[1:]):
+            self.assertEqual(next_start, end + step)
+        self.assertTrue(all((end - start) / step < 86400 / 90 for start, end, step in shards))
+
+    def test_fetches_shards_concurrently(self):
+        self.server.delay = 0.1
+
+        with mock.patch.object(settings, "PROMETHEUS_RANGE_SHARD_SIZE", 86400), mock.patch.object(
+            settings, "PROMETHEUS_RANGE_SHARD_CONCURRENCY", 3
+        ):
+            self.run_query("2024-01-01T00:00:00Z", "2024-01-06T23:59:00Z")
+
+        self.assertEqual(len(self.server.requests), 6)
+        self.assertEqual(self.server.max_active, 3)
+
+    def test_fetches_short_ranges_at_once(self):
+        self.run_query("2024-01-01T00:00:00Z", "2024-01-01T06:00:00Z")
+
+        self.assertEqual(len(self.server.requests), 1)
+
+
+class TestSplitRange(TestCase):
+    def test_aligns_shards_to_step(self):
+        self.assertEqual(split_range(0, 310, 60, 120), [(0, 60), (120, 180), (240, 310)])
+
+    def test_fits_at_least_one_step_per_shard(self):
+        self.assertEqual(split_range(0, 180, 60, 30), [(0, 0), (60, 60), (120, 180)])
+
+    def test_folds_single_point_tail_into_last_shard(self):
+        self.assertEqual(split_range(0, 250, 60, 120), [(0, 60), (120, 250)])
+        self.assertEqual(split_range(0, 86400, 60, 86400), [(0, 86400)])
+
+    def test_keeps_short_ranges_whole(self):
+        self.assertEqual(split_range(30, 3600, 60, 86400), [(30, 3600)])
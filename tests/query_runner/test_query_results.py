@@ -1,23 +1,39 @@
 import datetime
 import decimal
+import os
 import sqlite3
+import tempfile
+import threading
+import time
 from unittest import TestCase
 
 import mock
 import pytest
 
+from redash import settings
+from redash.query_runner import JobTimeoutException
+from redash.query_runner.pg import PostgreSQL
 from redash.query_runner.query_results import (
+    ArrowCachedTable,
     CreateTableError,
     PermissionError,
+    Results,
+    SQLiteCachedTable,
+    TableCache,
     _load_query,
+    create_duckdb_table,
     create_table,
+    duckdb_enabled,
     extract_cached_query_ids,
     extract_query_ids,
     extract_query_params,
+    fetch_query_results,
     fix_column_name,
     get_query_results,
     prepare_parameterized_query,
+    prune_table_cache_dir,
     replace_query_parameters,
+    table_cache,
 )
 from tests import BaseTestCase
 
@@ -143,6 +159,41 @@ class TestCreateTable(TestCase):
         self.assertEqual(len(list(connection.execute("SELECT * FROM query_123"))), 2)
 
 
+@pytest.mark.skipif(not duckdb_enabled, reason="duckdb and pyarrow are not installed")
+class TestCreateDuckDBTable(TestCase):
+    def setUp(self):
+        import duckdb
+
+        self.connection = duckdb.connect(":memory:")
+
+    def test_loads_results_with_column_types(self):
+        rows = [{"ga:id": 1, "value": 1.5, "flag": True, "name": "a"}, {"ga:id": 2, "name": "b"}]
+        results = {
+            "columns": [{"name": "ga:id"}, {"name": "value"}, {"name": "flag"}, {"name": "name"}],
+            "rows": rows,
+        }
+        create_duckdb_table(self.connection, "query_123", results)
+
+        cursor = self.connection.execute("SELECT * FROM query_123 ORDER BY ga_id")
+        self.assertEqual(["BIGINT", "DOUBLE", "BOOLEAN", "VARCHAR"], [str(c[1]) for c in cursor.description])
+        self.assertEqual([(1, 1.5, True, "a"), (2, None, None, "b")], cursor.fetchall())
+
+    def test_loads_mixed_types_as_text(self):
+        rows = [{"test1": 1}, {"test1": "a"}, {"test1": [1, 2]}, {"test1": decimal.Decimal(2)}]
+        results = {"columns": [{"name": "test1"}], "rows": rows}
+        create_duckdb_table(self.connection, "query_123", results)
+
+        self.assertEqual(
+            [("1",), ("a",), ("[1, 2]",), ("2.0",)],
+            self.connection.execute("SELECT * FROM query_123").fetchall(),
+        )
+
+    def test_shows_meaningful_error_on_failure_to_create_table(self):
+        results = {"columns": [], "rows": []}
+        with pytest.raises(CreateTableError):
+            create_duckdb_table(self.connection, "query_123", results)
+
+
 class TestGetQuery(BaseTestCase):
     # test query from different account
     def test_raises_exception_for_query_from_different_account(self):
@@ -248,3 +299,255 @@ class TestGetQueryResult(BaseTestCase):
             query_result_data = {"columns": [], "rows": []}
             qr.return_value = (query_result_data, None)
             self.assertEqual(query_result_data, get_query_results(self.factory.user, query.id, False))
+
+
+class TestRunQuery(BaseTestCase):
+    def setUp(self):
+        super(TestRunQuery, self).setUp()
+        table_cache.clear()
+        self.addCleanup(table_cache.clear)
+        rows = [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}]
+        query_result = self.factory.create_query_result(
+            data={"columns": [{"name": "id"}, {"name": "name"}], "rows": rows}
+        )
+        self.query = self.factory.create_query(latest_query_data=query_result)
+        self.query_text = "SELECT a.id, b.name FROM cached_query_{id} a JOIN cached_query_{id} b ON a.id = b.id ORDER BY a.id".format(
+            id=self.query.id
+        )
+
+    def test_runs_query_with_sqlite(self):
+        data, error = Results({}).run_query(self.query_text, self.factory.user)
+
+        self.assertIsNone(error)
+        self.assertEqual(["integer", "string"], [c["type"] for c in data["columns"]])
+        self.assertEqual([{"id": 1, "name": "a"}, {"id": 2, "name": "b"}], data["rows"])
+
+    @pytest.mark.skipif(not duckdb_enabled, reason="duckdb and pyarrow are not installed")
+    def test_runs_query_with_duckdb(self):
+        data, error = Results({"engine": "duckdb"}).run_query(self.query_text, self.factory.user)
+
+        self.assertIsNone(error)
+        self.assertEqual(["integer", "string"], [c["type"] for c in data["columns"]])
+        self.assertEqual([{"id": 1, "name": "a"}, {"id": 2, "name": "b"}], data["rows"])
+
+    @pytest.mark.skipif(not duckdb_enabled, reason="duckdb and pyarrow are not installed")
+    def test_returns_duckdb_errors(self):
+        data, error = Results({"engine": "duckdb"}).run_query("SELECT * FROM missing_table", self.factory.user)
+
+        self.assertIsNone(data)
+        self.assertIn("missing_table", error)
+
+    def test_reuses_loaded_table_while_result_is_unchanged(self):
+        with mock.patch.object(SQLiteCachedTable, "load", side_effect=SQLiteCachedTable.load) as load:
+            Results({}).run_query(self.query_text, self.factory.user)
+            data, error = Results({}).run_query(self.query_text, self.factory.user)
+            self.assertEqual(1, load.call_count)
+
+            self.query.latest_query_data = self.factory.create_query_result(
+                data={"columns": [{"name": "id"}, {"name": "name"}], "rows": [{"id": 3, "name": "c"}]}
+            )
+            data, error = Results({}).run_query(self.query_text, self.factory.user)
+            self.assertEqual(2, load.call_count)
+
+        self.assertEqual([{"id": 3, "name": "c"}], data["rows"])
+
+    def test_copies_cached_tables_beyond_the_attach_limit(self):
+        query_ids = [self.query.id]
+        for _ in range(11):
+            query_result = self.factory.create_query_result(data=self.query.latest_query_data.data)
+            query_ids.append(self.factory.create_query(latest_query_data=query_result).id)
+        query_text = "SELECT COUNT(*) AS c FROM cached_query_{} {}".format(
+            query_ids[0], " ".join("JOIN cached_query_{} USING (id)".format(query_id) for query_id in query_ids[1:])
+        )
+
+        data, error = Results({}).run_query(query_text, self.factory.user)
+
+        self.assertIsNone(error)
+        self.assertEqual([{"c": 2}], data["rows"])
+
+    def test_attaches_shared_results_once(self):
+        other_query = self.factory.create_query(latest_query_data=self.query.latest_query_data)
+        query_text = "SELECT a.id FROM cached_query_{} a JOIN cached_query_{} b ON a.id = b.id".format(
+            self.query.id, other_query.id
+        )
+
+        data, error = Results({}).run_query(query_text, self.factory.user)
+
+        self.assertIsNone(error)
+        self.assertEqual(2, len(data["rows"]))
+
+    def test_shares_loaded_tables_through_the_cache_dir(self):
+        directory = tempfile.mkdtemp()
+        with mock.patch.object(settings, "QUERY_RESULTS_TABLE_CACHE_DIR", directory):
+            Results({}).run_query(self.query_text, self.factory.user)
+            # Another worker process doesn't share the in-memory cache.
+            table_cache.clear()
+
+            with mock.patch.object(SQLiteCachedTable, "write") as write:
+                data, error = Results({}).run_query(self.query_text, self.factory.user)
+
+        write.assert_not_called()
+        self.assertEqual(["{}.sqlite".format(self.query.latest_query_data_id)], os.listdir(directory))
+        self.assertEqual([{"id": 1, "name": "a"}, {"id": 2, "name": "b"}], data["rows"])
+
+    @pytest.mark.skipif(not duckdb_enabled, reason="duckdb and pyarrow are not installed")
+    def test_reuses_loaded_table_with_duckdb(self):
+        directory = tempfile.mkdtemp()
+        with mock.patch.object(settings, "QUERY_RESULTS_TABLE_CACHE_DIR", directory):
+            with mock.patch.object(ArrowCachedTable, "write", side_effect=ArrowCachedTable.write) as write:
+                Results({"engine": "duckdb"}).run_query(self.query_text, self.factory.user)
+                table_cache.clear()
+                Results({"engine": "duckdb"}).run_query(self.query_text, self.factory.user)
+                data, error = Results({"engine": "duckdb"}).run_query(self.query_text, self.factory.user)
+
+        self.assertEqual(1, write.call_count)
+        self.assertEqual([{"id": 1, "name": "a"}, {"id": 2, "name": "b"}], data["rows"])
+
+
+class FakeTable:
+    def __init__(self, size):
+        self.size = size
+        self.close = mock.Mock()
+
+
+class TestTableCache(TestCase):
+    def setUp(self):
+        self.cache = TableCache()
+        patcher = mock.patch.object(settings, "QUERY_RESULTS_TABLE_CACHE_MAX_SIZE", 100)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_evicts_least_recently_used_tables(self):
+        tables = [FakeTable(40), FakeTable(40), FakeTable(40)]
+        self.cache.add(1, tables[0])
+        self.cache.add(2, tables[1])
+        self.cache.get(1)
+        self.cache.add(3, tables[2])
+
+        self.assertIsNone(self.cache.get(2))
+        tables[1].close.assert_called_once_with()
+        self.assertIs(tables[0], self.cache.get(1))
+        self.assertIs(tables[2], self.cache.get(3))
+
+    def test_doesnt_keep_tables_larger_than_max_size(self):
+        self.assertFalse(self.cache.add(1, FakeTable(101)))
+        self.assertIsNone(self.cache.get(1))
+
+
+class TestPruneTableCacheDir(TestCase):
+    def test_removes_least_recently_used_files(self):
+        directory = tempfile.mkdtemp()
+        for i, name in enumerate(["1.sqlite", "2.sqlite", "3.sqlite"]):
+            path = os.path.join(directory, name)
+            with open(path, "wb") as f:
+                f.write(b"x" * 10)
+            os.utime(path, (i, i))
+
+        prune_table_cache_dir(directory, 20)
+
+        self.assertEqual(["2.sqlite", "3.sqlite"], sorted(os.listdir(directory)))
+
+
+class TestFetchQueryResults(BaseTestCase):
+    def setUp(self):
+        super(TestFetchQueryResults, self).setUp()
+        self.queries = [self.factory.create_query(query_text="SELECT {}".format(i)) for i in range(3)]
+        self.sources = [("query_{}".format(q.id), q.id, None) for q in self.queries]
+        self.loaded = []
+
+    def load_table(self, table_name, results):
+        self.loaded.append(table_name)
+
+    def test_runs_queries_concurrently(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        def run_query(query_text, user):
+            barrier.wait()
+            return {"columns": [], "rows": []}, None
+
+        with mock.patch.object(PostgreSQL, "run_query", side_effect=run_query):
+            fetch_query_results(self.factory.user, self.sources, self.load_table)
+
+        self.assertCountEqual([source[0] for source in self.sources], self.loaded)
+
+    def test_loads_results_as_they_complete(self):
+        first_loaded = threading.Event()
+
+        def run_query(query_text, user):
+            if query_text == "SELECT 0":
+                first_loaded.wait(5)
+            return {"columns": [], "rows": []}, None
+
+        def load_table(table_name, results):
+            self.loaded.append(table_name)
+            first_loaded.set()
+
+        with mock.patch.object(PostgreSQL, "run_query", side_effect=run_query):
+            fetch_query_results(self.factory.user, self.sources[:2], load_table)
+
+        self.assertEqual([self.sources[1][0], self.sources[0][0]], self.loaded)
+
+    def test_cancels_running_queries_on_timeout(self):
+        cancelled = threading.Event()
+
+        def run_query(query_text, user):
+            try:
+                while True:
+                    time.sleep(0.01)
+            except JobTimeoutException:
+                cancelled.set()
+                raise
+
+        with mock.patch.object(settings, "QUERY_RESULTS_SOURCE_TIMEOUT", 1):
+            with mock.patch.object(PostgreSQL, "run_query", side_effect=run_query):
+                with self.assertRaisesRegex(Exception, "Timed out loading results"):
+                    fetch_query_results(self.factory.user, self.sources[:1], self.load_table)
+
+        self.assertTrue(cancelled.wait(5))
+
+    def test_cancels_running_queries_when_one_fails(self):
+        started = threading.Event()
+        cancelled = threading.Event()
+
+        def run_query(query_text, user):
+            if query_text == "SELECT 0":
+                started.wait(5)
+                return None, "Oh no"
+            started.set()
+            try:
+                while True:
+                    time.sleep(0.01)
+            except JobTimeoutException:
+                cancelled.set()
+                raise
+
+        with mock.patch.object(PostgreSQL, "run_query", side_effect=run_query):
+            with self.assertRaisesRegex(
+                Exception, "Failed loading results for query id {}".format(self.queries[0].id)
+            ):
+                fetch_query_results(self.factory.user, self.sources[:2], self.load_table)
+
+        self.assertTrue(cancelled.wait(5))
+        self.assertEqual([], self.loaded)
+
+    def test_cancels_running_queries_through_their_runner(self):
+        cancelled = threading.Event()
+
+        def run_query(query_text, user):
+            cancelled.wait(5)
+            return None, "canceling statement due to user request"
+
+        def cancel():
+            cancelled.set()
+            return True
+
+        with mock.patch.object(settings, "QUERY_RESULTS_SOURCE_TIMEOUT", 1), mock.patch.object(
+            PostgreSQL, "run_query", side_effect=run_query
+        ), mock.patch.object(PostgreSQL, "cancel", side_effect=cancel), mock.patch(
+            "redash.query_runner.query_results.interrupt_thread"
+        ) as interrupt_thread:
+            with self.assertRaisesRegex(Exception, "Timed out loading results"):
+                fetch_query_results(self.factory.user, self.sources[:1], self.load_table)
+
+        self.assertTrue(cancelled.is_set())
+        interrupt_thread.assert_not_called()
@@ -0,0 +1,154 @@
+import threading
+import time
+from unittest import TestCase, mock
+
+from redash import settings
+from redash.query_runner import BaseQueryRunner, with_ssh_tunnel
+from redash.query_runner.ssh_tunnel_pool import SSHTunnelPool
+
+BASTION = ("bastion", 22)
+AUTH = {"ssh_username": "redash"}
+
+
+class FakeServer:
+    ports = iter(range(10000, 20000))
+
+    def __init__(self, bastion_address, remote_bind_address, **kwargs):
+        self.remote_bind_address = remote_bind_address
+        self.kwargs = kwargs
+        self.local_bind_address = ("127.0.0.1", next(self.ports))
+        self.is_active = False
+        self.stopped = False
+
+    def start(self):
+        time.sleep(0.01)
+        self.is_active = True
+
+    def stop(self):
+        self.is_active = False
+        self.stopped = True
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class TestSSHTunnelPool(TestCase):
+    def setUp(self):
+        self.pool = SSHTunnelPool()
+        self.servers = []
+
+        def open_tunnel(*args, **kwargs):
+            server = FakeServer(*args, **kwargs)
+            self.servers.append(server)
+            return server
+
+        for patcher in (
+            mock.patch("redash.query_runner.ssh_tunnel_pool.open_tunnel", side_effect=open_tunnel),
+            mock.patch.object(settings, "SSH_TUNNEL_POOL_ENABLED", True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def use(self, remote_address=("db", 5432)):
+        with self.pool.tunnel(BASTION, remote_address, AUTH) as local_address:
+            return local_address
+
+    def test_shares_tunnels(self):
+        self.assertEqual(self.use(), self.use())
+        self.assertEqual(len(self.servers), 1)
+        self.assertFalse(self.servers[0].stopped)
+        self.assertEqual(self.servers[0].kwargs["set_keepalive"], settings.SSH_TUNNEL_KEEPALIVE)
+
+    def test_keeps_tunnels_per_remote_address(self):
+        self.assertNotEqual(self.use(("db", 5432)), self.use(("other-db", 5432)))
+        self.assertEqual(len(self.servers), 2)
+
+    def test_reopens_dead_tunnels(self):
+        first = self.use()
+        self.servers[0].is_active = False
+
+        self.assertNotEqual(self.use(), first)
+        self.assertTrue(self.servers[0].stopped)
+
+    def test_closes_idle_tunnels(self):
+        with mock.patch("time.monotonic", return_value=1000):
+            self.use(("db", 5432))
+        with mock.patch("time.monotonic", return_value=1000 + settings.SSH_TUNNEL_MAX_IDLE_TIME + 1):
+            self.use(("other-db", 5432))
+
+        self.assertTrue(self.servers[0].stopped)
+        self.assertFalse(self.servers[1].stopped)
+
+    def test_sweep_closes_idle_tunnels(self):
+        with mock.patch("time.monotonic", return_value=1000):
+            self.use()
+        with mock.patch("time.monotonic", return_value=1000 + settings.SSH_TUNNEL_MAX_IDLE_TIME + 1):
+            self.pool.sweep()
+
+        self.assertTrue(self.servers[0].stopped)
+
+    def test_does_not_close_tunnels_in_use(self):
+        with mock.patch("time.monotonic", return_value=1000):
+            with self.pool.tunnel(BASTION, ("db", 5432), AUTH):
+                with mock.patch("time.monotonic", return_value=1000 + settings.SSH_TUNNEL_MAX_IDLE_TIME + 1):
+                    self.use(("other-db", 5432))
+                self.assertFalse(self.servers[0].stopped)
+
+    def test_opens_one_tunnel_for_concurrent_queries(self):
+        addresses = []
+        threads = [threading.Thread(target=lambda: addresses.append(self.use())) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.servers), 1)
+        self.assertEqual(set(addresses), {self.servers[0].local_bind_address})
+
+    def test_retries_tunnels_that_failed_to_open(self):
+        with mock.patch.object(FakeServer, "start", side_effect=Exception("Could not establish session")):
+            with self.assertRaises(Exception):
+                self.use()
+
+        self.use()
+        self.assertEqual(len(self.servers), 2)
+        self.assertTrue(self.servers[1].is_active)
+
+    @mock.patch("statsd.StatsClient.incr")
+    def test_records_reuse(self, incr):
+        self.use()
+        self.use()
+
+        self.assertEqual(
+            incr.call_args_list, [mock.call("query_runner.ssh_tunnel.miss"), mock.call("query_runner.ssh_tunnel.hit")]
+        )
+
+    def test_opens_a_tunnel_per_query_when_disabled(self):
+        with mock.patch.object(settings, "SSH_TUNNEL_POOL_ENABLED", False):
+            self.assertNotEqual(self.use(), self.use())
+        self.assertTrue(all(server.stopped for server in self.servers))
+
+
+class TunneledQueryRunner(BaseQueryRunner):
+    def run_query(self, query, user):
+        return (self.host, self.port), None
+
+
+class TestWithSSHTunnel(TestCase):
+    @mock.patch.object(settings, "SSH_TUNNEL_POOL_ENABLED", True)
+    def test_runs_queries_through_shared_tunnels(self):
+        with mock.patch("redash.query_runner.ssh_tunnel_pool.open_tunnel", side_effect=FakeServer) as open_tunnel:
+            runner = with_ssh_tunnel(
+                TunneledQueryRunner({"host": "db", "port": 5432}), {"ssh_host": "bastion", "ssh_username": "redash"}
+            )
+            first, _ = runner.run_query("SELECT 1", None)
+            second, _ = runner.run_query("SELECT 1", None)
+
+        self.assertEqual(first, second)
+        self.assertEqual(first[0], "127.0.0.1")
+        self.assertEqual((runner.host, runner.port), ("db", 5432))
+        self.assertEqual(open_tunnel.call_count, 1)
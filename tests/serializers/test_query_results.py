@@ -1,9 +1,14 @@
 import csv
 import io
+import tracemalloc
+
+from openpyxl import load_workbook
 
 from redash.serializers import (
     serialize_query_result,
     serialize_query_result_to_dsv,
+    serialize_query_result_to_dsv_stream,
+    serialize_query_result_to_xlsx_file,
 )
 from tests import BaseTestCase
 
@@ -79,3 +84,52 @@ class DsvSerializationTest(BaseTestCase):
         self.assertEqual(rows[1]["bool"], "false")
         self.assertEqual(rows[2]["date"], "")
         self.assertEqual(rows[3]["datetime"], "459")
+
+    def test_does_not_modify_query_result_data(self):
+        query_result = self.factory.create_query_result(data=data)
+        with self.app.test_request_context("/"):
+            serialize_query_result_to_dsv(query_result, ",")
+
+        self.assertEqual(query_result.data["rows"][0]["bool"], True)
+
+    def test_streams_in_chunks(self):
+        query_result = self.factory.create_query_result(data=data)
+        with self.app.test_request_context("/"):
+            chunks = list(serialize_query_result_to_dsv_stream(query_result, ",", chunk_rows=2))
+
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual("".join(chunks), self.delimited_content(","))
+
+    def test_streaming_memory_stays_below_ceiling(self):
+        rows = [{"id": i, "name": "name-{}".format(i) * 5, "bool": i % 2 == 0} for i in range(60000)]
+        columns = [
+            {"name": "id", "type": "integer"},
+            {"name": "name", "type": "string"},
+            {"name": "bool", "type": "boolean"},
+        ]
+        query_result = self.factory.create_query_result(data={"columns": columns, "rows": rows})
+        query_result.data  # decoding the stored result is not part of the export
+
+        with self.app.test_request_context("/"):
+            stream = serialize_query_result_to_dsv_stream(query_result, ",", chunk_rows=500)
+            tracemalloc.start()
+            try:
+                size = sum(len(chunk) for chunk in stream)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+        self.assertGreater(size, 3 * 1024 * 1024)
+        self.assertLess(peak, 1024 * 1024)
+
+
+class XlsxSerializationTest(BaseTestCase):
+    def test_serializes_rows(self):
+        query_result = self.factory.create_query_result(data=data)
+
+        with serialize_query_result_to_xlsx_file(query_result) as output:
+            sheet = load_workbook(output)["result"]
+
+        self.assertEqual([c.value for c in sheet[1]], ["bool", "datetime", "date"])
+        self.assertEqual([c.value for c in sheet[2]], [True, "2019-05-26T12:39:23.026Z", "2019-05-26"])
+        self.assertEqual(sheet.max_row, len(data["rows"]) + 1)
@@ -1,8 +1,15 @@
-from mock import ANY, MagicMock
+import threading
+
+from mock import ANY, MagicMock, patch
 
 import redash.tasks.alerts
-from redash.models import Alert
-from redash.tasks.alerts import check_alerts_for_query, notify_subscriptions
+from redash import settings
+from redash.models import Alert, db
+from redash.tasks.alerts import (
+    check_alerts_for_query,
+    notify_subscriptions,
+    retry_notification,
+)
 from tests import BaseTestCase
 
 
@@ -49,3 +56,73 @@ class TestNotifySubscriptions(BaseTestCase):
             ANY,
             ANY,
         )
+
+    def test_notifies_subscribers_concurrently(self):
+        alert = self.factory.create_alert()
+        subscriptions = [self.factory.create_alert_subscription(alert=alert) for _ in range(2)]
+        barrier = threading.Barrier(2, timeout=5)
+        for subscription in subscriptions:
+            subscription.notify = MagicMock(side_effect=lambda *args: barrier.wait())
+
+        with patch("redash.tasks.schedule.rq_scheduler.enqueue_in") as enqueue_in:
+            notify_subscriptions(alert, Alert.TRIGGERED_STATE, metadata={})
+
+        for subscription in subscriptions:
+            subscription.notify.assert_called_once()
+        enqueue_in.assert_not_called()
+
+    def test_retries_failed_deliveries_later(self):
+        alert = self.factory.create_alert()
+        failing = self.factory.create_alert_subscription(alert=alert)
+        working = self.factory.create_alert_subscription(alert=alert)
+        failing.notify = MagicMock(side_effect=IOError("connection refused"))
+        working.notify = MagicMock()
+
+        with patch("redash.tasks.schedule.rq_scheduler.enqueue_in") as enqueue_in:
+            notify_subscriptions(alert, Alert.TRIGGERED_STATE, metadata={})
+
+        working.notify.assert_called_once()
+        enqueue_in.assert_called_once_with(
+            ANY,
+            retry_notification,
+            alert.id,
+            failing.id,
+            Alert.TRIGGERED_STATE,
+            {},
+            1,
+            queue_name="default",
+            timeout=300,
+        )
+        self.assertEqual(settings.ALERTS_NOTIFICATION_RETRY_BACKOFF, enqueue_in.call_args[0][0].total_seconds())
+
+
+class TestRetryNotification(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.subscription = self.factory.create_alert_subscription()
+        self.alert = self.subscription.alert
+        self.alert.state = Alert.TRIGGERED_STATE
+        db.session.commit()
+
+    def test_backs_off_until_max_retries(self):
+        with patch("redash.tasks.schedule.rq_scheduler.enqueue_in") as enqueue_in, patch.object(
+            type(self.subscription), "notify", side_effect=IOError("timeout")
+        ):
+            retry_notification(self.alert.id, self.subscription.id, Alert.TRIGGERED_STATE, {}, 1)
+            retry_notification(
+                self.alert.id,
+                self.subscription.id,
+                Alert.TRIGGERED_STATE,
+                {},
+                settings.ALERTS_NOTIFICATION_MAX_RETRIES,
+            )
+
+        enqueue_in.assert_called_once()
+        self.assertEqual(2 * settings.ALERTS_NOTIFICATION_RETRY_BACKOFF, enqueue_in.call_args[0][0].total_seconds())
+        self.assertEqual(2, enqueue_in.call_args[0][6])
+
+    def test_skips_when_alert_state_changed(self):
+        with patch.object(type(self.subscription), "notify") as notify:
+            retry_notification(self.alert.id, self.subscription.id, Alert.OK_STATE, {}, 1)
+
+        notify.assert_not_called()
@@ -0,0 +1,136 @@
+from mock import patch
+from sqlalchemy.exc import OperationalError
+
+from redash import redis_connection, settings
+from redash.models import Event
+from redash.tasks.general import (
+    EVENTS_BUFFER_KEY,
+    EVENTS_DEAD_LETTER_KEY,
+    EVENTS_FLUSH_LOCK_KEY,
+    EVENTS_PROCESSING_KEY,
+    buffer_event,
+    flush_events,
+    forward_events,
+)
+from redash.utils import json_dumps, json_loads
+from tests import BaseTestCase
+
+
+def raw_event(action="view", **kwargs):
+    event = {"action": action, "object_type": "dashboard", "object_id": 1, "org_id": 1, "timestamp": 1411778709}
+    event.update(kwargs)
+    return event
+
+
+class TestBufferEvent(BaseTestCase):
+    def test_appends_event_to_buffer(self):
+        buffer_event(raw_event())
+
+        self.assertEqual(redis_connection.llen(EVENTS_BUFFER_KEY), 1)
+        self.assertEqual(Event.query.count(), 0)
+
+    def test_records_event_with_a_job_when_buffering_disabled(self):
+        with patch.object(settings, "EVENTS_BUFFER_ENABLED", False), patch(
+            "redash.tasks.general.record_event.delay"
+        ) as delay:
+            buffer_event(raw_event())
+
+        delay.assert_called_once_with(raw_event())
+        self.assertEqual(redis_connection.llen(EVENTS_BUFFER_KEY), 0)
+
+
+class TestFlushEvents(BaseTestCase):
+    def test_inserts_buffered_events_in_batches(self):
+        for i in range(5):
+            buffer_event(raw_event(action="action{}".format(i), user_id=self.factory.user.id))
+
+        with patch.object(settings, "EVENTS_FLUSH_BATCH_SIZE", 2), patch(
+            "redash.tasks.general.forward_events"
+        ) as forward:
+            self.assertEqual(flush_events(), 5)
+
+        actions = [e.action for e in Event.query.order_by(Event.id)]
+        self.assertEqual(actions, ["action{}".format(i) for i in range(5)])
+        self.assertEqual([len(call[0][0]) for call in forward.call_args_list], [2, 2, 1])
+        self.assertEqual(redis_connection.llen(EVENTS_BUFFER_KEY), 0)
+
+    def test_skips_malformed_events(self):
+        redis_connection.rpush(EVENTS_BUFFER_KEY, "{not json")
+        buffer_event(raw_event())
+
+        self.assertEqual(flush_events(), 1)
+        self.assertEqual(Event.query.count(), 1)
+        self.assertEqual(redis_connection.lrange(EVENTS_DEAD_LETTER_KEY, 0, -1), ["{not json"])
+
+    def test_keeps_events_when_database_is_unavailable(self):
+        buffer_event(raw_event(action="first"))
+        buffer_event(raw_event(action="second"))
+
+        error = OperationalError("INSERT INTO events", {}, Exception("database is down"))
+        with patch.object(Event, "record_many", side_effect=error):
+            self.assertRaises(OperationalError, flush_events)
+
+        self.assertEqual(redis_connection.llen(EVENTS_PROCESSING_KEY), 2)
+        self.assertEqual(flush_events(), 2)
+        self.assertEqual([e.action for e in Event.query.order_by(Event.id)], ["first", "second"])
+        self.assertEqual(redis_connection.llen(EVENTS_PROCESSING_KEY), 0)
+
+    def test_dead_letters_events_that_cant_be_inserted(self):
+        missing_org = raw_event(action="missing org")
+        del missing_org["org_id"]
+        buffer_event(raw_event(action="first"))
+        buffer_event(missing_org)
+        buffer_event(raw_event(action="missing user", user_id=-1))
+        buffer_event(raw_event(action="last"))
+
+        self.assertEqual(flush_events(), 2)
+
+        self.assertEqual([e.action for e in Event.query.order_by(Event.id)], ["first", "last"])
+        dead = [json_loads(item)["action"] for item in redis_connection.lrange(EVENTS_DEAD_LETTER_KEY, 0, -1)]
+        self.assertEqual(dead, ["missing org", "missing user"])
+        self.assertEqual(redis_connection.llen(EVENTS_PROCESSING_KEY), 0)
+        self.assertEqual(flush_events(), 0)
+
+    def test_writes_batch_left_by_unfinished_flush(self):
+        redis_connection.rpush(EVENTS_PROCESSING_KEY, json_dumps(raw_event(action="unfinished")))
+        buffer_event(raw_event(action="buffered"))
+
+        self.assertEqual(flush_events(), 2)
+        self.assertEqual([e.action for e in Event.query.order_by(Event.id)], ["unfinished", "buffered"])
+
+    def test_skips_when_another_flush_is_running(self):
+        buffer_event(raw_event())
+
+        with redis_connection.lock(EVENTS_FLUSH_LOCK_KEY, timeout=10):
+            self.assertEqual(flush_events(), 0)
+
+        self.assertEqual(redis_connection.llen(EVENTS_BUFFER_KEY), 1)
+
+
+class TestForwardEvents(BaseTestCase):
+    def test_posts_each_event_by_default(self):
+        events = [{"action": "action{}".format(i)} for i in range(2)]
+
+        with patch.object(settings, "EVENT_REPORTING_WEBHOOKS", ["https://example.com/hook"]), patch(
+            "redash.tasks.general.http_session.post"
+        ) as post:
+            post.return_value.status_code = 200
+            forward_events(events)
+
+        self.assertEqual(
+            [call[1]["json"] for call in post.call_args_list],
+            [{"schema": "iglu:io.redash.webhooks/event/jsonschema/1-0-0", "data": event} for event in events],
+        )
+
+    def test_posts_events_in_batches(self):
+        events = [{"action": "action{}".format(i)} for i in range(5)]
+
+        with patch.object(settings, "EVENT_REPORTING_WEBHOOKS", ["https://example.com/hook"]), patch.object(
+            settings, "EVENT_REPORTING_WEBHOOKS_BATCH_SIZE", 3
+        ), patch("redash.tasks.general.http_session.post") as post:
+            post.return_value.status_code = 200
+            forward_events(events)
+
+        batches = [call[1]["json"]["data"] for call in post.call_args_list]
+        self.assertEqual([len(batch) for batch in batches], [3, 2])
+        self.assertEqual(batches[1][0]["data"], {"action": "action3"})
@@ -1,15 +1,19 @@
 from mock import Mock, patch
 from rq import Connection
 from rq.exceptions import NoSuchJobError
+from rq.job import JobStatus
 
-from redash import models, rq_redis_connection
+from redash import models, redis_connection, rq_redis_connection
 from redash.query_runner.pg import PostgreSQL
-from redash.tasks import Job
+from redash.tasks import Job, Queue
 from redash.tasks.queries.execution import (
+    JOB_STATUS_CHANNEL,
     QueryExecutionError,
+    enqueue_queries,
     enqueue_query,
     execute_query,
 )
+from redash.utils import json_loads
 from tests import BaseTestCase
 
 
@@ -22,6 +26,7 @@ def fetch_job(*args, **kwargs):
     result = Mock()
     result.id = job_id
     result.is_cancelled = False
+    result.started_at = None
 
     return result
 
@@ -172,6 +177,90 @@ class TestEnqueueTask(BaseTestCase):
         self.assertEqual(3, enqueue.call_count)
 
 
+class TestEnqueueQueries(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        rq_redis_connection.flushdb()
+
+    def enqueue_request(self, query, query_text=None):
+        return {
+            "query": query_text or query.query_text,
+            "data_source": query.data_source,
+            "user_id": query.user_id,
+            "scheduled_query": query,
+            "metadata": {"Username": "Arik", "query_id": query.id},
+        }
+
+    def test_enqueues_each_query_once(self):
+        query = self.factory.create_query()
+        other_query = self.factory.create_query(query_text="SELECT 2")
+
+        jobs = enqueue_queries(
+            [self.enqueue_request(query), self.enqueue_request(query), self.enqueue_request(other_query)]
+        )
+
+        self.assertEqual(jobs[0].id, jobs[1].id)
+        self.assertNotEqual(jobs[0].id, jobs[2].id)
+        queue = Queue(query.data_source.scheduled_queue_name, connection=rq_redis_connection)
+        self.assertEqual(2, len(queue))
+        self.assertEqual(query.id, jobs[0].meta["query_id"])
+        self.assertEqual(query.id, jobs[0].kwargs["scheduled_query_id"])
+
+    def test_reuses_jobs_of_existing_locks(self):
+        query = self.factory.create_query()
+
+        with Connection(rq_redis_connection):
+            job = enqueue_query(query.query_text, query.data_source, query.user_id, False, query, {})
+        jobs = enqueue_queries([self.enqueue_request(query)])
+
+        self.assertEqual(job.id, jobs[0].id)
+        self.assertEqual(1, len(Queue(query.data_source.scheduled_queue_name, connection=rq_redis_connection)))
+
+    def test_replaces_locks_of_complete_jobs(self):
+        query = self.factory.create_query()
+
+        (job,) = enqueue_queries([self.enqueue_request(query)])
+        job.set_status(JobStatus.FINISHED)
+        (new_job,) = enqueue_queries([self.enqueue_request(query)])
+
+        self.assertNotEqual(job.id, new_job.id)
+        lock_id = "query_hash_job:{}:{}".format(query.data_source.id, query.query_hash)
+        self.assertEqual(new_job.id, redis_connection.get(lock_id))
+
+    def test_enqueues_each_query_once_when_a_lock_changes(self):
+        query = self.factory.create_query()
+        other_queries = [self.factory.create_query(query_text="SELECT %d" % i) for i in (2, 3)]
+        (job,) = enqueue_queries([self.enqueue_request(query)])
+        job.set_status(JobStatus.FINISHED)
+        job.delete()
+        lock_id = "query_hash_job:{}:{}".format(query.data_source.id, query.query_hash)
+
+        pipeline = redis_connection.pipeline
+        conflicts = ["expired-job"]
+
+        def conflicting_pipeline():
+            pipe = pipeline()
+            execute = pipe.execute
+
+            def conflicting_execute(*args, **kwargs):
+                if conflicts:
+                    # Another manager replaces the lock between the WATCH and the transaction.
+                    redis_connection.set(lock_id, conflicts.pop())
+                return execute(*args, **kwargs)
+
+            pipe.execute = conflicting_execute
+            return pipe
+
+        with patch.object(redis_connection, "pipeline", side_effect=conflicting_pipeline):
+            jobs = enqueue_queries([self.enqueue_request(q) for q in [query] + other_queries])
+
+        self.assertFalse(conflicts)
+        self.assertTrue(all(jobs))
+        queue = Queue(query.data_source.scheduled_queue_name, connection=rq_redis_connection)
+        self.assertEqual(sorted(j.id for j in jobs), sorted(queue.job_ids))
+        self.assertEqual(jobs[0].id, redis_connection.get(lock_id))
+
+
 @patch("redash.tasks.queries.execution.get_current_job", side_effect=fetch_job)
 class QueryExecutorTests(BaseTestCase):
     def test_success(self, _):
@@ -186,6 +275,30 @@ class QueryExecutorTests(BaseTestCase):
             result = models.QueryResult.query.get(result_id)
             self.assertEqual(result.data, query_result_data)
 
+    def test_publishes_job_status(self, get_current_job):
+        job_id = "published-job"
+        get_current_job.side_effect = lambda: fetch_job(job_id)
+        pubsub = redis_connection.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(JOB_STATUS_CHANNEL.format(job_id))
+
+        with patch.object(PostgreSQL, "run_query") as qr:
+            qr.return_value = ({"columns": [], "rows": []}, None)
+            result_id = execute_query("SELECT 1, 2", self.factory.data_source.id, {})
+
+            qr.side_effect = ValueError("broken")
+            execute_query("SELECT 1, 2", self.factory.data_source.id, {})
+
+        messages = []
+        for _ in range(10):
+            message = pubsub.get_message(timeout=0.1)
+            if message is not None:
+                messages.append(json_loads(message["data"]))
+        pubsub.close()
+
+        self.assertEqual([(m["id"], m["status"]) for m in messages], [(job_id, s) for s in (2, 3, 2, 4)])
+        self.assertEqual(messages[1]["query_result_id"], result_id)
+        self.assertEqual(messages[3]["error"], "broken")
+
     def test_success_scheduled(self, _):
         """
         Scheduled queries remember their latest results.
@@ -1,10 +1,22 @@
-from mock import ANY, call, patch
+from mock import ANY, Mock, patch
 
+from redash import redis_connection
 from redash.models import Query
 from redash.tasks.queries.maintenance import refresh_queries
+from redash.utils import json_loads
 from tests import BaseTestCase
 
-ENQUEUE_QUERY = "redash.tasks.queries.maintenance.enqueue_query"
+ENQUEUE_QUERIES = "redash.tasks.queries.maintenance.enqueue_queries"
+
+
+def enqueue_request(query, query_text, metadata=ANY):
+    return {
+        "query": query_text,
+        "data_source": query.data_source,
+        "user_id": query.user_id,
+        "scheduled_query": query,
+        "metadata": metadata,
+    }
 
 
 class TestRefreshQuery(BaseTestCase):
@@ -20,27 +32,21 @@ class TestRefreshQuery(BaseTestCase):
             options={"apply_auto_limit": True},
         )
         oq = staticmethod(lambda: [query1, query2])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(Query, "outdated_queries", oq):
+        with patch(ENQUEUE_QUERIES) as add_job_mock, patch.object(Query, "outdated_queries", oq):
             refresh_queries()
-            self.assertEqual(add_job_mock.call_count, 2)
-            add_job_mock.assert_has_calls(
+            add_job_mock.assert_called_once_with(
                 [
-                    call(
+                    enqueue_request(
+                        query1,
                         query1.query_text + " LIMIT 1000",
-                        query1.data_source,
-                        query1.user_id,
-                        scheduled_query=query1,
-                        metadata={"query_id": query1.id, "Username": query1.user.get_actual_user()},
+                        {"query_id": query1.id, "Username": query1.user.get_actual_user()},
                     ),
-                    call(
+                    enqueue_request(
+                        query2,
                         "select 42 LIMIT 1000",
-                        query2.data_source,
-                        query2.user_id,
-                        scheduled_query=query2,
-                        metadata={"query_id": query2.id, "Username": query2.user.get_actual_user()},
+                        {"query_id": query2.id, "Username": query2.user.get_actual_user()},
                     ),
-                ],
-                any_order=True,
+                ]
             )
 
     def test_enqueues_outdated_queries_for_non_sqlquery(self):
@@ -52,27 +58,21 @@ class TestRefreshQuery(BaseTestCase):
         query1 = self.factory.create_query(data_source=ds, options={"apply_auto_limit": True})
         query2 = self.factory.create_query(query_text="select 42;", data_source=ds, options={"apply_auto_limit": True})
         oq = staticmethod(lambda: [query1, query2])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(Query, "outdated_queries", oq):
+        with patch(ENQUEUE_QUERIES) as add_job_mock, patch.object(Query, "outdated_queries", oq):
             refresh_queries()
-            self.assertEqual(add_job_mock.call_count, 2)
-            add_job_mock.assert_has_calls(
+            add_job_mock.assert_called_once_with(
                 [
-                    call(
+                    enqueue_request(
+                        query1,
                         query1.query_text,
-                        query1.data_source,
-                        query1.user_id,
-                        scheduled_query=query1,
-                        metadata={"query_id": query1.id, "Username": query1.user.get_actual_user()},
+                        {"query_id": query1.id, "Username": query1.user.get_actual_user()},
                     ),
-                    call(
+                    enqueue_request(
+                        query2,
                         query2.query_text,
-                        query2.data_source,
-                        query2.user_id,
-                        scheduled_query=query2,
-                        metadata={"query_id": query2.id, "Username": query2.user.get_actual_user()},
+                        {"query_id": query2.id, "Username": query2.user.get_actual_user()},
                     ),
-                ],
-                any_order=True,
+                ]
             )
 
     def test_doesnt_enqueue_outdated_queries_for_paused_data_source_for_sqlquery(self):
@@ -84,21 +84,15 @@ class TestRefreshQuery(BaseTestCase):
         oq = staticmethod(lambda: [query])
         query.data_source.pause()
         with patch.object(Query, "outdated_queries", oq):
-            with patch(ENQUEUE_QUERY) as add_job_mock:
+            with patch(ENQUEUE_QUERIES) as add_job_mock:
                 refresh_queries()
                 add_job_mock.assert_not_called()
 
             query.data_source.resume()
 
-            with patch(ENQUEUE_QUERY) as add_job_mock:
+            with patch(ENQUEUE_QUERIES) as add_job_mock:
                 refresh_queries()
-                add_job_mock.assert_called_with(
-                    query.query_text + " LIMIT 1000",
-                    query.data_source,
-                    query.user_id,
-                    scheduled_query=query,
-                    metadata=ANY,
-                )
+                add_job_mock.assert_called_once_with([enqueue_request(query, query.query_text + " LIMIT 1000")])
 
     def test_doesnt_enqueue_outdated_queries_for_paused_data_source_for_non_sqlquery(
         self,
@@ -112,21 +106,15 @@ class TestRefreshQuery(BaseTestCase):
         oq = staticmethod(lambda: [query])
         query.data_source.pause()
         with patch.object(Query, "outdated_queries", oq):
-            with patch(ENQUEUE_QUERY) as add_job_mock:
+            with patch(ENQUEUE_QUERIES) as add_job_mock:
                 refresh_queries()
                 add_job_mock.assert_not_called()
 
             query.data_source.resume()
 
-            with patch(ENQUEUE_QUERY) as add_job_mock:
+            with patch(ENQUEUE_QUERIES) as add_job_mock:
                 refresh_queries()
-                add_job_mock.assert_called_with(
-                    query.query_text,
-                    query.data_source,
-                    query.user_id,
-                    scheduled_query=query,
-                    metadata=ANY,
-                )
+                add_job_mock.assert_called_once_with([enqueue_request(query, query.query_text)])
 
     def test_enqueues_parameterized_queries_for_sqlquery(self):
         """
@@ -148,15 +136,9 @@ class TestRefreshQuery(BaseTestCase):
             },
         )
         oq = staticmethod(lambda: [query])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(Query, "outdated_queries", oq):
+        with patch(ENQUEUE_QUERIES) as add_job_mock, patch.object(Query, "outdated_queries", oq):
             refresh_queries()
-            add_job_mock.assert_called_with(
-                "select 42 LIMIT 1000",
-                query.data_source,
-                query.user_id,
-                scheduled_query=query,
-                metadata=ANY,
-            )
+            add_job_mock.assert_called_once_with([enqueue_request(query, "select 42 LIMIT 1000")])
 
     def test_enqueues_parameterized_queries_for_non_sqlquery(self):
         """
@@ -180,15 +162,9 @@ class TestRefreshQuery(BaseTestCase):
             data_source=ds,
         )
         oq = staticmethod(lambda: [query])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(Query, "outdated_queries", oq):
+        with patch(ENQUEUE_QUERIES) as add_job_mock, patch.object(Query, "outdated_queries", oq):
             refresh_queries()
-            add_job_mock.assert_called_with(
-                "select 42",
-                query.data_source,
-                query.user_id,
-                scheduled_query=query,
-                metadata=ANY,
-            )
+            add_job_mock.assert_called_once_with([enqueue_request(query, "select 42")])
 
     def test_doesnt_enqueue_parameterized_queries_with_invalid_parameters(self):
         """
@@ -210,7 +186,7 @@ class TestRefreshQuery(BaseTestCase):
             },
         )
         oq = staticmethod(lambda: [query])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(Query, "outdated_queries", oq):
+        with patch(ENQUEUE_QUERIES) as add_job_mock, patch.object(Query, "outdated_queries", oq):
             refresh_queries()
             add_job_mock.assert_not_called()
 
@@ -239,6 +215,17 @@ class TestRefreshQuery(BaseTestCase):
         self.factory.create_query(id=100, data_source=None)
 
         oq = staticmethod(lambda: [query])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(Query, "outdated_queries", oq):
+        with patch(ENQUEUE_QUERIES) as add_job_mock, patch.object(Query, "outdated_queries", oq):
             refresh_queries()
             add_job_mock.assert_not_called()
+
+    def test_records_only_enqueued_queries_in_status(self):
+        query1 = self.factory.create_query()
+        query2 = self.factory.create_query(query_text="select 42;")
+        oq = staticmethod(lambda: [query1, query2])
+        with patch(ENQUEUE_QUERIES, return_value=[Mock(), None]), patch.object(Query, "outdated_queries", oq):
+            refresh_queries()
+
+        status = redis_connection.hgetall("redash:status")
+        self.assertEqual(status["outdated_queries_count"], "1")
+        self.assertEqual(json_loads(status["query_ids"]), [query1.id])
@@ -1,13 +1,44 @@
+import threading
+import time
+
 from mock import call, patch
-from rq import Connection
+from rq import Connection, get_current_job
 from rq.job import JobStatus
 
 from redash import rq_redis_connection
+from redash.query_runner.connection_pool import connection_pool
+from redash.query_runner.ssh_tunnel_pool import ssh_tunnel_pool
 from redash.tasks import Queue, Worker
 from redash.tasks.queries.execution import enqueue_query
+from redash.tasks.worker import RunningJob, ThreadedWorker
 from redash.worker import default_queues, job
 from tests import BaseTestCase
 
+barrier = threading.Barrier(3)
+release_stuck_job = threading.Event()
+
+
+def wait_for_others():
+    barrier.wait(timeout=10)
+
+
+def sleep_forever():
+    while True:
+        time.sleep(0.05)
+
+
+def cancel_and_sleep():
+    get_current_job().cancel()
+    sleep_forever()
+
+
+def ignore_interrupts():
+    while not release_stuck_job.is_set():
+        try:
+            time.sleep(0.05)
+        except BaseException:
+            pass
+
 
 @patch("statsd.StatsClient.incr")
 class TestWorkerMetrics(BaseTestCase):
@@ -97,3 +128,97 @@ class TestQueueMetrics(BaseTestCase):
 
         foo.delay()
         incr.assert_called_with("rq.jobs.created.default")
+
+
+class TestThreadedWorker(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.queue = Queue("default", connection=rq_redis_connection)
+
+    def tearDown(self):
+        self.queue.empty()
+        super().tearDown()
+
+    def work(self, **kwargs):
+        worker = ThreadedWorker([self.queue], connection=rq_redis_connection, job_monitoring_interval=1, **kwargs)
+        worker.work(burst=True)
+        return worker
+
+    def test_runs_jobs_concurrently(self):
+        barrier.reset()
+        jobs = [self.queue.enqueue(wait_for_others) for _ in range(3)]
+
+        self.work(concurrency=3)
+
+        self.assertEqual([job.get_status() for job in jobs], [JobStatus.FINISHED] * 3)
+
+    def test_stops_jobs_at_their_time_limit(self):
+        job = self.queue.enqueue(sleep_forever, job_timeout=1)
+
+        self.work()
+
+        self.assertEqual(job.get_status(), JobStatus.FAILED)
+        self.assertIn("JobTimeoutException", job.latest_result().exc_string)
+
+    def test_interrupts_cancelled_jobs(self):
+        job = self.queue.enqueue(cancel_and_sleep, job_timeout=30)
+
+        started = time.monotonic()
+        self.work()
+
+        self.assertLess(time.monotonic() - started, 10)
+        job.refresh()
+        self.assertTrue(job.is_cancelled)
+        self.assertIn("InterruptException", job.latest_result().exc_string)
+
+    def test_fails_jobs_that_ignore_their_time_limit(self):
+        release_stuck_job.clear()
+        self.addCleanup(release_stuck_job.set)
+        job = self.queue.enqueue(ignore_interrupts, job_timeout=1)
+
+        with patch.object(ThreadedWorker, "grace_period", 1):
+            worker = self.work()
+
+        self.assertEqual(job.get_status(), JobStatus.FAILED)
+        self.assertTrue(worker._stop_requested)
+
+        # The abandoned thread finishing the job later doesn't overwrite its status.
+        release_stuck_job.set()
+        for thread in threading.enumerate():
+            if thread.name == "job-{}".format(job.id):
+                thread.join(5)
+        self.assertEqual(job.get_status(), JobStatus.FAILED)
+
+    def test_applies_default_timeout_to_jobs_without_one(self):
+        worker = ThreadedWorker([self.queue], connection=rq_redis_connection)
+        job = self.queue.enqueue(sleep_forever)
+        job.timeout = None
+        running = RunningJob(job, self.queue, threading.current_thread())
+        running.started_at -= Queue.DEFAULT_TIMEOUT + worker.grace_period + 1
+        worker._running[job.id] = running
+
+        with patch.object(worker, "enforce_hard_limit") as enforce_hard_limit:
+            worker.monitor_jobs()
+
+        enforce_hard_limit.assert_called_once_with(running, Queue.DEFAULT_TIMEOUT)
+
+    @patch("statsd.StatsClient.incr")
+    def test_executes_queries(self, incr):
+        query = self.factory.create_query()
+        self.queue = Queue("queries", connection=rq_redis_connection)
+
+        with Connection(rq_redis_connection):
+            enqueue_query(query.query_text, query.data_source, query.user_id, False, None, {"query_id": query.id})
+        self.work()
+
+        incr.assert_has_calls([call("rq.jobs.started.queries"), call("rq.jobs.running.queries", -1, 1)])
+        self.assertNotIn(call("rq.jobs.failed.queries"), incr.call_args_list)
+
+    def test_sweeps_idle_connections_while_monitoring(self):
+        worker = ThreadedWorker([self.queue], connection=rq_redis_connection)
+
+        with patch.object(connection_pool, "sweep") as sweep, patch.object(ssh_tunnel_pool, "sweep") as sweep_tunnels:
+            worker.monitor_jobs()
+
+        sweep.assert_called_once_with()
+        sweep_tunnels.assert_called_once_with()
@@ -11,7 +11,7 @@ from flask import request
 from mock import Mock, patch
 from sqlalchemy.orm.exc import NoResultFound
 
-from redash import models, settings
+from redash import models, settings, statsd_client
 from redash.authentication import (
     api_key_load_user_from_request,
     get_login_url,
@@ -160,6 +160,111 @@ class TestHMACAuthentication(BaseTestCase):
             self.assertEqual(user.id, hmac_load_user_from_request(request).id)
 
 
+class TestPrincipalCache(BaseTestCase):
+    def setUp(self):
+        super(TestPrincipalCache, self).setUp()
+        self.query = self.factory.create_query(api_key="query_key")
+        self.user = self.factory.create_user(api_key="user_key")
+        models.db.session.flush()
+        self.query_url = "/{}/api/queries/{}".format(self.factory.org.slug, self.query.id)
+        self.queries_url = "/{}/api/queries".format(self.factory.org.slug)
+
+    def load_user(self, url, api_key):
+        with self.app.test_client() as c:
+            c.get(url, query_string={"api_key": api_key})
+            return api_key_load_user_from_request(request)
+
+    def test_caches_user_api_key(self):
+        self.load_user(self.queries_url, "user_key")
+
+        with patch.object(models.User, "get_by_api_key_and_org") as get_by_api_key_and_org, patch.object(
+            statsd_client, "incr"
+        ) as incr:
+            user = self.load_user(self.queries_url, "user_key")
+
+        get_by_api_key_and_org.assert_not_called()
+        incr.assert_called_with("auth.principal_cache.hit")
+        self.assertIs(user, self.user)
+        self.assertEqual(user.group_ids, self.user.group_ids)
+
+    def test_restores_user_without_querying_database(self):
+        self.load_user(self.queries_url, "user_key")
+        models.db.session.expunge_all()
+
+        with patch.object(models.User, "get_by_api_key_and_org") as get_by_api_key_and_org:
+            user = self.load_user(self.queries_url, "user_key")
+
+        get_by_api_key_and_org.assert_not_called()
+        self.assertEqual(user.id, self.user.id)
+        self.assertEqual(user.email, self.user.email)
+        self.assertFalse(user.is_disabled)
+        # Columns that are not cached are loaded on access.
+        self.assertIsNotNone(user.created_at)
+
+    def test_regenerating_user_api_key_invalidates_cache(self):
+        self.load_user(self.queries_url, "user_key")
+
+        self.user.regenerate_api_key()
+        models.db.session.flush()
+
+        self.assertIsNone(self.load_user(self.queries_url, "user_key"))
+        self.assertEqual(self.user.id, self.load_user(self.queries_url, self.user.api_key).id)
+
+    def test_disabling_user_invalidates_cache(self):
+        self.load_user(self.queries_url, "user_key")
+
+        self.user.disable()
+        models.db.session.flush()
+
+        self.assertIsNone(self.load_user(self.queries_url, "user_key"))
+
+    def test_query_api_key_is_only_valid_for_its_query(self):
+        self.assertIsNotNone(self.load_user(self.query_url, "query_key"))
+
+        other_query = self.factory.create_query()
+        models.db.session.flush()
+        other_url = "/{}/api/queries/{}".format(self.factory.org.slug, other_query.id)
+
+        self.assertIsNone(self.load_user(other_url, "query_key"))
+        self.assertIsNotNone(self.load_user(self.query_url, "query_key"))
+
+    def test_data_source_group_changes_invalidate_cache(self):
+        user = self.load_user(self.query_url, "query_key")
+        self.assertEqual(user.group_ids, list(self.query.groups.keys()))
+
+        group = self.factory.create_group()
+        self.query.data_source.add_group(group)
+        models.db.session.flush()
+
+        user = self.load_user(self.query_url, "query_key")
+        self.assertIn(group.id, user.group_ids)
+
+    def test_caches_hmac_query_principal(self):
+        expires = time.time() + 1800
+        path = self.query_url
+        signature = sign(self.query.api_key, path, expires)
+
+        for _ in range(2):
+            with self.app.test_client() as c:
+                c.get(path, query_string={"signature": signature, "expires": expires})
+                self.assertIsNotNone(hmac_load_user_from_request(request))
+
+        with patch.object(models.Query, "query") as query:
+            with self.app.test_client() as c:
+                c.get(path, query_string={"signature": signature, "expires": expires})
+                user = hmac_load_user_from_request(request)
+
+        query.filter.assert_not_called()
+        self.assertEqual(user.group_ids, list(self.query.groups.keys()))
+
+        self.query.regenerate_api_key()
+        models.db.session.flush()
+
+        with self.app.test_client() as c:
+            c.get(path, query_string={"signature": signature, "expires": expires})
+            self.assertIsNone(hmac_load_user_from_request(request))
+
+
 class TestSessionAuthentication(BaseTestCase):
     def test_prefers_api_key_over_session_user_id(self):
         user = self.factory.create_user()
@@ -4,7 +4,7 @@ from unittest import TestCase
 
 from dateutil.parser import parse as date_parse
 
-from redash import models
+from redash import models, redis_connection
 from redash.models import db
 from redash.utils import gen_query_hash, utcnow
 from tests import BaseTestCase
@@ -325,6 +325,58 @@ class QueryOutdatedQueriesTest(BaseTestCase):
         queries = models.Query.outdated_queries()
         self.assertNotIn(query, queries)
 
+    def test_fresh_queries_are_indexed_by_next_due_time(self):
+        query = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(query, minutes=30)
+
+        self.assertEqual(list(models.Query.outdated_queries()), [])
+
+        due = redis_connection.zscore(models.scheduled_queries_index.KEY_NAME, query.id)
+        expected = query.latest_query_data.retrieved_at + datetime.timedelta(hours=1)
+        self.assertAlmostEqual(expected.timestamp(), due, places=3)
+        self.assertEqual(models.scheduled_queries_index.due(utcnow()), [])
+
+    def test_outdated_queries_stay_due(self):
+        query = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(query, hours=2)
+
+        self.assertEqual(list(models.Query.outdated_queries()), [query])
+        self.assertEqual(list(models.Query.outdated_queries()), [query])
+
+    def test_schedule_change_marks_query_due(self):
+        query = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(query, minutes=30)
+        self.assertEqual(list(models.Query.outdated_queries()), [])
+
+        query.schedule = self.schedule(interval="600")
+        db.session.commit()
+
+        self.assertEqual(list(models.Query.outdated_queries()), [query])
+
+    def test_unscheduled_queries_are_removed_from_index(self):
+        query = self.create_scheduled_query(interval="3600", disabled=True)
+
+        models.Query.outdated_queries()
+
+        self.assertIsNone(redis_connection.zscore(models.scheduled_queries_index.KEY_NAME, query.id))
+
+    def test_only_due_queries_are_evaluated(self):
+        query = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(query, hours=2)
+        db.session.flush()
+        models.scheduled_queries_index.rebuild([])
+
+        self.assertEqual(list(models.Query.outdated_queries()), [])
+
+    def test_index_is_rebuilt_when_expired(self):
+        query = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(query, hours=2)
+        db.session.flush()
+        redis_connection.delete(models.scheduled_queries_index.KEY_NAME)
+        redis_connection.delete(models.scheduled_queries_index.REBUILT_KEY_NAME)
+
+        self.assertEqual(list(models.Query.outdated_queries()), [query])
+
 
 class QueryArchiveTest(BaseTestCase):
     def test_archive_query_sets_flag(self):
@@ -576,6 +628,20 @@ class TestEvents(BaseTestCase):
 
         self.assertDictEqual(event.additional_properties, additional_properties)
 
+    def test_records_many_events_at_once(self):
+        raw_event, user, created_at = self.raw_event()
+        other_event = dict(raw_event, action="edit", extra="value")
+
+        forwarded = models.Event.record_many([raw_event, other_event])
+
+        events = models.Event.query.order_by(models.Event.id).all()
+        self.assertEqual([e.action for e in events], ["view", "edit"])
+        self.assertEqual(events[0].user, user)
+        self.assertEqual(events[0].created_at.replace(tzinfo=None), created_at)
+        self.assertDictEqual(events[1].additional_properties, {"extra": "value"})
+        self.assertEqual([e["action"] for e in forwarded], ["view", "edit"])
+        self.assertEqual(forwarded[0]["created_at"], events[0].created_at.isoformat())
+
 
 def _set_up_dashboard_test(d):
     d.g1 = d.factory.create_group(name="First", permissions=["create", "view"])
@@ -0,0 +1,72 @@
+import datetime
+from unittest import TestCase
+
+from redash.utils import columnar, json_dumps, json_loads
+
+
+def _result(rows):
+    names = list(rows[0].keys()) if rows else ["a"]
+    return {"columns": [{"name": n, "friendly_name": n, "type": None} for n in names], "rows": rows}
+
+
+class TestColumnarEncoding(TestCase):
+    def test_round_trips_typed_columns(self):
+        data = _result(
+            [
+                {"i": 1, "f": 1.5, "b": True, "s": "x", "n": None},
+                {"i": None, "f": None, "b": None, "s": None, "n": None},
+                {"i": -(2**63), "f": -2.25, "b": False, "s": "ü", "n": None},
+            ]
+        )
+        encoded = columnar.encode(data)
+
+        self.assertTrue(columnar.is_columnar(encoded))
+        self.assertEqual(data, columnar.decode(encoded))
+
+        result = columnar.ColumnarResult(encoded)
+        self.assertEqual("int64", result.column_kind("i"))
+        self.assertEqual("float64", result.column_kind("f"))
+        self.assertEqual("bool", result.column_kind("b"))
+        self.assertEqual("json", result.column_kind("s"))
+
+    def test_matches_json_for_values_json_would_convert(self):
+        now = datetime.datetime(2024, 1, 2, 3, 4, 5)
+        data = _result([{"d": now, "f": float("nan"), "m": 1}, {"d": None, "f": float("inf"), "m": 1.0}])
+
+        self.assertEqual(json_loads(json_dumps(data)), columnar.decode(columnar.encode(data)))
+
+    def test_keeps_extra_keys(self):
+        data = _result([{"a": 1}])
+        data["metadata"] = {"data_scanned": 10}
+
+        self.assertEqual(data, columnar.decode(columnar.encode(data)))
+
+    def test_reads_single_column_without_materializing_rows(self):
+        data = _result([{"a": i, "b": str(i)} for i in range(100)])
+        result = columnar.ColumnarResult(columnar.encode(data))
+
+        self.assertEqual(100, result.row_count)
+        self.assertEqual(list(range(100)), result.column("a"))
+        self.assertNotIn("b", result._decoded)
+
+    def test_returns_none_when_rows_do_not_match_columns(self):
+        self.assertIsNone(columnar.encode({"columns": [{"name": "a"}], "rows": [{"a": 1}, {"b": 2}]}))
+        self.assertIsNone(columnar.encode({"columns": [{"name": "a"}, {"name": "a"}], "rows": []}))
+        self.assertIsNone(columnar.encode({"columns": {}, "rows": []}))
+        self.assertIsNone(columnar.encode({}))
+
+    def test_handles_empty_results(self):
+        data = _result([])
+
+        self.assertEqual(data, columnar.decode(columnar.encode(data)))
+
+    def test_rejects_unknown_versions(self):
+        encoded = columnar.encode(_result([{"a": 1}])).replace(columnar.PREFIX, "RDC99:", 1)
+
+        self.assertTrue(columnar.is_columnar(encoded))
+        with self.assertRaises(columnar.UnsupportedVersionError):
+            columnar.decode(encoded)
+
+    def test_legacy_json_is_not_columnar(self):
+        self.assertFalse(columnar.is_columnar(json_dumps(_result([{"a": 1}]))))
+        self.assertFalse(columnar.is_columnar(None))